@@ -0,0 +1,89 @@
+"""
+Benchmark of TokenChunker (streamlit/helpers/chunker.py) against the
+RecursiveCharacterTextSplitter configuration used by streamlit/pages/Upload.py.
+
+Splits langchain/docs/mobydick.txt with both splitters and reports the time,
+throughput, number of chunks and tokens per chunk, then chunks all books in
+langchain/docs serially and in parallel with TokenChunker.
+
+Usage: python benchmarks/bench_chunker.py [--chunk-size 400] [--chunk-overlap 20] [--chars N] [--output results.json]
+"""
+import argparse
+import json
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "streamlit" / "helpers"))
+
+from chunker import TokenChunker
+from embeddings import tiktoken_len
+
+DOCS = ROOT / "langchain" / "docs"
+
+
+def describe(name, chunks, elapsed, text):
+    lengths = [tiktoken_len(chunk) for chunk in chunks]
+    result = {
+        "seconds": elapsed,
+        "mb_per_s": len(text.encode("utf-8")) / elapsed / 1e6,
+        "chunks": len(chunks),
+        "mean_tokens": sum(lengths) / len(lengths),
+        "max_tokens": max(lengths),
+        "min_tokens": min(lengths),
+    }
+    print(f"{name:36} {elapsed:8.2f} s {result['mb_per_s']:7.3f} MB/s {len(chunks):6} chunks, tokens/chunk mean {result['mean_tokens']:.0f} max {result['max_tokens']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=400)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    parser.add_argument("--chars", type=int, default=0, help="only use the first N characters of mobydick.txt")
+    parser.add_argument("--skip-recursive", action="store_true", help="do not run the (slow) RecursiveCharacterTextSplitter")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    text = (DOCS / "mobydick.txt").read_text(encoding="utf-8")
+    if args.chars:
+        text = text[:args.chars]
+    results = {}
+
+    if not args.skip_recursive:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            length_function=tiktoken_len,
+            separators=['\n\n', '\n', ' ', '']
+        )
+        start = time.perf_counter()
+        chunks = splitter.split_text(text)
+        results["recursive_character"] = describe("RecursiveCharacterTextSplitter", chunks, time.perf_counter() - start, text)
+
+    chunker = TokenChunker(args.chunk_size, args.chunk_overlap)
+    start = time.perf_counter()
+    chunks = chunker.split_text(text)
+    results["token_chunker"] = describe("TokenChunker", chunks, time.perf_counter() - start, text)
+
+    # all books, serial and in parallel
+    texts = [path.read_text(encoding="utf-8") for path in sorted(DOCS.glob("*.txt"))]
+    total_mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    for name, processes in (("serial", 1), ("parallel", None)):
+        start = time.perf_counter()
+        chunker.split_texts(texts, processes=processes)
+        elapsed = time.perf_counter() - start
+        results[f"token_chunker_{name}"] = {"seconds": elapsed, "mb_per_s": total_mb / elapsed, "documents": len(texts)}
+        label = f"TokenChunker {name} (all books)"
+        print(f"{label:36} {elapsed:8.2f} s {total_mb / elapsed:7.3f} MB/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
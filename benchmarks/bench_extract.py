@@ -0,0 +1,173 @@
+"""
+Benchmark of the HTML extraction backends in streamlit/helpers/extract.py.
+
+Runs every backend over the saved blog pages in benchmarks/fixtures and
+reports pages per second and MB per second, and whether the extracted text
+matches the bs4 backend. The fixtures are real posts of the blog, saved with
+--save-feed N (the first N posts of the feed) or --save URL and committed
+with their sources.json. --generate N adds N WordPress-like pages built from
+the books in langchain/docs (in benchmarks/fixtures/generated, not
+committed) to scale the corpus up; they are reported as a separate set.
+
+Usage: python benchmarks/bench_extract.py [--save-feed N] [--save URL ...] [--generate N] [--repeat N] [--output results.json]
+"""
+import argparse
+import html
+import json
+import os
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "streamlit" / "helpers"))
+
+from extract import BACKENDS, extract_text
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / "fixtures"
+GENERATED = FIXTURES / "generated"
+DOCS = ROOT / "langchain" / "docs"
+FEED_URL = "https://blog.baeke.info/feed/"
+
+
+def generate_fixtures(folder, pages=20, paragraphs=40):
+    # build pages with the structure of a WordPress post: a large header and
+    # navigation, the article in div.entry-content, then comments and footer
+    folder.mkdir(parents=True, exist_ok=True)
+    text = "\n".join(path.read_text(encoding="utf-8") for path in sorted(DOCS.glob("*.txt")))
+    blocks = [block.strip() for block in text.split("\n\n") if block.strip()]
+
+    nav = "".join(f'<li class="menu-item"><a href="/category/{i}/">Category {i}</a></li>' for i in range(60))
+    for p in range(pages):
+        article = "".join(
+            f"<p>{html.escape(block)}</p>" if i % 7 else f"<h2>{html.escape(block[:60])}</h2><pre><code>{html.escape(block)}</code></pre>"
+            for i, block in enumerate(blocks[p * paragraphs:(p + 1) * paragraphs])
+        )
+        comments = "".join(
+            f'<li class="comment"><div class="comment-content"><p>{html.escape(block)}</p></div></li>'
+            for block in blocks[(p + 1) * paragraphs:(p + 1) * paragraphs + 10]
+        )
+        page = f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8"><title>Post {p}</title>
+<link rel="stylesheet" href="/style.css"><script>var config = {{"page": {p}}};</script></head>
+<body class="post-template-default single single-post">
+<header id="masthead" class="site-header"><nav class="main-navigation"><ul>{nav}</ul></nav></header>
+<main id="main" class="site-main"><article id="post-{p}" class="post type-post">
+<header class="entry-header"><h1 class="entry-title">Post {p}</h1></header>
+<div class="entry-content">{article}</div>
+<footer class="entry-footer"><span class="cat-links">Posted in <a href="/category/1/">Category</a></span></footer>
+</article>
+<div id="comments" class="comments-area"><ol class="comment-list">{comments}</ol></div>
+</main>
+<footer id="colophon" class="site-footer"><ul>{nav}</ul></footer>
+</body></html>"""
+        (folder / f"generated-{p:03d}.html").write_text(page, encoding="utf-8")
+
+
+def save_pages(folder, urls):
+    import requests
+
+    folder.mkdir(parents=True, exist_ok=True)
+    sources_path = folder / "sources.json"
+    sources = json.loads(sources_path.read_text(encoding="utf-8")) if sources_path.exists() else {}
+    for url in urls:
+        name = url.rstrip("/").rsplit("/", 1)[-1] or "index"
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        (folder / f"{name}.html").write_text(r.text, encoding="utf-8")
+        sources[f"{name}.html"] = {"url": url, "saved": time.strftime("%Y-%m-%d")}
+        print("Saved", url)
+    sources_path.write_text(json.dumps(sources, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def feed_urls(count):
+    import feedparser
+
+    return [entry.link for entry in feedparser.parse(FEED_URL).entries[:count]]
+
+
+def real_pages(folder=FIXTURES):
+    # saved blog posts; generated pages of older runs are left out
+    return [path.read_text(encoding="utf-8") for path in sorted(folder.glob("*.html")) if not path.name.startswith("generated-")]
+
+
+def generated_pages(count, folder=GENERATED):
+    if count <= 0:
+        return []
+    if len(list(folder.glob("generated-*.html"))) < count:
+        generate_fixtures(folder, pages=count)
+    return [path.read_text(encoding="utf-8") for path in sorted(folder.glob("generated-*.html"))[:count]]
+
+
+def load_page_sets(folder, generate):
+    """
+    Returns {"real": pages, "generated": pages} without empty sets. Exits
+    when there are no real pages and no generated ones were asked for.
+    """
+    sets = {"real": real_pages(folder), "generated": generated_pages(generate)}
+    sets = {name: pages for name, pages in sets.items() if pages}
+    if "real" not in sets:
+        print(f"No saved blog pages in {folder}. Save some with --save-feed 10 (and commit them), "
+              "or pass --generate N to measure generated pages only.", file=sys.stderr)
+        if not sets:
+            sys.exit(2)
+    return sets
+
+
+def run(pages, backend, repeat, tag, class_name):
+    total_bytes = sum(len(page.encode("utf-8")) for page in pages)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        texts = [extract_text(page, tag, class_name, backend) for page in pages]
+    elapsed = time.perf_counter() - start
+    return texts, {
+        "pages_per_s": len(pages) * repeat / elapsed,
+        "mb_per_s": total_bytes * repeat / elapsed / 1e6,
+        "seconds": elapsed,
+    }
+
+
+def normalized(text):
+    return " ".join(text.split()) if text is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=str(FIXTURES), help="folder with saved .html pages")
+    parser.add_argument("--save", nargs="*", default=[], help="download these pages into the fixture folder first")
+    parser.add_argument("--save-feed", type=int, default=0, metavar="N", help="download the first N posts of the blog feed first")
+    parser.add_argument("--generate", type=int, default=0, metavar="N", help="also measure N generated pages, as a separate set")
+    parser.add_argument("--backends", nargs="*", default=list(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    folder = pathlib.Path(args.fixtures)
+    urls = args.save + (feed_urls(args.save_feed) if args.save_feed else [])
+    if urls:
+        save_pages(folder, urls)
+
+    results = {}
+    for set_name, pages in load_page_sets(folder, args.generate).items():
+        print(f"{set_name}: {len(pages)} pages, {sum(len(page) for page in pages) / 1e6:.2f} MB")
+        for mode, tag, class_name in (("article", "div", "entry-content"), ("page", None, None)):
+            reference = None
+            for backend in args.backends:
+                try:
+                    texts, stats = run(pages, backend, args.repeat, tag, class_name)
+                except ImportError as e:
+                    print(f"{mode:8} {backend:8} skipped ({e})")
+                    continue
+                if reference is None:
+                    reference = [normalized(text) for text in texts]
+                stats["matches_reference"] = sum(normalized(text) == ref for text, ref in zip(texts, reference)) / len(pages)
+                results.setdefault(set_name, {}).setdefault(mode, {})[backend] = stats
+                print(f"{mode:8} {backend:8} {stats['pages_per_s']:9.1f} pages/s {stats['mb_per_s']:7.2f} MB/s  same text as {args.backends[0]}: {stats['matches_reference']:.0%}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
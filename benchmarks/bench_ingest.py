@@ -0,0 +1,274 @@
+"""
+Throughput benchmark of the ingestion path: extraction, chunking, embedding
+and vector store writes.
+
+The corpus is the saved blog pages in benchmarks/fixtures, plus --generate N
+generated pages to scale it up (see bench_extract.py), whose articles are
+extracted first, plus the books in langchain/docs as plain text. Every case chunks the
+corpus with one splitter configuration, embeds the chunks with one provider
+and writes them to a LocalStore in a temporary folder. The stages run one
+after the other so each gets its own time; the Ingestion pipeline overlaps
+them, so its wall time is lower than the sum.
+
+Splitters:
+  upload             TokenChunker(400, 20), as used by streamlit/pages/Upload.py
+  langchain          CharacterTextSplitter(400, 20), as in langchain/app.py
+  langchain-windows  CharacterTextSplitter(1000, 0), as in langchain/windows/app.py
+
+Providers:
+  hash    deterministic vectors computed in process, no HTTP
+  fake    create_embeddings against benchmarks/fake_services.py (started in
+          process unless --api-base points at a running one), cache disabled
+  cached  as fake, but through a warm embedding cache in a temporary folder
+
+Every case runs in a fresh process so its peak RSS is its own. Results
+(docs/s, chunks/s, tokens/s, peak RSS and seconds per stage) are printed and
+written as JSON with --output; --baseline compares against an earlier file
+and exits with status 1 when a case got slower than --tolerance allows.
+
+Usage: python benchmarks/bench_ingest.py [--splitters ...] [--providers ...] [--repeat N]
+       [--output results.json] [--baseline old.json] [--tolerance 0.1]
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "streamlit" / "helpers"))
+sys.path.append(str(ROOT / "benchmarks"))
+
+from bench_extract import FIXTURES, load_page_sets
+
+DOCS = ROOT / "langchain" / "docs"
+SPLITTERS = ("upload", "langchain", "langchain-windows")
+PROVIDERS = ("hash", "fake", "cached")
+UPSERT_BATCH = 100
+
+
+def make_splitter(name):
+    # returns a function that splits one text into chunks
+    if name == "upload":
+        from chunker import TokenChunker
+
+        return TokenChunker(400, 20).split_text
+    from langchain.text_splitter import CharacterTextSplitter
+
+    # it warns on the root logger for every chunk over the size, which
+    # would flood the report
+    logging.getLogger().setLevel(logging.ERROR)
+    if name == "langchain":
+        return CharacterTextSplitter(chunk_size=400, chunk_overlap=20).split_text
+    if name == "langchain-windows":
+        return CharacterTextSplitter(chunk_size=1000, chunk_overlap=0).split_text
+    raise ValueError(f"Unknown splitter: {name}")
+
+
+def make_embedder(provider, dimension, cache_dir):
+    # returns a function that embeds a list of texts
+    if provider == "hash":
+        from fake_services import hash_vector
+
+        return lambda texts: [hash_vector(text, dimension) for text in texts]
+
+    import embedding_cache
+    from embeddings import create_embeddings
+
+    # the cache of the case, never the shared one in the home folder
+    if provider == "cached":
+        os.environ["EMBEDDING_CACHE"] = "1"
+        embedding_cache._default_cache = embedding_cache.EmbeddingCache(str(cache_dir))
+    else:
+        os.environ["EMBEDDING_CACHE"] = "0"
+    return create_embeddings
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(splitter_name, provider, fixtures, generate, api_base, dimension):
+    """
+    Runs one case in the current (fresh) process and returns its stats.
+    """
+    import openai
+    from embeddings import tiktoken_len
+    from extract import extract_article
+    from vector_store import LocalStore
+
+    if api_base:
+        openai.api_base = api_base
+        openai.api_key = "fake"
+
+    workdir = tempfile.mkdtemp(prefix="bench-ingest-")
+    try:
+        split = make_splitter(splitter_name)
+        embed = make_embedder(provider, dimension, pathlib.Path(workdir) / "cache")
+        pages = [page for pages in load_page_sets(pathlib.Path(fixtures), generate).values() for page in pages]
+        books = [path.read_text(encoding="utf-8") for path in sorted(DOCS.glob("*.txt"))]
+        stages = {}
+
+        start = time.perf_counter()
+        texts = [extract_article(page) for page in pages] + books
+        stages["extract"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        documents = [split(text) for text in texts]
+        stages["chunk"] = time.perf_counter() - start
+        chunks = [chunk for document in documents for chunk in document]
+
+        if provider == "cached":
+            # warm the cache; the measured run is served from it
+            embed(chunks)
+
+        start = time.perf_counter()
+        vectors = embed(chunks)
+        stages["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = LocalStore("bench", path=str(pathlib.Path(workdir) / "store"))
+        store.ensure_index(len(vectors[0]))
+        batch = []
+        n = 0
+        for d, document in enumerate(documents):
+            for c, chunk in enumerate(document):
+                batch.append((f"{d}-{c}", vectors[n], {"url": f"doc-{d}", "chunk-id": c, "text": chunk}))
+                n += 1
+                if len(batch) == UPSERT_BATCH:
+                    store.upsert(batch)
+                    batch = []
+        if batch:
+            store.upsert(batch)
+        store.flush()
+        stages["store"] = time.perf_counter() - start
+
+        total = sum(stages.values())
+        tokens = sum(tiktoken_len(chunk) for chunk in chunks)
+        return {
+            "docs": len(texts),
+            "chunks": len(chunks),
+            "tokens": tokens,
+            "seconds": total,
+            "docs_per_s": len(texts) / total,
+            "chunks_per_s": len(chunks) / total,
+            "tokens_per_s": tokens / total,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stages,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def start_fake(dimension):
+    # the fake services on a free port, in a thread of this process
+    from werkzeug.serving import make_server
+    from fake_services import FakeServices
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, FakeServices(dimension=dimension).app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change in docs/s per case against baseline and returns the
+    cases that got slower by more than tolerance.
+    """
+    regressions = []
+    for case, stats in results.items():
+        old = baseline.get("results", {}).get(case)
+        if old is None:
+            continue
+        change = stats["docs_per_s"] / old["docs_per_s"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(case)
+            flag = "  REGRESSION"
+        print(f"{case:32} {old['docs_per_s']:9.2f} -> {stats['docs_per_s']:9.2f} docs/s ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=str(FIXTURES), help="folder with saved .html pages")
+    parser.add_argument("--generate", type=int, default=0, metavar="N", help="add N generated pages to the corpus")
+    parser.add_argument("--splitters", nargs="*", default=list(SPLITTERS), choices=SPLITTERS)
+    parser.add_argument("--providers", nargs="*", default=list(PROVIDERS), choices=PROVIDERS)
+    parser.add_argument("--api-base", help="OpenAI API base of a running fake service for the fake and cached providers")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case; the fastest is reported")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed drop in docs/s against the baseline")
+    args = parser.parse_args()
+
+    page_sets = load_page_sets(pathlib.Path(args.fixtures), args.generate)
+    print(", ".join(f"{len(pages)} {name} pages" for name, pages in page_sets.items()))
+
+    api_base = args.api_base
+    if api_base is None and set(args.providers) & {"fake", "cached"}:
+        api_base = start_fake(args.dimension)
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for splitter_name in args.splitters:
+        for provider in args.providers:
+            case = f"{splitter_name}/{provider}"
+            runs = []
+            for _ in range(args.repeat):
+                with context.Pool(1) as pool:
+                    try:
+                        runs.append(pool.apply(run_case, (splitter_name, provider, args.fixtures, args.generate, api_base, args.dimension)))
+                    except ImportError as e:
+                        print(f"{case:32} skipped ({e})")
+                        break
+            if not runs:
+                continue
+            stats = min(runs, key=lambda run: run["seconds"])
+            results[case] = stats
+            stages = " ".join(f"{name} {seconds:.2f}s" for name, seconds in stats["stages"].items())
+            print(f"{case:32} {stats['docs_per_s']:8.2f} docs/s {stats['chunks_per_s']:9.1f} chunks/s {stats['tokens_per_s']:10.0f} tokens/s "
+                  f"{stats['peak_rss_mb']:7.1f} MB  ({stages})")
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
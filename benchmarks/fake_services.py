@@ -0,0 +1,622 @@
+"""
+Local stand-in for the OpenAI and Pinecone APIs, for load tests and
+benchmarks that must not need (or pay for) real accounts.
+
+Serves the OpenAI embeddings, chat completions (streamed or not) and
+completions endpoints, the Pinecone controller (list, create, describe and
+delete indexes, whoami) and the Pinecone data plane (upsert, query, fetch,
+update, delete, describe_index_stats) of every index. Embeddings are
+deterministic: the vector of a text is seeded by its hash, so the same text
+always gets the same unit vector and runs can be compared. Indexes live in
+memory and are searched exactly.
+
+Every response can be delayed and can fail on purpose. Requests are grouped
+in "embeddings", "completions" and "pinecone"; each group has a latency (ms),
+a jitter (ms, uniform or exponential, the latter for a long tail), the
+fraction of requests answered with 429 and the fraction answered with 500.
+Settings can be changed while the server runs with POST /_fake/config and
+GET /_fake/stats returns the number of requests and injected faults.
+
+Point the clients at it with:
+
+    OPENAI_API_BASE=http://127.0.0.1:8800/v1
+    PINECONE_CONTROLLER_HOST=http://127.0.0.1:8800
+    PINECONE_INDEX_HOST=http://127.0.0.1:8800/index/{index_name}
+    PINECONE_API_KEY=fake PINECONE_ENVIRONMENT=fake OPENAI_API_KEY=fake
+
+Usage: python benchmarks/fake_services.py [--port 8800] [--latency 20] [--jitter 10]
+       [--rate-limit 0.01] [--errors 0.001] [--set completions:latency=500,jitter=300]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import numpy as np
+from flask import Flask, Response, jsonify, request
+
+GROUPS = ("embeddings", "completions", "pinecone")
+DEFAULT_DIMENSION = 1536
+
+WORDS = ("the vector index stores embeddings of every chunk so that a query can be answered "
+         "from the most similar passages of the blog and the model only sees relevant context").split()
+
+
+class Faults:
+    """
+    Latency and error injection settings of one group of endpoints.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, distribution="exponential", rate_limit=0.0, errors=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.rate_limit = rate_limit
+        self.errors = errors
+
+    def update(self, settings):
+        for key, value in settings.items():
+            if key not in vars(self):
+                raise ValueError(f"Unknown setting: {key}")
+            setattr(self, key, value if key == "distribution" else float(value))
+
+    def delay(self, rng):
+        # seconds to wait before answering
+        if self.jitter <= 0:
+            extra = 0.0
+        elif self.distribution == "uniform":
+            extra = rng.uniform(0, self.jitter)
+        else:
+            extra = rng.expovariate(1.0 / self.jitter)
+        return (self.latency + extra) / 1000.0
+
+    def fault(self, rng):
+        # status code of an injected failure, or None
+        draw = rng.random()
+        if draw < self.rate_limit:
+            return 429
+        if draw < self.rate_limit + self.errors:
+            return 500
+        return None
+
+
+def hash_vector(text, dimension=DEFAULT_DIMENSION):
+    """
+    Deterministic unit vector of text, like an embedding.
+    """
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def count_tokens(text):
+    # rough count; good enough for the usage fields
+    return max(1, len(text) // 4)
+
+
+def fake_answer(prompt, max_tokens):
+    # deterministic answer of at most max_tokens words
+    rng = random.Random(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest())
+    return [rng.choice(WORDS) for _ in range(max(1, min(max_tokens, 60)))]
+
+
+def matches_filter(metadata, condition):
+    # Pinecone metadata filter: {field: value}, {field: {"$op": value}}, $and, $or
+    for key, value in condition.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, c) for c in value):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, c) for c in value):
+                return False
+        else:
+            ops = value if isinstance(value, dict) else {"$eq": value}
+            field = metadata.get(key)
+            for op, operand in ops.items():
+                if op == "$eq" and not (field == operand or (isinstance(field, list) and operand in field)):
+                    return False
+                if op == "$ne" and field == operand:
+                    return False
+                if op == "$in" and not (field in operand or (isinstance(field, list) and set(field) & set(operand))):
+                    return False
+                if op == "$nin" and field in operand:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if field is None:
+                        return False
+                    if op == "$gt" and not field > operand or op == "$gte" and not field >= operand:
+                        return False
+                    if op == "$lt" and not field < operand or op == "$lte" and not field <= operand:
+                        return False
+    return True
+
+
+class FakeIndex:
+    """
+    In-memory Pinecone index with exact search. Vectors are rows of a matrix
+    that doubles in size when full; deleted rows are reused.
+    """
+
+    def __init__(self, name, dimension, metric="cosine", metadata_config=None):
+        self.name = name
+        self.dimension = dimension
+        self.metric = metric
+        self.metadata_config = metadata_config
+        self.lock = threading.Lock()
+        self.matrix = np.zeros((1024, dimension), dtype=np.float32)
+        self.norms = np.zeros(1024, dtype=np.float32)
+        self.alive = np.zeros(1024, dtype=bool)
+        self.ids = [None] * 1024
+        self.metadata = [None] * 1024
+        self.rows = {}
+        self.free = list(range(1023, -1, -1))
+
+    def _grow(self):
+        size = len(self.alive)
+        self.matrix = np.vstack([self.matrix, np.zeros_like(self.matrix)])
+        self.norms = np.concatenate([self.norms, np.zeros(size, dtype=np.float32)])
+        self.alive = np.concatenate([self.alive, np.zeros(size, dtype=bool)])
+        self.ids.extend([None] * size)
+        self.metadata.extend([None] * size)
+        self.free.extend(range(2 * size - 1, size - 1, -1))
+
+    def upsert(self, vectors):
+        with self.lock:
+            for vector in vectors:
+                values = np.asarray(vector["values"], dtype=np.float32)
+                if len(values) != self.dimension:
+                    raise ValueError(f"Vector dimension {len(values)} does not match the dimension of the index {self.dimension}")
+                row = self.rows.get(vector["id"])
+                if row is None:
+                    if not self.free:
+                        self._grow()
+                    row = self.free.pop()
+                    self.rows[vector["id"]] = row
+                self.matrix[row] = values
+                self.norms[row] = np.linalg.norm(values)
+                self.alive[row] = True
+                self.ids[row] = vector["id"]
+                self.metadata[row] = vector.get("metadata") or {}
+        return len(vectors)
+
+    def _remove(self, row):
+        self.alive[row] = False
+        del self.rows[self.ids[row]]
+        self.ids[row] = None
+        self.metadata[row] = None
+        self.free.append(row)
+
+    def delete(self, ids=None, filter=None, delete_all=False):
+        with self.lock:
+            if delete_all:
+                rows = list(self.rows.values())
+            elif ids:
+                rows = [self.rows[id] for id in ids if id in self.rows]
+            else:
+                rows = [row for row in self.rows.values() if matches_filter(self.metadata[row], filter or {})]
+            for row in rows:
+                self._remove(row)
+
+    def update(self, id, values=None, set_metadata=None):
+        with self.lock:
+            row = self.rows.get(id)
+            if row is None:
+                return
+            if values:
+                self.matrix[row] = np.asarray(values, dtype=np.float32)
+                self.norms[row] = np.linalg.norm(self.matrix[row])
+            if set_metadata:
+                self.metadata[row] = {**self.metadata[row], **set_metadata}
+
+    def fetch(self, ids):
+        with self.lock:
+            return {
+                id: {"id": id, "values": self.matrix[row].tolist(), "metadata": self.metadata[row]}
+                for id, row in ((id, self.rows.get(id)) for id in ids) if row is not None
+            }
+
+    def query(self, vector, top_k, filter=None, include_values=False, include_metadata=False):
+        query = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            rows = np.flatnonzero(self.alive)
+            if filter:
+                rows = np.array([row for row in rows if matches_filter(self.metadata[row], filter)], dtype=np.int64)
+            if len(rows) == 0:
+                return []
+            if self.metric == "euclidean":
+                scores = ((self.matrix[rows] - query) ** 2).sum(axis=1)
+                order = np.argsort(scores)[:top_k]
+            else:
+                scores = self.matrix[rows] @ query
+                if self.metric == "cosine":
+                    scores = scores / np.maximum(self.norms[rows] * np.linalg.norm(query), 1e-12)
+                order = np.argsort(-scores)[:top_k]
+            matches = []
+            for i in order:
+                row = rows[i]
+                match = {"id": self.ids[row], "score": float(scores[i])}
+                if include_values:
+                    match["values"] = self.matrix[row].tolist()
+                if include_metadata:
+                    match["metadata"] = self.metadata[row]
+                matches.append(match)
+            return matches
+
+    def count(self):
+        return len(self.rows)
+
+    def describe(self):
+        database = {
+            "name": self.name,
+            "dimension": self.dimension,
+            "metric": self.metric,
+            "replicas": 1,
+            "shards": 1,
+            "pods": 1,
+            "pod_type": "p1.x1",
+        }
+        # pinecone-client rejects "metadata_config": null
+        if self.metadata_config is not None:
+            database["metadata_config"] = self.metadata_config
+        return {
+            "database": database,
+            "status": {"ready": True, "state": "Ready", "host": request.host, "port": 443},
+        }
+
+
+class FakeServices:
+    """
+    The state of the fake: injection settings per group, the indexes and
+    request counters. app() returns the Flask application.
+    """
+
+    def __init__(self, faults=None, dimension=DEFAULT_DIMENSION, tokens_per_s=50.0, seed=None):
+        self.faults = faults or {group: Faults() for group in GROUPS}
+        self.dimension = dimension
+        self.tokens_per_s = tokens_per_s
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.stats = {group: {"requests": 0, "rate_limited": 0, "errors": 0, "delay_s": 0.0} for group in GROUPS}
+
+    def inject(self, group):
+        """
+        Waits for the latency of group and returns the error response of an
+        injected failure, or None.
+        """
+        faults = self.faults[group]
+        with self.lock:
+            delay = faults.delay(self.rng)
+            status = faults.fault(self.rng)
+            stats = self.stats[group]
+            stats["requests"] += 1
+            stats["delay_s"] += delay
+            if status == 429:
+                stats["rate_limited"] += 1
+            elif status:
+                stats["errors"] += 1
+        time.sleep(delay)
+
+        if status is None:
+            return None
+        message = "Rate limit reached, please retry" if status == 429 else "Injected server error"
+        if group == "pinecone":
+            response = Response(message, status=status, mimetype="text/plain")
+        else:
+            kind = "requests" if status == 429 else "server_error"
+            response = jsonify({"error": {"message": message, "type": kind, "param": None, "code": None}})
+            response.status_code = status
+        if status == 429:
+            response.headers["Retry-After"] = "1"
+        return response
+
+    def index(self, name):
+        index = self.indexes.get(name)
+        if index is None:
+            return None, Response(f"Index {name} not found", status=404, mimetype="text/plain")
+        return index, None
+
+    def app(self):
+        app = Flask(__name__)
+
+        # OpenAI
+
+        @app.route("/v1/embeddings", methods=["POST"])
+        @app.route("/v1/engines/<engine>/embeddings", methods=["POST"])
+        def embeddings(engine=None):
+            failure = self.inject("embeddings")
+            if failure is not None:
+                return failure
+            body = request.get_json()
+            inputs = body["input"]
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            data = []
+            tokens = 0
+            for i, item in enumerate(inputs):
+                text = item if isinstance(item, str) else json.dumps(item)
+                tokens += count_tokens(text) if isinstance(item, str) else len(item)
+                vector = hash_vector(text, self.dimension)
+                if body.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            return jsonify({
+                "object": "list",
+                "data": data,
+                "model": body.get("model", engine),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+        def complete(body, prompt, chat):
+            words = fake_answer(prompt, int(body.get("max_tokens") or 16))
+            prompt_tokens = count_tokens(prompt)
+            created = int(time.time())
+            id = "fake-" + hashlib.blake2b(prompt.encode("utf-8"), digest_size=6).hexdigest()
+            kind = "chat.completion" if chat else "text_completion"
+
+            def choice(text, finish_reason, stream):
+                if not chat:
+                    return {"index": 0, "text": text, "logprobs": None, "finish_reason": finish_reason}
+                if stream:
+                    return {"index": 0, "delta": {"content": text} if text else {}, "finish_reason": finish_reason}
+                return {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}
+
+            if not body.get("stream"):
+                return jsonify({
+                    "id": id,
+                    "object": kind,
+                    "created": created,
+                    "model": body.get("model"),
+                    "choices": [choice(" ".join(words), "stop", False)],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+                })
+
+            def generate():
+                # tokens are paced at tokens_per_s after the first one
+                event = {"id": id, "object": kind + ".chunk", "created": created, "model": body.get("model")}
+                if chat:
+                    yield f"data: {json.dumps(dict(event, choices=[{'index': 0, 'delta': {'role': 'assistant'}, 'finish_reason': None}]))}\n\n"
+                for i, word in enumerate(words):
+                    if i and self.tokens_per_s > 0:
+                        time.sleep(1.0 / self.tokens_per_s)
+                    text = word if i == 0 else " " + word
+                    yield f"data: {json.dumps(dict(event, choices=[choice(text, None, True)]))}\n\n"
+                yield f"data: {json.dumps(dict(event, choices=[choice('', 'stop', True)]))}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return Response(generate(), mimetype="text/event-stream")
+
+        @app.route("/v1/chat/completions", methods=["POST"])
+        def chat_completions():
+            failure = self.inject("completions")
+            if failure is not None:
+                return failure
+            body = request.get_json()
+            prompt = "\n".join(message.get("content") or "" for message in body.get("messages", []))
+            return complete(body, prompt, chat=True)
+
+        @app.route("/v1/completions", methods=["POST"])
+        @app.route("/v1/engines/<engine>/completions", methods=["POST"])
+        def completions(engine=None):
+            failure = self.inject("completions")
+            if failure is not None:
+                return failure
+            body = request.get_json()
+            prompt = body.get("prompt") or ""
+            if isinstance(prompt, list):
+                prompt = "\n".join(map(str, prompt))
+            return complete(body, prompt, chat=False)
+
+        # Pinecone controller
+
+        @app.route("/actions/whoami", methods=["GET"])
+        def whoami():
+            return jsonify({"project_name": "fake", "user_label": "fake", "user_name": "fake"})
+
+        @app.route("/databases", methods=["GET"])
+        def list_indexes():
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            return jsonify(sorted(self.indexes))
+
+        @app.route("/databases", methods=["POST"])
+        def create_index():
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            body = request.get_json()
+            name = body["name"]
+            with self.lock:
+                if name in self.indexes:
+                    return Response(f"Index {name} already exists", status=409, mimetype="text/plain")
+                self.indexes[name] = FakeIndex(name, int(body["dimension"]), body.get("metric", "cosine"), body.get("metadata_config"))
+            return Response(name, status=201, mimetype="text/plain")
+
+        @app.route("/databases/<name>", methods=["GET"])
+        def describe_index(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            return missing or jsonify(index.describe())
+
+        @app.route("/databases/<name>", methods=["DELETE"])
+        def delete_index(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            with self.lock:
+                if self.indexes.pop(name, None) is None:
+                    return Response(f"Index {name} not found", status=404, mimetype="text/plain")
+            return Response("", status=202, mimetype="text/plain")
+
+        # Pinecone data plane, one prefix per index (see PINECONE_INDEX_HOST)
+
+        @app.route("/index/<name>/vectors/upsert", methods=["POST"])
+        def upsert(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            if missing:
+                return missing
+            try:
+                count = index.upsert(request.get_json()["vectors"])
+            except ValueError as e:
+                return Response(str(e), status=400, mimetype="text/plain")
+            return jsonify({"upsertedCount": count})
+
+        @app.route("/index/<name>/query", methods=["POST"])
+        def query(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            if missing:
+                return missing
+            body = request.get_json()
+            options = dict(
+                top_k=int(body.get("topK", 10)),
+                filter=body.get("filter"),
+                include_values=body.get("includeValues", False),
+                include_metadata=body.get("includeMetadata", False),
+            )
+            if "queries" in body:
+                results = [{"matches": index.query(q["values"], **options), "namespace": ""} for q in body["queries"]]
+                return jsonify({"results": results, "matches": [], "namespace": ""})
+            return jsonify({"results": [], "matches": index.query(body["vector"], **options), "namespace": ""})
+
+        @app.route("/index/<name>/vectors/fetch", methods=["GET"])
+        def fetch(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            return missing or jsonify({"vectors": index.fetch(request.args.getlist("ids")), "namespace": ""})
+
+        @app.route("/index/<name>/vectors/update", methods=["POST"])
+        def update(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            if missing:
+                return missing
+            body = request.get_json()
+            index.update(body["id"], body.get("values"), body.get("setMetadata"))
+            return jsonify({})
+
+        @app.route("/index/<name>/vectors/delete", methods=["POST", "DELETE"])
+        def delete(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            if missing:
+                return missing
+            if request.method == "DELETE":
+                body = {"ids": request.args.getlist("ids"), "deleteAll": request.args.get("deleteAll") == "true"}
+            else:
+                body = request.get_json()
+            index.delete(body.get("ids"), body.get("filter"), bool(body.get("deleteAll")))
+            return jsonify({})
+
+        @app.route("/index/<name>/describe_index_stats", methods=["GET", "POST"])
+        def describe_index_stats(name):
+            failure = self.inject("pinecone")
+            if failure is not None:
+                return failure
+            index, missing = self.index(name)
+            if missing:
+                return missing
+            count = index.count()
+            return jsonify({
+                "namespaces": {"": {"vectorCount": count}} if count else {},
+                "dimension": index.dimension,
+                "indexFullness": 0.0,
+                "totalVectorCount": count,
+            })
+
+        # control of the fake itself
+
+        @app.route("/_fake/config", methods=["GET", "POST"])
+        def config():
+            if request.method == "POST":
+                try:
+                    for group, settings in request.get_json().items():
+                        if group == "tokens_per_s":
+                            self.tokens_per_s = float(settings)
+                        elif group in self.faults:
+                            self.faults[group].update(settings)
+                        else:
+                            raise ValueError(f"Unknown group: {group}")
+                except (ValueError, AttributeError) as e:
+                    return jsonify({"error": str(e)}), 400
+            return jsonify({"tokens_per_s": self.tokens_per_s, **{group: vars(faults) for group, faults in self.faults.items()}})
+
+        @app.route("/_fake/stats", methods=["GET"])
+        def stats():
+            with self.lock:
+                return jsonify({
+                    "groups": self.stats,
+                    "indexes": {name: index.count() for name, index in self.indexes.items()},
+                })
+
+        @app.route("/_fake/reset", methods=["POST"])
+        def reset():
+            with self.lock:
+                self.indexes.clear()
+                for stats in self.stats.values():
+                    stats.update(requests=0, rate_limited=0, errors=0, delay_s=0.0)
+            return jsonify({})
+
+        return app
+
+
+def parse_override(value):
+    # "completions:latency=500,jitter=300" -> ("completions", {...})
+    match = re.fullmatch(r"(\w+):((?:\w+=[\w.]+,?)+)", value)
+    if not match or match.group(1) not in GROUPS:
+        raise argparse.ArgumentTypeError(f"expected GROUP:key=value,... with GROUP one of {', '.join(GROUPS)}")
+    return match.group(1), dict(item.split("=", 1) for item in match.group(2).strip(",").split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="base latency of every request in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in ms (mean for exponential)")
+    parser.add_argument("--distribution", choices=["exponential", "uniform"], default="exponential", help="distribution of the jitter")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--errors", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--set", type=parse_override, action="append", default=[], metavar="GROUP:key=value,...",
+                        help="settings of one group (embeddings, completions, pinecone), e.g. completions:latency=800,jitter=400")
+    parser.add_argument("--tokens-per-s", type=float, default=50.0, help="pace of streamed completion tokens, 0 for no pacing")
+    parser.add_argument("--dimension", type=int, default=DEFAULT_DIMENSION, help="dimension of the embeddings")
+    parser.add_argument("--seed", type=int, help="seed of the latency and fault draws")
+    args = parser.parse_args()
+
+    faults = {
+        group: Faults(args.latency, args.jitter, args.distribution, args.rate_limit, args.errors)
+        for group in GROUPS
+    }
+    for group, settings in args.set:
+        faults[group].update(settings)
+
+    services = FakeServices(faults, args.dimension, args.tokens_per_s, args.seed)
+    base = f"http://{args.host}:{args.port}"
+    print(f"OPENAI_API_BASE={base}/v1")
+    print(f"PINECONE_CONTROLLER_HOST={base}")
+    print(f"PINECONE_INDEX_HOST={base}/index/{{index_name}}")
+    services.app().run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
+import sys
+import pathlib
+
+# add the shared helpers folder to path (document store, context packer)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "streamlit" / "helpers"))
+
 import feedparser
 from sklearn.feature_extraction.text import CountVectorizer
 import tiktoken
 import openai
 import os
+from doc_store import get_article
+from context_packer import context_budget, fit_text
 
 
 # Set the OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# the completion model; the context budget and token counts use its tokenizer
+MODEL = "text-davinci-003"
+
 # URL of the RSS feed to parse
 url = 'https://blog.baeke.info/feed/'
 
@@ -30,8 +41,8 @@ post_vectors = vectorizer.fit_transform(post_texts)
 # print vector dimensions
 
 
-def tokens_from_string(string, encoding_name):
-        encoding = tiktoken.get_encoding(encoding_name)
+def tokens_from_string(string, model):
+        encoding = tiktoken.encoding_for_model(model)
         num_tokens = len(encoding.encode(string))
         return num_tokens
 
@@ -56,16 +67,9 @@ while True:
     # print the most similar blog post
     print(feed.entries[most_similar_index].link)
 
-    # scrape the content of the article
-    import requests
-    from bs4 import BeautifulSoup
-
-    # get the content of the article
-    r = requests.get(feed.entries[most_similar_index].link)
-    soup = BeautifulSoup(r.text, 'html.parser')
-
-    # print the content of the article
-    article = soup.find('div', {'class': 'entry-content'}).text
+    # get the content of the article from the local document store;
+    # it is only scraped the first time
+    article = get_article(feed.entries[most_similar_index].link)
 
     prompt=f'''{your_query}
 
@@ -73,25 +77,27 @@ while True:
 
     Context: 
 
-    {article}
+    {{context}}
     '''
 
-
-    # print number of tokens from the article with encoding cl100k_base
-    num_tokens = tokens_from_string(prompt, 'cl100k_base')
-    print(f"Number of tokens: {num_tokens}")
-
     reply_tokens = 200
 
-    if (num_tokens + reply_tokens) > 4000:
-        print('The article is too long for OpenAI to process. Please try again with a different article.')
-        continue
+    # long articles are cut to the tokens left after the question and the reply
+    budget = context_budget(MODEL, reply_tokens, prompt)
+    context = fit_text(article, budget, MODEL)
+    if context != article:
+        print(f"Article cut to {budget} tokens to fit the model")
+    prompt = prompt.replace("{context}", context)
+
+    # print number of tokens from the prompt with the model's encoding
+    num_tokens = tokens_from_string(prompt, MODEL)
+    print(f"Number of tokens: {num_tokens}")
 
 
     try:
         # openai completion with article as context
         response = openai.Completion.create(
-            model="text-davinci-004",
+            model=MODEL,
             prompt=prompt,
             temperature=0,
             max_tokens=reply_tokens
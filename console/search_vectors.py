@@ -1,10 +1,18 @@
 import os
-import pinecone
+import sys
+import pathlib
 import openai
 import requests
-from bs4 import BeautifulSoup
 import tiktoken
 
+# add the shared helpers folder to path (vector stores, query cache, document store)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "streamlit" / "helpers"))
+
+from vector_store import get_vector_store
+from query_cache import embed_query
+from doc_store import get_article
+from context_packer import context_budget, fit_text
+
 def tokens_from_string(string, encoding_name):
         encoding = tiktoken.get_encoding(encoding_name)
         num_tokens = len(encoding.encode(string))
@@ -21,30 +29,21 @@ def get_highest_score_url(items):
 
     return highest_score_item["metadata"]['url']
 
-# get the Pinecone API key and environment
-pinecone_api = os.getenv('PINECONE_API_KEY')
-pinecone_env = os.getenv('PINECONE_ENVIRONMENT')
-
-pinecone.init(api_key=pinecone_api, environment=pinecone_env)
-
-# set index
-index = pinecone.Index('blog-index')
+# set index; Pinecone unless VECTOR_STORE selects another backend
+index = get_vector_store('blog-index')
 
 while True:
     # set query
     your_query = input("\nWhat would you like to know? ")
     
-    # vectorize your query with openai
+    # vectorize your query with openai; repeated queries come from the query cache
     try:
-        query_vector = openai.Embedding.create(
-            input=your_query,
-            model="text-embedding-ada-002"
-        )["data"][0]["embedding"]
+        query_vector = embed_query(your_query)
     except Exception as e:
         print("Error calling OpenAI Embedding API: ", e)
         continue
 
-    # search for the most similar vector in Pinecone
+    # search for the most similar vector in the vector store
     search_response = index.query(
         top_k=5,
         vector=query_vector,
@@ -58,12 +57,10 @@ while True:
     # print url
     print("Highest score url: ", url)
 
-    # get the content of the article
-    r = requests.get(url)
-    soup = BeautifulSoup(r.text, 'html.parser')
-
-    # get the article
-    article = soup.find('div', {'class': 'entry-content'}).text
+    # get the article from the local document store (fetched on a miss);
+    # long articles are cut to the tokens left after the question and the reply
+    article = get_article(url)
+    article = fit_text(article, context_budget("gpt-3.5-turbo", 200, your_query + "Provide your answer based on this context: . Do not answer beyond this context!"))
 
     try:
         # openai chatgpt with article as context
@@ -1,55 +1,74 @@
-import numpy as np
-from redis.commands.search.query import Query
-import redis
+import sys
+import pathlib
+
+# add the shared helpers folder to path (query cache, Redis search)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "streamlit" / "helpers"))
+
+import argparse
 import openai
 import os
+import time
+from query_cache import embed_query
+from redis_search import RedisSearch
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-def search_vectors(query_vector, client, top_k=5):
-    base_query = "*=>[KNN 5 @embedding $vector AS vector_score]"
-    query = Query(base_query).return_fields("url", "vector_score").sort_by("vector_score").dialect(2)    
+parser = argparse.ArgumentParser(description="Search blog posts in Redis")
+parser.add_argument("--top-k", type=int, default=5)
+parser.add_argument("--ef-runtime", type=int, default=None, help="HNSW candidate list size for this search")
+parser.add_argument("--filter", default=None, help="RediSearch pre-filter, e.g. '@text:\"kubernetes\"'")
+parser.add_argument("--queries", default=None, help="file with one query per line; searched in one pipeline")
+args = parser.parse_args()
 
+
+def search_vectors(query_vector, searcher, top_k=5):
     try:
-        results = client.ft("posts").search(query, query_params={"vector": query_vector})
+        return searcher.search(query_vector, top_k, filter=args.filter, ef_runtime=args.ef_runtime)
     except Exception as e:
         print("Error calling Redis search: ", e)
         return None
 
-    return results
-
 
+def print_results(results):
+    print(f"Found {len(results)} results:")
+    for i, post in enumerate(results):
+        print(f"\t{i}. {post['metadata'].get('url')} (Score: {round(post['score'], 3)})")
 
-# Redis connection details
-redis_host = os.getenv('REDIS_HOST')
-redis_port = os.getenv('REDIS_PORT')
-redis_password = os.getenv('REDIS_PASSWORD')
 
-# Connect to the Redis server
-conn = redis.Redis(host=redis_host, port=redis_port, password=redis_password, encoding='utf-8', decode_responses=True)
+# pooled, binary-safe connection from REDIS_HOST, REDIS_PORT and REDIS_PASSWORD
+searcher = RedisSearch()
 
-if conn.ping():
+if searcher.conn.ping():
     print("Connected to Redis")
 
+if args.queries:
+    # batch mode: embed all queries, then run every search in one round trip
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    print(f"Vectorizing {len(queries)} queries...")
+    vectors = [embed_query(query) for query in queries]
+
+    start = time.perf_counter()
+    all_results = searcher.search_many(vectors, args.top_k, filter=args.filter, ef_runtime=args.ef_runtime)
+    elapsed = time.perf_counter() - start
+    for query, results in zip(queries, all_results):
+        print(query)
+        print_results(results)
+    print(f"{len(queries)} searches in {elapsed:.3f} s ({len(queries) / elapsed:.0f} searches/s)")
+    sys.exit(0)
+
 # Enter a query
 query = input("Enter your query: ")
 
-# Vectorize the query using OpenAI's text-embedding-ada-002 model
+# Vectorize the query using OpenAI's text-embedding-ada-002 model (cached)
 print("Vectorizing query...")
-embedding = openai.Embedding.create(input=query, model="text-embedding-ada-002")
-query_vector = embedding["data"][0]["embedding"]
-
-# Convert the vector to a numpy array
-query_vector = np.array(query_vector).astype(np.float32).tobytes()
+query_vector = embed_query(query)
 
 # Perform the similarity search
 print("Searching for similar posts...")
-results = search_vectors(query_vector, conn)
+results = search_vectors(query_vector, searcher, args.top_k)
 
 if results:
-    print(f"Found {results.total} results:")
-    for i, post in enumerate(results.docs):
-        score = 1 - float(post.vector_score)
-        print(f"\t{i}. {post.url} (Score: {round(score ,3) })")
+    print_results(results)
 else:
-    print("No results found")
\ No newline at end of file
+    print("No results found")
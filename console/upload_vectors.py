@@ -1,75 +1,79 @@
+import sys
+import pathlib
+
+# add the shared helpers folder to path (embedding cache, manifest, vector stores)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "streamlit" / "helpers"))
+
+import argparse
 import feedparser
 import os
-import pinecone
 import numpy as np
 import openai
 import requests
-from bs4 import BeautifulSoup
-from retrying import retry
-
-@retry(wait_exponential_multiplier=1000, wait_exponential_max=10000)
-def create_embedding(article):
-    # vectorize with OpenAI text-emebdding-ada-002
-    embedding = openai.Embedding.create(
-        input=article,
-        model="text-embedding-ada-002"
-    )
-
-    return embedding["data"][0]["embedding"]
-
-
-# OpenAI API key
-openai.api_key = os.getenv('OPENAI_API_KEY')
-
-# get the Pinecone API key and environment
-pinecone_api = os.getenv('PINECONE_API_KEY')
-pinecone_env = os.getenv('PINECONE_ENVIRONMENT')
+from embedding_cache import get_default_cache
+from doc_store import get_document_store
+from ingest import Ingestion
+from manifest import IngestManifest
+from vector_store import get_vector_store
 
-pinecone.init(api_key=pinecone_api, environment=pinecone_env)
 
-if "blog-index" not in pinecone.list_indexes():
-    print("Index does not exist. Creating...")
-    pinecone.create_index("blog-index", 1536)
-else:
-    print("Index already exists. Deleting...")
-    pinecone.delete_index("blog-index")
-    print("Creating new index...")
-    pinecone.create_index("blog-index", 1536)
 
-# set index; must exist
-index = pinecone.Index('blog-index')
+def main():
+    # OpenAI API key
+    openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# URL of the RSS feed to parse
-url = 'https://blog.baeke.info/feed/'
+    # only recreate the index when asked; otherwise update it incrementally
+    parser = argparse.ArgumentParser(description="Upload blog posts as vectors to Pinecone")
+    parser.add_argument("--recreate", action="store_true", help="delete and recreate the index")
+    args = parser.parse_args()
 
-# Parse the RSS feed with feedparser
-feed = feedparser.parse(url)
+    # the manifest records what is in the index so unchanged posts are skipped;
+    # the Upload page chunks posts differently and keeps its own
+    manifest = IngestManifest.for_index("blog-index", "console")
 
-# get number of entries in feed
-entries = len(feed.entries)
-print("Number of entries: ", entries)
+    # Pinecone unless VECTOR_STORE selects another backend
+    index = get_vector_store("blog-index")
+    index_existed = index.ensure_index(1536, recreate=args.recreate)
+    if index_existed:
+        print("Index already exists. Updating changed posts only.")
+    else:
+        print("Index created.")
+        manifest.clear()
+        IngestManifest.forget_index("blog-index")
 
-post_texts = []
-pinecone_vectors = []
-for i, entry in enumerate(feed.entries[:50]):
-    # report progress
-    print("Create embedding for entry ", i, " of ", entries)
+    # extracted articles are saved for the query path
+    documents = get_document_store()
 
-    r = requests.get(entry.link)
-    soup = BeautifulSoup(r.text, 'html.parser')
-    article = soup.find('div', {'class': 'entry-content'}).text
+    # URL of the RSS feed to parse
+    url = 'https://blog.baeke.info/feed/'
 
-    # create embedding
-    vector = create_embedding(article)
+    # Parse the RSS feed with feedparser
+    feed = feedparser.parse(url)
 
-    # append tuple to pinecone_vectors list
-    pinecone_vectors.append((str(i), vector, {"url": entry.link}))
+    # get number of entries in feed
+    entries = len(feed.entries)
+    print("Number of entries: ", entries)
 
-# all vectors can be upserted to pinecode in one go
-upsert_response = index.upsert(vectors=pinecone_vectors)
+    # fetch, extract, embed and upsert run as overlapping stages; the whole
+    # article is embedded as a single chunk
+    ingestion = Ingestion(index, manifest, documents, index_existed=index_existed, chunk_size=None, include_text=False)
+    for message in ingestion.run([entry.link for entry in feed.entries[:50]]):
+        if message is not None:
+            print(f"[{ingestion.pages}/{min(entries, 50)}] {message}")
 
-print("Vector upload complete.")
+    # delete vectors of removed posts, flush the index and save the manifest
+    ingestion.finish()
+    print("Vectors upserted: ", ingestion.vectors, ", deleted: ", len(ingestion.stale_ids))
+    print("Throughput: ", ingestion.progress())
 
+    print("Vector upload complete.")
 
+    # report how many articles were served from the embedding cache
+    cache = get_default_cache()
+    if cache is not None:
+        print("Embedding cache: ", cache.stats())
 
 
+# pages are parsed in worker processes, which import this module
+if __name__ == "__main__":
+    main()
@@ -1,83 +1,113 @@
+import sys
+import pathlib
+
+# add the shared helpers folder to path (embedding batching and cache, Redis loader)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "streamlit" / "helpers"))
+
+import argparse
 import feedparser
 import os
 import numpy as np
 import openai
-import requests
-from bs4 import BeautifulSoup
-import redis
-from redis.commands.search.field import VectorField, TextField
-from redis.commands.search.query import Query
-from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from embeddings import create_embeddings
+from embedding_cache import get_default_cache
+from doc_store import get_document_store
+from extract import extract_article
+from crawler import create_session
+from redis_index import DEFAULT_BATCH_SIZE, INDEX_NAME, RedisBulkLoader, get_connection, index_info, prefix_for
 
 # OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# Redis connection details
-redis_host = os.getenv('REDIS_HOST')
-redis_port = os.getenv('REDIS_PORT')
-redis_password = os.getenv('REDIS_PASSWORD')
-
-# Connect to the Redis server
-conn = redis.Redis(host=redis_host, port=redis_port, password=redis_password, encoding='utf-8', decode_responses=True)
-
-
-SCHEMA = [
-    TextField("url"),
-    VectorField("embedding", "HNSW", {"TYPE": "FLOAT32", "DIM": 1536, "DISTANCE_METRIC": "COSINE"}),
-]
-
-# Create the index
-try:
-    conn.ft("posts").create_index(fields=SCHEMA, definition=IndexDefinition(prefix=["post:"], index_type=IndexType.HASH))
-except Exception as e:
-    print("Index already exists")
-    
-
-# URL of the RSS feed to parse
-url = 'https://blog.baeke.info/feed/'
-
-# Parse the RSS feed with feedparser
-feed = feedparser.parse(url)
-
-# get number of entries in feed
-entries = len(feed.entries)
-print("Number of entries: ", entries)
-
-p = conn.pipeline(transaction=False)
-for i, entry in enumerate(feed.entries[:50]):
-    # report progress
-    print("Create embedding and save for entry ", i, " of ", entries)
-
-    r = requests.get(entry.link)
-    soup = BeautifulSoup(r.text, 'html.parser')
-    article = soup.find('div', {'class': 'entry-content'}).text
-
-    # vectorize with OpenAI text-emebdding-ada-002
-    embedding = openai.Embedding.create(
-        input=article,
-        model="text-embedding-ada-002"
-    )
-
-    # print the embedding (length = 1536)
-    vector = embedding["data"][0]["embedding"]
-
-    print(embedding)
-    exit()
-
-    # convert to numpy array
-    vector = np.array(vector).astype(np.float32).tobytes()
-
-    # Create a new hash with the URL and embedding
-    post_hash = {
-        "url": entry.link,
-        "embedding": vector
-    }
-
-    
-    
-    # add_document() is deprecated
-    conn.hset(name=f"post:{i}", mapping=post_hash)
-
-p.execute()
+parser = argparse.ArgumentParser(description="Upload blog posts as vectors to Redis")
+parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="hashes per pipeline round trip")
+parser.add_argument("--recreate", action="store_true", help="drop the index and its hashes first")
+parser.add_argument("--reindex", action="store_true", help="migrate the index to the current schema, keeping the hashes")
+parser.add_argument("--defer-index", action="store_true", help="load all hashes first and create a missing index afterwards")
+parser.add_argument("--random", type=int, default=0, metavar="N", help="load N random vectors instead of the feed (load test)")
+parser.add_argument("--keep", action="store_true", help="keep the load test index and hashes")
+args = parser.parse_args()
+
+# Connect to the Redis server; binary-safe, embeddings are FLOAT32 blobs
+conn = get_connection()
+
+# load tests use their own index and key prefix, never the posts index
+index_name = "loadtest" if args.random else INDEX_NAME
+loader = RedisBulkLoader(conn, index_name=index_name, prefix=prefix_for(index_name), batch_size=args.batch_size)
+
+# Create the index, or check that the existing one has the expected schema;
+# with --defer-index a missing index is created after the load
+if args.recreate:
+    loader.drop_index()
+elif args.reindex:
+    loader.reindex()
+    print("Reindexing...")
+    print("Indexed documents: ", loader.wait_for_indexing())
+if index_info(conn, index_name) is not None or not args.defer_index:
+    if loader.ensure_index(1536):
+        print("Index already exists")
+
+if args.random:
+    # random unit vectors, generated while they are loaded
+    def random_vectors(n):
+        rng = np.random.default_rng(0)
+        for i in range(n):
+            vector = rng.standard_normal(1536).astype(np.float32)
+            yield f"random-{i}", vector / np.linalg.norm(vector), {"url": f"random:{i}", "chunk-id": 0}
+
+    vectors = random_vectors(args.random)
+else:
+    # extracted articles are saved for the query path
+    documents = get_document_store()
+
+    # URL of the RSS feed to parse
+    url = 'https://blog.baeke.info/feed/'
+
+    # Parse the RSS feed with feedparser
+    feed = feedparser.parse(url)
+
+    # get number of entries in feed
+    entries = len(feed.entries)
+    print("Number of entries: ", entries)
+
+    session = create_session()
+    links = []
+    articles = []
+    for i, entry in enumerate(feed.entries[:50]):
+        # report progress
+        print("Fetching entry ", i, " of ", entries)
+
+        r = session.get(entry.link, timeout=30)
+        article = extract_article(r.text)
+
+        # keep the article text for the query path
+        documents.put(entry.link, article)
+        links.append(entry.link)
+        articles.append(article)
+
+    # vectorize with OpenAI text-emebdding-ada-002 (batched and cached)
+    print("Creating embeddings...")
+    embeddings = create_embeddings(articles)
+    vectors = [(str(i), vector, {"url": link, "chunk-id": 0}) for i, (link, vector) in enumerate(zip(links, embeddings))]
+
+# write all hashes with pipelined HSETs
+stats = loader.load(vectors, defer_index=args.defer_index)
+mb_per_s = stats['bytes'] / stats['seconds'] / 1e6 if stats['seconds'] else 0.0
+print(f"Loaded {stats['vectors']} vectors in {stats['batches']} pipelines, "
+      f"{stats['seconds']:.2f} s, {stats['vectors_per_s']:.0f} vectors/s, {mb_per_s:.1f} MB/s")
+
+if args.defer_index:
+    print("Indexing...")
+    print("Indexed documents: ", loader.wait_for_indexing())
+
+if args.random and not args.keep:
+    # the load test leaves nothing behind
+    loader.drop_index()
+    print("Dropped the load test index and its hashes")
 
 print("Vector upload complete.")
+
+# report how many articles were served from the embedding cache
+cache = get_default_cache()
+if cache is not None:
+    print("Embedding cache: ", cache.stats())
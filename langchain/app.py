@@ -1,68 +1,77 @@
+import argparse
 import os
-from langchain.document_loaders import DirectoryLoader
+import sys
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.indexes.vectorstore import VectorstoreIndexCreator
 from langchain.llms import OpenAI
 from langchain.chains import ConversationalRetrievalChain
+from chat_history import ChatHistory
+from vector_index import DEFAULT_INDEX_TYPE, FaissIndexManager, RebuildRequired, corpus_files
 
 # get openai key from environment
 OpenAI.openai_api_key = os.getenv('OPENAI_API_KEY')
 
-# initialize wrapper around openai embeddings
-# the embeddings are either loaded from local storage (faiss_index folder)
-# or created from scratch
-embeddings = OpenAIEmbeddings()
 
-# try to load embeddings from local, otherwise re-create them
-try:
-    db = FAISS.load_local("faiss_index", embeddings)
-    print("Loaded embeddings from local storage.")
-except Exception as e:
-    print(e)
-    print("Could not load embeddings from local storage. Creating new embeddings.")
+def ask_question(qa, query, chat_history=None):
+    # query is already condensed by ChatHistory, so chat_history is usually empty
+    if chat_history is None:
+        chat_history = []
+    result = qa({"question": query, "chat_history": chat_history})
 
-    # Load documents from a folder
-    loader = DirectoryLoader('./', glob="**/*.txt")
-    documents = loader.load()
+    return result["answer"]
 
-    # Split documents into chunks
-    text_splitter = CharacterTextSplitter(chunk_size=400, chunk_overlap=20)
-    documents = text_splitter.split_documents(documents)
 
-    # Create embeddings for chunks
-    db = FAISS.from_documents(documents, embeddings)
+def main():
+    parser = argparse.ArgumentParser(description="Chat about the .txt files in this folder.")
+    parser.add_argument("--rebuild", action="store_true", help="re-embed the corpus when the saved index is stale or damaged")
+    parser.add_argument("--index-type", default=DEFAULT_INDEX_TYPE, help="flat, ivf, ivfpq or a faiss index_factory string")
+    args = parser.parse_args()
 
-    # Save embeddings to local storage
-    db.save_local("faiss_index")
+    # initialize wrapper around openai embeddings
+    # the embeddings are either loaded from local storage (faiss_index folder)
+    # or created from scratch
+    embeddings = OpenAIEmbeddings()
+    text_splitter = CharacterTextSplitter(chunk_size=400, chunk_overlap=20)
 
-# Initialize the ConversationalRetrievalChain
-qa = ConversationalRetrievalChain.from_llm(OpenAI(temperature=0), db.as_retriever(search_kwargs={"k": 5}), return_source_documents=True)
+    # load the saved index when it was built from the same files and settings;
+    # only new and changed files are embedded, everything else needs --rebuild
+    manager = FaissIndexManager("faiss_index", embeddings,
+                                {"loader": "text", "splitter": "CharacterTextSplitter", "chunk_size": 400, "chunk_overlap": 20},
+                                index_type=args.index_type)
+    try:
+        db = manager.open(corpus_files('./', "**/*.txt"), text_splitter, rebuild=args.rebuild)
+    except RebuildRequired as e:
+        print(e)
+        sys.exit(1)
 
-def ask_question(query, chat_history=None):
-    if chat_history is None:
-        chat_history = []
-    result = qa({"question": query, "chat_history": chat_history})
+    # Initialize the ConversationalRetrievalChain
+    llm = OpenAI(temperature=0)
+    qa = ConversationalRetrievalChain.from_llm(llm, db.as_retriever(search_kwargs={"k": 5}), return_source_documents=True)
 
-    return result["answer"]
+    # recent turns within a token budget plus a rolling summary of older ones
+    history = ChatHistory(llm, qa.question_generator,
+                          system="You are a literary assistant for the book 1984! Only answer questions about the book")
+
+    print("Welcome to the Chat Interface! Type 'exit' to quit.")
 
+    while True:
+        user_input = input("You: ")
+        if user_input.lower() == "exit":
+            break
+        question = history.condense(user_input)
+        answer = ask_question(qa, question)
+        history.add(user_input, answer, question)
+        print("Assistant:", answer)
 
-print("Welcome to the Chat Interface! Type 'exit' to quit.")
-chat_history = []
-chat_history.append({"role": "system", "content": "You are a literary assistant for the book 1984! Only answer questions about the book"})
+        # pretty print chat history
+        print("Chat History:")
+        for role, content in history.messages():
+            print(f"{role}: {content}")
+        print("")
 
-while True:
-    user_input = input("You: ")
-    if user_input.lower() == "exit":
-        break
-    answer = ask_question(user_input, chat_history)
-    chat_history.append({"role": "user", "content": user_input})
-    chat_history.append({"role": "assistant", "content": answer})
-    print("Assistant:", answer)
 
-    # pretty print chat history
-    print("Chat History:")
-    for item in chat_history:
-        print(f"{item['role']}: {item['content']}")
-    print("")
+# the files are chunked in worker processes, which import this module
+if __name__ == "__main__":
+    main()
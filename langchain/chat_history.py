@@ -0,0 +1,130 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# tokens of recent turns passed verbatim to the question condensing step
+HISTORY_TOKENS = int(os.getenv('CHAT_HISTORY_TOKENS', 1000))
+# condensed questions kept for repeated questions
+CONDENSE_CACHE_SIZE = int(os.getenv('CHAT_CONDENSE_CACHE', 256))
+
+Turn = collections.namedtuple('Turn', ['question', 'answer', 'standalone', 'tokens'])
+
+
+class ChatHistory:
+    """
+    Bounded chat history for ConversationalRetrievalChain REPLs.
+
+    Recent turns are kept verbatim as long as they fit in max_tokens; older
+    turns are folded into a rolling summary, a few at a time, on a
+    background thread while the user types the next question. condense()
+    turns a follow-up question into a standalone one with the chain's
+    question generator, from the summary and the recent turns only, so its
+    prompt (and the time it takes) stays the same size however long the
+    session runs. The standalone question is cached by history and question,
+    and kept with its turn.
+
+    Pass the standalone question to the chain with an empty chat_history,
+    which makes the chain skip its own condensing step.
+    """
+
+    def __init__(self, llm, question_generator, system=None, max_tokens=HISTORY_TOKENS, cache_size=CONDENSE_CACHE_SIZE):
+        from langchain.chains import LLMChain
+        from langchain.memory.prompt import SUMMARY_PROMPT
+
+        self.llm = llm
+        self.question_generator = question_generator
+        self.summarizer = LLMChain(llm=llm, prompt=SUMMARY_PROMPT)
+        self.system = system
+        self.max_tokens = max_tokens
+        self.turns = collections.deque()
+        self.tokens = 0
+        self.summary = ""
+        # evicted turns that are not in the summary yet
+        self.unfolded = []
+        self.lock = threading.Lock()
+        self.folder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-summary')
+        self.folding = None
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+
+    def _context(self):
+        lines = []
+        if self.system:
+            lines.append(f"System: {self.system}")
+        if self.summary:
+            lines.append(f"Summary of the earlier conversation: {self.summary}")
+        for turn in self.turns:
+            lines.append(f"Human: {turn.question}")
+            lines.append(f"Assistant: {turn.answer}")
+        return "\n".join(lines)
+
+    def condense(self, question):
+        """
+        Returns question rephrased as a standalone question, or question
+        itself at the start of a session.
+        """
+        if self.folding is not None:
+            # the summary of the turns evicted last time
+            self.folding.result()
+        if not self.turns and not self.summary:
+            return question
+
+        context = self._context()
+        key = hashlib.sha256(f"{context}\0{question}".encode('utf-8')).hexdigest()
+        standalone = self.cache.get(key)
+        if standalone is not None:
+            self.cache.move_to_end(key)
+            return standalone
+
+        standalone = self.question_generator.run(question=question, chat_history=context).strip()
+        self.cache[key] = standalone
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return standalone
+
+    def add(self, question, answer, standalone=None):
+        """
+        Adds a turn and evicts the oldest turns beyond max_tokens into the
+        summary. The newest turn is always kept.
+        """
+        tokens = self.llm.get_num_tokens(f"Human: {question}\nAssistant: {answer}")
+        self.turns.append(Turn(question, answer, standalone or question, tokens))
+        self.tokens += tokens
+
+        evicted = []
+        while self.tokens > self.max_tokens and len(self.turns) > 1:
+            turn = self.turns.popleft()
+            self.tokens -= turn.tokens
+            evicted.append(turn)
+        if evicted:
+            self.folding = self.folder.submit(self._fold, evicted)
+
+    def _fold(self, turns):
+        with self.lock:
+            turns = self.unfolded + turns
+            # standalone questions read well without the turns before them
+            new_lines = "\n".join(f"Human: {turn.standalone}\nAI: {turn.answer}" for turn in turns)
+            try:
+                self.summary = self.summarizer.predict(summary=self.summary, new_lines=new_lines).strip()
+                self.unfolded = []
+            except Exception:
+                logging.error("Could not summarize the chat history, retrying with the next turns", exc_info=True)
+                self.unfolded = turns
+
+    def messages(self):
+        """
+        Returns (role, content) of the system message, the summary and the
+        recent turns, for display.
+        """
+        messages = []
+        if self.system:
+            messages.append(("system", self.system))
+        if self.summary:
+            messages.append(("summary", self.summary))
+        for turn in self.turns:
+            messages.append(("user", turn.question))
+            messages.append(("assistant", turn.answer))
+        return messages
@@ -0,0 +1,525 @@
+import collections
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import pathlib
+import pickle
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# flat, ivf, ivfpq or any faiss index_factory string
+DEFAULT_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+# inverted lists visited per query by ivf indexes
+DEFAULT_NPROBE = int(os.getenv('FAISS_NPROBE', 8))
+# versions kept on disk, the current one included
+KEEP_VERSIONS = int(os.getenv('FAISS_KEEP_VERSIONS', 2))
+# hash the index files on every load instead of only checking their sizes
+VERIFY = os.getenv('FAISS_VERIFY', '0') == '1'
+# chunks per embedding request, and processes that read and chunk files
+EMBED_BATCH = int(os.getenv('FAISS_EMBED_BATCH', 256))
+CHUNK_WORKERS = int(os.getenv('FAISS_CHUNK_WORKERS', os.cpu_count() or 1))
+# vectors held back to train a new ivf index on, and copied per step between indexes
+TRAIN_VECTORS = int(os.getenv('FAISS_TRAIN_VECTORS', 16384))
+COPY_BATCH = 8192
+
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+INDEX_FILE = 'index.faiss'
+DOCSTORE_FILE = 'index.pkl'
+# the manifest fields that decide whether a saved index still matches the corpus
+MATCH_FIELDS = ('embedding_model', 'chunker', 'corpus_hash', 'index_type')
+# ivf needs about 39 training vectors per list, pq 256 per code book
+MIN_TRAIN_VECTORS = 1024
+
+
+class RebuildRequired(RuntimeError):
+    """
+    The saved index is stale, damaged or has no manifest, and rebuilding it
+    would re-embed the corpus, which needs an explicit rebuild=True.
+    """
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def corpus_hash(files):
+    # files maps the relative path of every corpus file to its stats
+    h = hashlib.sha256()
+    for path, stats in sorted(files.items()):
+        h.update(f"{path}\0{stats['sha256']}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def corpus_files(root, glob):
+    # the files DirectoryLoader(root, glob=glob) would load, hidden ones skipped
+    root = pathlib.Path(root)
+    return sorted(path for path in root.glob(glob)
+                  if path.is_file() and not any(part.startswith('.') for part in path.relative_to(root).parts))
+
+
+def file_stats(files, root, previous=None):
+    """
+    Returns size, mtime and content hash of every file by path relative to
+    root. Files whose size and mtime match previous keep their hash there,
+    so an unchanged corpus is not read again.
+    """
+    previous = previous or {}
+    stats = {}
+    for path in files:
+        rel = pathlib.Path(os.path.relpath(str(path), str(root))).as_posix()
+        st = os.stat(path)
+        old = previous.get(rel)
+        if old is not None and old.get('size') == st.st_size and old.get('mtime') == st.st_mtime_ns:
+            digest = old['sha256']
+        else:
+            digest = file_hash(path)
+        stats[rel] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': digest}
+    return stats
+
+
+def factory_string(index_type, dimension, count):
+    """
+    Returns the faiss index_factory string of index_type for count vectors
+    of dimension. Indexes that need training fall back to a flat index when
+    there are too few vectors to train them.
+    """
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type not in ('ivf', 'ivfpq'):
+        return index_type
+    if count < MIN_TRAIN_VECTORS:
+        logging.warning("%d vectors are too few to train a %s index, using a flat index", count, index_type)
+        return 'Flat'
+    nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+    if index_type == 'ivf':
+        return f'IVF{nlist},Flat'
+    # the largest number of sub-quantizers up to 64 that divides the dimension
+    m = max(m for m in range(1, 65) if dimension % m == 0)
+    return f'IVF{nlist},PQ{m}x8'
+
+
+def exact_vectors(spec):
+    # indexes whose stored vectors can be copied into another index type without loss
+    return spec == 'Flat' or (spec.startswith('IVF') and spec.endswith(',Flat'))
+
+
+def read_index(path, mmap=True, spec=None):
+    """
+    Reads a faiss index. With mmap, the vectors stay on disk and are paged
+    in by searches: IO_FLAG_MMAP maps the inverted lists of ivf indexes,
+    IO_FLAG_MMAP_IFC (recent faiss releases) the vectors of flat indexes.
+    The two cannot be combined, so spec picks one. A mapped index is read
+    only; adding to a mapped flat index aborts the process.
+    """
+    import faiss
+
+    if mmap:
+        if spec is not None and not spec.startswith('IVF'):
+            flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+        else:
+            flag = faiss.IO_FLAG_MMAP
+        try:
+            if flag is not None:
+                return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            logging.debug("Could not memory map %s, reading it", path, exc_info=True)
+    return faiss.read_index(path)
+
+
+def chunk_file(path, splitter):
+    # runs in the chunking processes and returns plain (text, metadata) pairs
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    return [(document.page_content, document.metadata)
+            for document in splitter.create_documents([text], [{'source': str(path)}])]
+
+
+def iter_chunks(paths, splitter, workers=CHUNK_WORKERS):
+    """
+    Yields (path, chunks) for every path in order. Files are read and split
+    in a pool of worker processes with at most two files per worker in
+    flight, so memory does not grow with the number of files.
+    """
+    paths = list(paths)
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield path, chunk_file(path, splitter)
+        return
+
+    remaining = iter(paths)
+    with ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque((path, pool.submit(chunk_file, path, splitter)) for path in itertools.islice(remaining, 2 * workers))
+        while pending:
+            path, future = pending.popleft()
+            for next_path in itertools.islice(remaining, 1):
+                pending.append((next_path, pool.submit(chunk_file, next_path, splitter)))
+            yield path, future.result()
+
+
+class IndexWriter:
+    """
+    Adds vectors to a faiss index in order. While the index is untrained,
+    up to train_size vectors are held back, then it is trained on them.
+    """
+
+    def __init__(self, index, train_size=TRAIN_VECTORS):
+        self.index = index
+        self.train_size = train_size
+        self.pending = []
+        self.pending_count = 0
+
+    def add(self, vectors):
+        if self.index.is_trained:
+            self.index.add(vectors)
+            return
+        self.pending.append(vectors)
+        self.pending_count += len(vectors)
+        if self.pending_count >= self.train_size:
+            self._train()
+
+    def _train(self):
+        vectors = np.vstack(self.pending)
+        self.pending = []
+        self.pending_count = 0
+        self.index.train(vectors)
+        self.index.add(vectors)
+
+    def close(self):
+        if self.pending:
+            self._train()
+        return self.index
+
+
+class FaissIndexManager:
+    """
+    Versioned FAISS indexes of a corpus for the langchain apps.
+
+    Every build is written to its own folder under path (v0001, v0002, ...)
+    with the index, the langchain docstore and a manifest of what it was
+    built from: embedding model, chunker settings, index type, a hash of the
+    corpus and the size, mtime, content hash and vector range of every file.
+    CURRENT names the version in use; it is switched only once a new version
+    is complete, so an interrupted build leaves the last good one in place.
+    The vectors of flat and ivf indexes are memory mapped on load where
+    faiss supports it, so startup does not read them; the docstore (the
+    chunk texts) is unpickled, so its load time grows with the corpus.
+
+    open() loads the current version when its manifest matches the corpus.
+    When files were added, changed or removed, only the new and changed
+    files are embedded: their chunks are appended to a copy of the index,
+    and the vectors of changed and removed files are left out of it. A
+    version that differs only in index type is re-indexed from its stored
+    vectors. Everything that would re-embed the whole corpus (other
+    settings, a damaged version or an index saved before manifests existed)
+    raises RebuildRequired unless rebuild=True; the first build of an empty
+    folder needs no flag.
+
+    Files are chunked in a process pool and embedded in batches of
+    EMBED_BATCH chunks, so memory beyond the index and docstore themselves
+    stays bounded however large the corpus is.
+    """
+
+    def __init__(self, path, embeddings, chunker, index_type=DEFAULT_INDEX_TYPE, nprobe=DEFAULT_NPROBE,
+                 keep=KEEP_VERSIONS, verify=VERIFY, workers=CHUNK_WORKERS):
+        self.path = path
+        self.embeddings = embeddings
+        self.embedding_model = getattr(embeddings, 'document_model_name', None) or getattr(embeddings, 'model', type(embeddings).__name__)
+        self.chunker = chunker
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.keep = keep
+        self.verify = verify
+        self.workers = workers
+
+    def expected_manifest(self, files, root='.', previous=None):
+        stats = file_stats(files, root, previous)
+        return {
+            'embedding_model': self.embedding_model,
+            'chunker': self.chunker,
+            'corpus_hash': corpus_hash(stats),
+            'index_type': self.index_type,
+            'files': stats,
+        }
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.path, CURRENT)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def versions(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.startswith('v') and name[1:].isdigit())
+
+    def read_manifest(self, version):
+        with open(os.path.join(self.path, version, MANIFEST)) as f:
+            return json.load(f)
+
+    def differences(self, manifest, expected):
+        return [field for field in MATCH_FIELDS if manifest.get(field) != expected[field]]
+
+    def read(self, version, manifest, mmap=True):
+        """
+        Returns the faiss index, docstore and index to docstore id map of
+        version. Raises ValueError when its files do not match its manifest.
+        """
+        folder = os.path.join(self.path, version)
+        for name, expected in manifest['artifacts'].items():
+            file = os.path.join(folder, name)
+            if os.path.getsize(file) != expected['size']:
+                raise ValueError(f"{file} has {os.path.getsize(file)} bytes, expected {expected['size']}")
+            if self.verify and file_hash(file) != expected['sha256']:
+                raise ValueError(f"{file} does not match its checksum")
+
+        index = read_index(os.path.join(folder, INDEX_FILE), mmap, manifest.get('spec'))
+        with open(os.path.join(folder, DOCSTORE_FILE), 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        if index.ntotal != manifest['count'] or len(index_to_docstore_id) != manifest['count']:
+            raise ValueError(f"{folder} holds {index.ntotal} vectors and {len(index_to_docstore_id)} ids, expected {manifest['count']}")
+        return index, docstore, index_to_docstore_id
+
+    def load(self, version, manifest=None):
+        """
+        Loads version as a langchain FAISS vector store.
+        """
+        from langchain.vectorstores import FAISS
+
+        if manifest is None:
+            manifest = self.read_manifest(version)
+        index, docstore, index_to_docstore_id = self.read(version, manifest)
+        self._set_nprobe(index)
+        return FAISS(self.embeddings.embed_query, index, docstore, index_to_docstore_id)
+
+    def _set_nprobe(self, index):
+        import faiss
+
+        try:
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        except RuntimeError:
+            # not an ivf index
+            pass
+
+    def _previous_files(self, version):
+        # file stats of version, to skip hashing unchanged files
+        try:
+            return self.read_manifest(version)['files']
+        except Exception:
+            return None
+
+    def open(self, files, splitter, rebuild=False, root='.'):
+        """
+        Returns the vector store of the corpus files, loading the current
+        version when it matches and writing a new one otherwise (see the
+        class docstring for when that needs rebuild=True). splitter is the
+        langchain text splitter that chunks the files; it must be picklable.
+        """
+        version = self.current_version()
+        expected = self.expected_manifest(files, root, self._previous_files(version) if version else None)
+
+        if version is None:
+            if os.path.exists(os.path.join(self.path, INDEX_FILE)) and not rebuild:
+                raise RebuildRequired(f"{self.path} holds an index without a manifest. Run with --rebuild to re-embed the corpus.")
+            print("No saved index found, creating new embeddings.")
+            return self._write(expected, splitter, root, add=list(expected['files']))
+
+        try:
+            manifest = self.read_manifest(version)
+            differences = self.differences(manifest, expected)
+            if not differences:
+                db = self.load(version, manifest)
+                print(f"Loaded embeddings from local storage ({version}).")
+                return db
+            if set(differences) <= {'corpus_hash', 'index_type'} and (self.index_type == manifest['index_type'] or exact_vectors(manifest['spec'])):
+                return self.update(version, manifest, expected, splitter, root)
+        except Exception as e:
+            logging.error("Could not load index %s: %s", version, e)
+            db = self.load_fallback(expected, version)
+            if db is not None:
+                return db
+            if not rebuild:
+                raise RebuildRequired(f"Index {version} in {self.path} is damaged ({e}). Run with --rebuild to re-embed the corpus.")
+            return self._write(expected, splitter, root, add=list(expected['files']))
+
+        if not rebuild:
+            raise RebuildRequired(f"Index {version} in {self.path} is stale ({', '.join(differences)} changed). "
+                                  "Run with --rebuild to re-embed the corpus.")
+        print(f"Index {version} is stale ({', '.join(differences)} changed), creating new embeddings.")
+        return self._write(expected, splitter, root, add=list(expected['files']))
+
+    def load_fallback(self, expected, damaged):
+        # the newest older version that matches the corpus and loads
+        for version in reversed(self.versions()):
+            if version == damaged:
+                continue
+            try:
+                manifest = self.read_manifest(version)
+                if self.differences(manifest, expected):
+                    continue
+                db = self.load(version, manifest)
+            except Exception as e:
+                logging.error("Could not load index %s: %s", version, e)
+                continue
+            self._set_current(version)
+            print(f"Loaded embeddings from local storage ({version}, {damaged} is damaged).")
+            return db
+        return None
+
+    def update(self, version, manifest, expected, splitter, root='.'):
+        """
+        Writes a new version from version with the chunks of new and changed
+        files embedded and appended, and the vectors of changed and removed
+        files left out.
+        """
+        old, new = manifest['files'], expected['files']
+        add = [rel for rel in new if rel not in old or old[rel]['sha256'] != new[rel]['sha256']]
+        drop = [rel for rel in old if rel not in new or old[rel]['sha256'] != new[rel]['sha256']]
+        print(f"Updating {version}: embedding {len(add)} new or changed files, dropping {len(drop)} changed or removed files.")
+        if self.index_type != manifest['index_type']:
+            print(f"Re-indexing {version} as {self.index_type} from its stored vectors.")
+        # appending in place and cloning the trained index (same index type)
+        # need the index in memory; faiss cannot clone memory mapped lists.
+        # Re-indexing as another type only reads the vectors
+        source = self.read(version, manifest, mmap=self.index_type != manifest['index_type'])
+        return self._write(expected, splitter, root, add, drop, source, manifest)
+
+    def _write(self, expected, splitter, root, add, drop=(), source=None, manifest=None):
+        import faiss
+        from langchain.docstore.document import Document
+        from langchain.docstore.in_memory import InMemoryDocstore
+
+        files = {}
+        index = spec = None
+        if source is not None and not drop and self.index_type == manifest['index_type']:
+            # append to the index of the source version
+            index, docstore, index_to_docstore_id = source
+            spec = manifest['spec']
+            files = {rel: dict(expected['files'][rel], start=stats['start'], count=stats['count'])
+                     for rel, stats in manifest['files'].items()}
+            source = None
+        else:
+            docstore = InMemoryDocstore({})
+            index_to_docstore_id = {}
+
+        # the number of vectors the new index will hold, to size an ivf index
+        estimated = sum(expected['files'][rel]['size'] for rel in add) // max(1, getattr(splitter, '_chunk_size', 1000))
+        writer = IndexWriter(index) if index is not None else None
+
+        def new_writer(dimension, kept):
+            nonlocal spec
+            if source is not None and self.index_type == manifest['index_type']:
+                # an empty copy of the source index keeps its training
+                spec = manifest['spec']
+                target = faiss.clone_index(source[0])
+                target.reset()
+            else:
+                spec = factory_string(self.index_type, dimension, kept + estimated)
+                target = faiss.index_factory(dimension, spec)
+            return IndexWriter(target, min(TRAIN_VECTORS, kept + estimated))
+
+        if source is not None:
+            # copy the vectors of the files that are kept
+            old_index, old_docstore, old_ids = source
+            if manifest['spec'] != 'Flat':
+                # ivf indexes reconstruct vectors through a direct map
+                faiss.extract_index_ivf(old_index).make_direct_map()
+            kept = sorted((stats['start'], stats['count'], rel) for rel, stats in manifest['files'].items() if rel not in drop)
+            writer = new_writer(manifest['dimension'], sum(count for _, count, _ in kept))
+            for start, count, rel in kept:
+                files[rel] = dict(expected['files'][rel], start=len(index_to_docstore_id), count=count)
+                for offset in range(start, start + count, COPY_BATCH):
+                    n = min(COPY_BATCH, start + count - offset)
+                    writer.add(old_index.reconstruct_n(offset, n))
+                    for i in range(offset, offset + n):
+                        id = old_ids[i]
+                        # InMemoryDocstore.add copies the whole dict on every call
+                        docstore._dict[id] = old_docstore.search(id)
+                        index_to_docstore_id[len(index_to_docstore_id)] = id
+            del old_index, old_docstore, old_ids, source
+
+        batch = []
+
+        def embed(chunks):
+            nonlocal writer
+            vectors = np.array(self.embeddings.embed_documents([text for text, _ in chunks]), dtype=np.float32)
+            if writer is None:
+                writer = new_writer(vectors.shape[1], 0)
+            writer.add(vectors)
+            for text, metadata in chunks:
+                id = str(uuid.uuid4())
+                docstore._dict[id] = Document(page_content=text, metadata=metadata)
+                index_to_docstore_id[len(index_to_docstore_id)] = id
+
+        if add:
+            print(f"Embedding {len(add)} files with {self.embedding_model}.")
+        paths = [os.path.normpath(os.path.join(str(root), rel)) for rel in add]
+        for path, chunks in iter_chunks(paths, splitter, self.workers):
+            rel = pathlib.Path(os.path.relpath(path, str(root))).as_posix()
+            files[rel] = dict(expected['files'][rel], start=len(index_to_docstore_id) + len(batch), count=len(chunks))
+            batch.extend(chunks)
+            while len(batch) >= EMBED_BATCH:
+                embed(batch[:EMBED_BATCH])
+                batch = batch[EMBED_BATCH:]
+        if batch:
+            embed(batch)
+
+        if writer is None:
+            raise ValueError("The corpus has no text to index")
+        index = writer.close()
+        return self._save(index, spec, docstore, index_to_docstore_id, dict(expected, files=files))
+
+    def _save(self, index, spec, docstore, index_to_docstore_id, manifest):
+        import faiss
+        from langchain.vectorstores import FAISS
+
+        self._set_nprobe(index)
+        os.makedirs(self.path, exist_ok=True)
+        versions = self.versions()
+        version = f'v{int(versions[-1][1:]) + 1 if versions else 1:04d}'
+        tmp = os.path.join(self.path, f'.tmp-{version}-{uuid.uuid4().hex[:8]}')
+        os.makedirs(tmp)
+        try:
+            faiss.write_index(index, os.path.join(tmp, INDEX_FILE))
+            with open(os.path.join(tmp, DOCSTORE_FILE), 'wb') as f:
+                pickle.dump((docstore, index_to_docstore_id), f)
+            manifest = dict(manifest, spec=spec, dimension=index.d, count=index.ntotal, artifacts={
+                name: {'size': os.path.getsize(os.path.join(tmp, name)), 'sha256': file_hash(os.path.join(tmp, name))}
+                for name in (INDEX_FILE, DOCSTORE_FILE)
+            })
+            with open(os.path.join(tmp, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp, os.path.join(self.path, version))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self._set_current(version)
+        self._prune(version)
+        print(f"Saved embeddings to local storage ({version}, {spec}, {index.ntotal} vectors).")
+        return FAISS(self.embeddings.embed_query, index, docstore, index_to_docstore_id)
+
+    def _set_current(self, version):
+        tmp = os.path.join(self.path, f'{CURRENT}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(self.path, CURRENT))
+
+    def _prune(self, current):
+        older = [version for version in self.versions() if version != current]
+        for version in older[:max(0, len(older) - (self.keep - 1))]:
+            shutil.rmtree(os.path.join(self.path, version), ignore_errors=True)
+        # left behind by interrupted builds
+        for name in os.listdir(self.path):
+            if name.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
@@ -1,5 +1,7 @@
+import argparse
 import os
-from langchain.document_loaders import TextLoader
+import pathlib
+import sys
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
@@ -8,6 +10,11 @@ from langchain.llms import OpenAI
 from langchain.chains import ConversationalRetrievalChain
 from elevenlabslib import *
 
+# the index lifecycle and chat history are shared with ../app.py
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from chat_history import ChatHistory
+from vector_index import DEFAULT_INDEX_TYPE, FaissIndexManager, RebuildRequired
+
 # init elevenlabs
 speak = True
 user = ElevenLabsUser("elevenlabskey")
@@ -17,37 +24,35 @@ voice = user.get_voices_by_name("Geert")[0]
 # get openai key from environment
 OpenAI.openai_api_key = os.getenv('OPENAI_API_KEY')
 
+parser = argparse.ArgumentParser(description="Voice chat about 1984.")
+parser.add_argument("--rebuild", action="store_true", help="re-embed the book when the saved index is stale or damaged")
+parser.add_argument("--index-type", default=DEFAULT_INDEX_TYPE, help="flat, ivf, ivfpq or a faiss index_factory string")
+args = parser.parse_args()
+
 # initialize wrapper around openai embeddings
 # the embeddings are either loaded from local storage (faiss_index folder)
 # or created from scratch
 embeddings = OpenAIEmbeddings()
+text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
 
-# try to load embeddings from local, otherwise re-create them
+
+# load the saved index when it was built from the same book and settings;
+# new embeddings are only created for a new folder, a changed book or with --rebuild
+manager = FaissIndexManager("faiss_index", embeddings,
+                            {"loader": "text", "splitter": "CharacterTextSplitter", "chunk_size": 1000, "chunk_overlap": 0},
+                            index_type=args.index_type)
 try:
-    db = FAISS.load_local("faiss_index", embeddings)
-    print("Loaded embeddings from local storage.")
-except Exception as e:
+    db = manager.open([pathlib.Path("./docs/1984.txt")], text_splitter, rebuild=args.rebuild)
+except RebuildRequired as e:
     print(e)
-    print("Could not load embeddings from local storage. Creating new embeddings.")
-
-    # Load documents from a folder
-    loader = TextLoader("./docs/1984.txt")
-    documents = loader.load()
-
-    # Split documents into chunks
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    documents = text_splitter.split_documents(documents)
-
-    # Create embeddings for chunks
-    db = FAISS.from_documents(documents, embeddings)
-
-    # Save embeddings to local storage
-    db.save_local("faiss_index")
+    sys.exit(1)
 
 # Initialize the ConversationalRetrievalChain
-qa = ConversationalRetrievalChain.from_llm(OpenAI(temperature=0), db.as_retriever(search_kwargs={"k": 5}), return_source_documents=True)
+llm = OpenAI(temperature=0)
+qa = ConversationalRetrievalChain.from_llm(llm, db.as_retriever(search_kwargs={"k": 5}), return_source_documents=True)
 
 def ask_question(query, chat_history=None):
+    # query is already condensed by ChatHistory, so chat_history is usually empty
     if chat_history is None:
         chat_history = []
     result = qa({"question": query, "chat_history": chat_history})
@@ -56,16 +61,17 @@ def ask_question(query, chat_history=None):
 
 
 print("Welcome to the Chat Interface! Type 'exit' to quit.")
-chat_history = []
-chat_history.append({"role": "system", "content": "You are a literary assistant for the book 1984! Only answer questions about the book"})
+# recent turns within a token budget plus a rolling summary of older ones
+history = ChatHistory(llm, qa.question_generator,
+                      system="You are a literary assistant for the book 1984! Only answer questions about the book")
 
 while True:
     user_input = input("You: ")
     if user_input.lower() == "exit":
         break
-    answer = ask_question(user_input, chat_history)
-    chat_history.append({"role": "user", "content": user_input})
-    chat_history.append({"role": "assistant", "content": answer})
+    question = history.condense(user_input)
+    answer = ask_question(question)
+    history.add(user_input, answer, question)
     print("Assistant:", answer)
 
     if speak:
@@ -73,6 +79,6 @@ while True:
 
     # pretty print chat history
     print("Chat History:")
-    for item in chat_history:
-        print(f"{item['role']}: {item['content']}")
+    for role, content in history.messages():
+        print(f"{role}: {content}")
     print("")
@@ -1,42 +1,24 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin
+import sys
+import pathlib
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-def scrape_website(url, depth, base_url=None):
-    if depth <= 0:
-        return []
-
-    if not base_url:
-        base_url = urlparse(url).scheme + "://" + urlparse(url).netloc
+# add the shared helpers folder to path (crawler)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent / "streamlit" / "helpers"))
 
-    internal_links = set()
-    response = requests.get(url)
-    if response.status_code != 200:
-        logging.warning(f"Failed to fetch URL: {url}")
-        return []
+from crawler import crawl_website
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    for link in soup.find_all("a"):
-        href = link.get("href")
-        if not href:
-            continue
-
-        full_url = urljoin(base_url, href)
-        parsed_url = urlparse(full_url)
-
-        if parsed_url.netloc == urlparse(base_url).netloc and parsed_url.scheme in ["http", "https"]:
-            internal_links.add(full_url)
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def scrape_website(url, depth):
+    # breadth-first crawl; every page is fetched only once and pages of one
+    # level are fetched concurrently over a shared keep-alive session
     scraped_links = []
-    for link in internal_links:
-        logging.info(f"Scraping link: {link}")
-        scraped_links.extend(scrape_website(link, depth - 1, base_url))
+    for page in crawl_website(url, depth):
+        logging.info(f"Found link: {page['link']}")
+        scraped_links.append(page['link'])
 
-    return list(internal_links) + scraped_links
+    return scraped_links
 
 if __name__ == "__main__":
     website_url = "https://learn.microsoft.com/en-us/azure/aks/"  # Replace with your desired website URL
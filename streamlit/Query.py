@@ -5,24 +5,36 @@ import pathlib
 sys.path.append(str(pathlib.Path().absolute()) + "/helpers")
 
 import os
-import pinecone
 import openai
 import tiktoken
 import streamlit as st
-from helpers import tiktoken_len, search_pinecone, gpt
+from helpers import tiktoken_len, search_pinecone, gpt_stream, get_index
+from context_packer import context_budget
 import dotenv
 
-dotenv.load_dotenv(dotenv_path='./.env')
+
+@st.cache_resource
+def missing_settings():
+    # runs once per process instead of on every rerun
+    dotenv.load_dotenv(dotenv_path='./.env')
+
+    # Pinecone settings are only needed for the Pinecone backend
+    required = ['OPENAI_API_KEY']
+    if os.getenv('VECTOR_STORE', 'pinecone') == 'pinecone':
+        required = ['PINECONE_API_KEY', 'PINECONE_ENVIRONMENT'] + required
+    return [name for name in required if os.getenv(name) is None]
+
 
 # check environment variables
-if os.getenv('PINECONE_API_KEY') is None:
-    st.error("PINECONE_API_KEY not set. Please set this environment variable and restart the app.")
+for name in missing_settings():
+    st.error(f"{name} not set. Please set this environment variable and restart the app.")
     st.stop()
-if os.getenv('PINECONE_ENVIRONMENT') is None:
-    st.error("PINECONE_ENVIRONMENT not set. Please set this environment variable and restart the app.")
-    st.stop()
-if os.getenv('OPENAI_API_KEY') is None:
-    st.error("OPENAI_API_KEY not set. Please set this environment variable and restart the app.")
+
+# connect to the vector store once per process, not on every search
+try:
+    get_index()
+except Exception as e:
+    st.error(f"Error connecting to the vector store: {e}")
     st.stop()
 
 # create a title for the app
@@ -53,10 +65,21 @@ with st.expander("Options"):
         reply_tokens = st.slider("Reply tokens", 750, max_reply_tokens, 750)
     
 
+# the answer prompt without its context; the context fills the rest of
+# the model's context window, leaving room for the reply
+PROMPT = """Answer the following query based on the context below ---: {query}
+                                                Do not answer beyond this context!
+                                                ---
+                                                {context}"""
+
 # create a submit button
 if st.button("Search"):
-    # perform Pinecone search and return the urls and chunks
-    urls, chunk_texts, all_chunks = search_pinecone(your_query, num_chunks)
+    # perform Pinecone search and return the urls and chunks; duplicate and
+    # overlapping chunks are merged and the context is cut to the token budget.
+    # Results for the same query, number of chunks and budget are reused for
+    # SEARCH_CACHE_TTL seconds
+    budget = context_budget(model, reply_tokens, PROMPT.format(query=your_query, context=""))
+    urls, chunk_texts, all_chunks = search_pinecone(your_query, num_chunks, budget)
     
     # show urls of the chunks in expanded section
     with st.expander("URLs", expanded=True):
@@ -70,30 +93,30 @@ if st.button("Search"):
             tokens = tiktoken_len(t)
             t = t.replace("\n", " ")
             st.write("Chunk ", i, "(Tokens: ", tokens, ") - ", t[:50] + "...")
+        st.write("Context tokens: ", tiktoken_len(all_chunks), " of ", budget)
 
-    # chatgpt with article as context
-    with st.spinner("Summarizing..."):
-    
-        prompt = f"""Answer the following query based on the context below ---: {your_query}
-                                                    Do not answer beyond this context!
-                                                    ---
-                                                    {all_chunks}"""
+    # chatgpt with article as context; the answer is rendered while it streams in
+    prompt = PROMPT.format(query=your_query, context=all_chunks)
 
-        response_text, full_response = gpt(prompt, model, temperature, reply_tokens)
-
-        # if full_response is None then stop
-        if full_response is None:
-            st.stop()
-        else:
-            st.markdown("### Answer:")
-            st.write(response_text)
+    st.markdown("### Answer:")
+    answer = st.empty()
+    response_text = ""
+    with st.spinner("Summarizing..."):
+        for delta in gpt_stream(prompt, model, temperature, reply_tokens):
+            response_text += delta
+            answer.markdown(response_text + "▌")
 
-            with st.expander("More information"):
-                st.write("Query: ", your_query)
-                st.write("Full Response: ", full_response)
+    # if nothing was returned then stop
+    if response_text == "":
+        st.stop()
+    else:
+        answer.markdown(response_text)
 
-            with st.expander("Full Prompt"):
-                st.write(prompt)
+        with st.expander("More information"):
+            st.write("Query: ", your_query)
+            st.write("Model: ", model, ", reply tokens: ", tiktoken_len(response_text))
 
-            st.balloons()
+        with st.expander("Full Prompt"):
+            st.write(prompt)
 
+        st.balloons()
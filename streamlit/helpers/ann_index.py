@@ -0,0 +1,171 @@
+import json
+import os
+import numpy as np
+
+DEFAULT_NLIST = int(os.getenv('IVF_NLIST', 256))
+DEFAULT_NPROBE = int(os.getenv('IVF_NPROBE', 16))
+
+# number of vectors per list needed before the coarse quantizer is trained
+MIN_POINTS_PER_LIST = 39
+# sample at most this many vectors per list when training
+MAX_POINTS_PER_LIST = 256
+
+
+class IVFIndex:
+    """
+    Inverted-file index for L2-normalized vectors with cosine similarity.
+
+    A coarse quantizer of nlist centroids is trained with spherical k-means
+    once enough vectors are stored. Every vector is assigned to its closest
+    centroid; a query scores the centroids, scans only the vectors of the
+    nprobe best lists and ranks them exactly. More lists make each list
+    smaller (faster), more probes scan more lists (better recall).
+
+    The index does not own the vectors. It keeps one list id per row of the
+    store matrix, so rows must be passed in as they are added, and compacted
+    with the same mask when the store compacts its rows. Until it is trained,
+    the index reports itself as not ready and the store scans all rows.
+    """
+
+    def __init__(self, nlist=DEFAULT_NLIST, nprobe=DEFAULT_NPROBE):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.lists = None
+        self._list_arrays = {}
+
+    @property
+    def ready(self):
+        return self.centroids is not None
+
+    def _train(self, vectors, iterations=10, seed=0):
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        sample_size = min(n, self.nlist * MAX_POINTS_PER_LIST)
+        sample = vectors[rng.choice(n, sample_size, replace=False)] if sample_size < n else np.asarray(vectors)
+
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(self.nlist):
+                members = sample[labels == c]
+                if len(members) == 0:
+                    # re-seed empty lists with a random sample vector
+                    centroids[c] = sample[rng.integers(len(sample))]
+                else:
+                    centroids[c] = members.sum(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms == 0, 1, norms)
+        self.centroids = centroids.astype(np.float32)
+
+    def _nearest(self, vectors):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        # assign in blocks to bound the size of the score matrix
+        for start in range(0, len(vectors), 8192):
+            block = vectors[start:start + 8192]
+            labels[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def maybe_train(self, matrix, count, alive):
+        """
+        Trains the quantizer once there are enough live vectors and assigns
+        every row. Returns True if the index was trained by this call.
+        """
+        if self.ready or count < self.nlist * MIN_POINTS_PER_LIST:
+            return False
+        self._train(matrix[:count][alive[:count]])
+        self.assign = self._nearest(matrix[:count])
+        self._build_lists()
+        return True
+
+    def _build_lists(self):
+        # group row numbers by list id
+        order = np.argsort(self.assign, kind='stable')
+        bounds = np.searchsorted(self.assign[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(self.nlist)]
+        self._list_arrays = {}
+
+    def compact(self, keep):
+        """
+        Drops the rows where the boolean mask keep is False, in step with
+        the store compacting its matrix.
+        """
+        if not self.ready:
+            return
+        self.assign = self.assign[:len(keep)][keep]
+        self._build_lists()
+
+    def add(self, rows, vectors):
+        """
+        Assigns new or overwritten rows to their closest list.
+        """
+        if not self.ready or len(rows) == 0:
+            return
+        labels = self._nearest(vectors)
+        needed = max(rows) + 1
+        if needed > len(self.assign):
+            assign = np.full(max(needed, len(self.assign) * 2), -1, dtype=np.int32)
+            assign[:len(self.assign)] = self.assign
+            self.assign = assign
+        for row, label in zip(rows, labels):
+            if self.assign[row] == label:
+                continue
+            # an overwritten row leaves a stale entry in its old list;
+            # candidates() skips rows whose assignment does not match, so
+            # the cached arrays of both lists are rebuilt
+            old = int(self.assign[row])
+            self.assign[row] = label
+            self.lists[label].append(row)
+            self._list_arrays.pop(int(label), None)
+            if old >= 0:
+                self._list_arrays.pop(old, None)
+
+    def candidates(self, query, nprobe=None):
+        """
+        Returns the rows in the nprobe lists closest to query.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = self.centroids @ query
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+
+        rows = []
+        for c in probe:
+            c = int(c)
+            if c not in self._list_arrays:
+                array = np.asarray(self.lists[c], dtype=np.int64)
+                # a row that moved away and back is in its list twice
+                self._list_arrays[c] = np.unique(array[self.assign[array] == c]) if len(array) else array
+            rows.append(self._list_arrays[c])
+        return np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+
+    def save(self, path, count):
+        params = {'type': 'ivf', 'nlist': self.nlist, 'nprobe': self.nprobe}
+        with open(os.path.join(path, 'ann.json'), 'w') as f:
+            json.dump(params, f)
+        if self.ready:
+            np.save(os.path.join(path, 'ann_centroids.npy'), self.centroids)
+            np.save(os.path.join(path, 'ann_assign.npy'), self.assign[:count])
+        else:
+            for name in ('ann_centroids.npy', 'ann_assign.npy'):
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved next to a store. Returns None if there is no
+        saved index.
+        """
+        params_path = os.path.join(path, 'ann.json')
+        if not os.path.exists(params_path):
+            return None
+        with open(params_path) as f:
+            params = json.load(f)
+        index = cls(nlist=params['nlist'], nprobe=params['nprobe'])
+        centroids_path = os.path.join(path, 'ann_centroids.npy')
+        if os.path.exists(centroids_path):
+            index.centroids = np.load(centroids_path)
+            index.assign = np.load(os.path.join(path, 'ann_assign.npy'))
+            index._build_lists()
+        return index
@@ -0,0 +1,276 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no lock between processes
+    fcntl = None
+
+DEFAULT_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_SIZE', 1000))
+DEFAULT_MAX_AGE = int(os.getenv('ANSWER_CACHE_TTL', 24 * 3600))
+# cosine similarity above which two queries count as the same question
+DEFAULT_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+# urls whose vectors changed, appended by ingestion and read by every cache
+DEFAULT_LOG = os.getenv('ANSWER_CACHE_INVALIDATION_LOG', os.path.join(os.path.expanduser('~'), '.cache', 'gpt-vectors', 'answer-invalidations.log'))
+# the log is compacted when an append finds it larger than this
+DEFAULT_LOG_MAX_BYTES = int(os.getenv('ANSWER_CACHE_LOG_MAX_BYTES', 1024 * 1024))
+
+
+def sources_key(source_ids):
+    # the set of retrieved vector ids, independent of their order
+    digest = hashlib.sha1(json.dumps(sorted(source_ids)).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little', signed=True)
+
+
+def _parse_log(data):
+    # (time, url) of every complete line
+    entries = []
+    for line in data.decode('utf-8').splitlines():
+        parts = line.split('\t', 1)
+        if len(parts) == 2:
+            entries.append((float(parts[0]), parts[1]))
+    return entries
+
+
+@contextlib.contextmanager
+def _log_lock(path):
+    # appends and compactions of the log exclude each other across processes
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def compact_log(path=DEFAULT_LOG, max_age=DEFAULT_MAX_AGE):
+    """
+    Rewrites the log with the newest entry of every url logged in the last
+    max_age seconds. Older entries only concern expired answers, and an
+    invalidation of a url covers its earlier ones, so no cache misses an
+    invalidation. The log is replaced, not truncated; readers notice the
+    new file and read only the entries newer than what they have seen.
+    """
+    with open(path, 'rb') as f:
+        entries = _parse_log(f.read())
+    cutoff = time.time() - max_age
+    newest = {}
+    for t, url in entries:
+        if t >= cutoff:
+            newest[url] = max(t, newest.get(url, t))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(''.join(f"{t}\t{url}\n" for url, t in sorted(newest.items(), key=lambda item: item[1])))
+    os.replace(tmp, path)
+
+
+def log_invalidations(urls, path=DEFAULT_LOG, max_bytes=DEFAULT_LOG_MAX_BYTES):
+    """
+    Records that the vectors of urls changed, so cached answers based on
+    them are dropped by every process that uses an AnswerCache. The log is
+    compacted once it grows beyond max_bytes.
+    """
+    urls = list(urls)
+    if not urls:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _log_lock(path):
+        now = time.time()
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(f"{now}\t{url}\n" for url in urls))
+        if os.path.getsize(path) > max_bytes:
+            compact_log(path)
+
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers.
+
+    An entry holds the normalized query embedding, the model, the ids of the
+    retrieved chunks, their urls and the answer. get() returns the answer of
+    the most similar earlier query (cosine similarity of at least threshold)
+    that used the same model and retrieved the same chunks, so paraphrased
+    questions skip the completion while answers never outlive their sources.
+
+    Embeddings are kept in one preallocated float32 matrix, so a lookup is a
+    single matrix-vector product over the candidate rows. Entries expire
+    after max_age seconds; when the cache is full, the least recently used
+    entry is replaced. Entries whose urls appear in the invalidation log
+    (see log_invalidations) are dropped before every lookup; only the bytes
+    appended since the last lookup are read.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE, threshold=DEFAULT_THRESHOLD, log_path=DEFAULT_LOG):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.threshold = threshold
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.log_lock = threading.Lock()
+
+        self.matrix = None
+        self.alive = np.zeros(max_entries, dtype=bool)
+        self.models = np.full(max_entries, -1, dtype=np.int32)
+        self.sources = np.zeros(max_entries, dtype=np.int64)
+        self.created = np.zeros(max_entries)
+        self.used = np.zeros(max_entries)
+        self.answers = [None] * max_entries
+        self.urls = [None] * max_entries
+        self.model_ids = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+        # only invalidations logged from now on concern this (empty) cache
+        self.log_inode = None
+        self.log_offset = 0
+        self.log_time = time.time()
+        if log_path and os.path.exists(log_path):
+            st = os.stat(log_path)
+            self.log_inode, self.log_offset = st.st_ino, st.st_size
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _sync(self):
+        # read the invalidations appended since the last lookup
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+        with self.log_lock:
+            self._read_log()
+
+    def _read_log(self):
+        st = os.stat(self.log_path)
+        compacted = st.st_ino != self.log_inode
+        if compacted:
+            # a new file (see compact_log): read it from the start, but skip
+            # the entries that were read before
+            self.log_inode = st.st_ino
+            self.log_offset = 0
+        elif st.st_size == self.log_offset:
+            return
+        elif st.st_size < self.log_offset:
+            # the log was truncated; nothing is known about what changed
+            self.clear()
+            self.log_offset = st.st_size
+            return
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.log_offset)
+            data = f.read(st.st_size - self.log_offset)
+        # a partially written last line is read on the next sync
+        end = data.rfind(b'\n') + 1
+        self.log_offset += end
+        entries = _parse_log(data[:end])
+        if compacted:
+            entries = [(t, url) for t, url in entries if t > self.log_time]
+        if entries:
+            self.log_time = max(self.log_time, max(t for t, _ in entries))
+        self.invalidate(url for _, url in entries)
+
+    def get(self, query_vector, model, source_ids):
+        """
+        Returns the cached answer for a query similar to query_vector that
+        used model and retrieved exactly source_ids, or None.
+        """
+        self._sync()
+        query = self._normalize(query_vector)
+        with self.lock:
+            now = time.time()
+            self.alive &= self.created > now - self.max_age
+            model_id = self.model_ids.get(model)
+            if self.matrix is None or model_id is None or len(query) != self.matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            rows = np.flatnonzero(self.alive & (self.models == model_id) & (self.sources == sources_key(source_ids)))
+            if len(rows) == 0:
+                self.misses += 1
+                return None
+
+            scores = self.matrix[rows] @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            row = rows[best]
+            self.used[row] = now
+            self.hits += 1
+            return self.answers[row]
+
+    def put(self, query_vector, model, source_ids, urls, answer):
+        query = self._normalize(query_vector)
+        with self.lock:
+            if self.matrix is None or self.matrix.shape[1] != len(query):
+                self.matrix = np.zeros((self.max_entries, len(query)), dtype=np.float32)
+                self.alive[:] = False
+
+            # a free row, or the least recently used one
+            free = np.flatnonzero(~self.alive)
+            row = int(free[0]) if len(free) else int(np.argmin(self.used))
+
+            now = time.time()
+            self.matrix[row] = query
+            self.alive[row] = True
+            self.models[row] = self.model_ids.setdefault(model, len(self.model_ids))
+            self.sources[row] = sources_key(source_ids)
+            self.created[row] = now
+            self.used[row] = now
+            self.answers[row] = answer
+            self.urls[row] = set(urls)
+
+    def invalidate(self, urls):
+        """
+        Drops the answers that were based on any of urls.
+        """
+        urls = set(urls)
+        if not urls:
+            return
+        with self.lock:
+            for row in np.flatnonzero(self.alive):
+                if self.urls[row] & urls:
+                    self.alive[row] = False
+                    self.answers[row] = None
+                    self.invalidated += 1
+
+    def clear(self):
+        with self.lock:
+            self.alive[:] = False
+            self.answers = [None] * self.max_entries
+            self.urls = [None] * self.max_entries
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': int(self.alive.sum()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidated': self.invalidated,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+_answer_cache = None
+
+def get_answer_cache():
+    """
+    Returns the process-wide answer cache, or None when ANSWER_CACHE=0.
+    """
+    global _answer_cache
+    if os.getenv('ANSWER_CACHE', '1') == '0':
+        return None
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
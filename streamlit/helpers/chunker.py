@@ -0,0 +1,159 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DEFAULT_SEPARATORS = ('\n\n', '\n', ' ')
+
+# byte length of every token id seen so far, per encoding, shared by all chunkers
+_token_lengths = {}
+
+
+class TokenChunker:
+    """
+    Splits text into chunks of at most chunk_size tokens with chunk_overlap
+    tokens of overlap, like RecursiveCharacterTextSplitter with
+    length_function=tiktoken_len, but the text is encoded only once.
+
+    Separator boundaries ("\\n\\n", "\\n", " ") are located in token-offset
+    space: a chunk ends at the strongest separator in the second half of its
+    token window (the last one if there are several), or exactly at
+    chunk_size tokens if the window has no separator. Chunks therefore hold
+    at most chunk_size tokens, and at least half of that except for the
+    last one, rather than exactly chunk_size: like the splitter it
+    replaces, it keeps paragraphs and words whole. The only exception is a
+    single character of more tokens than chunk_size, which is not split.
+    The overlap of the next chunk is at most chunk_overlap tokens and
+    starts at a word boundary when possible.
+
+    encoding defaults to the cl100k_base tokenizer of embeddings.py, loaded
+    on first use.
+    """
+
+    def __init__(self, chunk_size=400, chunk_overlap=20, separators=DEFAULT_SEPARATORS, encoding=None):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = [separator for separator in separators if separator]
+        self._encoding = encoding
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            # tiktoken loads (and may download) the encoding on import
+            from embeddings import tokenizer
+            self._encoding = tokenizer
+        return self._encoding
+
+    def _byte_offsets(self, tokens):
+        # start offset of every token in the utf-8 encoded text, plus the end
+        lengths = np.empty(len(tokens), dtype=np.int64)
+        known = _token_lengths.setdefault(getattr(self.encoding, 'name', id(self.encoding)), {})
+        for i, token in enumerate(tokens):
+            length = known.get(token)
+            if length is None:
+                length = len(self.encoding.decode_single_token_bytes(token))
+                known[token] = length
+            lengths[i] = length
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return offsets
+
+    def _char_starts(self, data, offsets):
+        # True where a token starts a utf-8 character; tokens of multi-byte
+        # characters can start with a continuation byte (0b10xxxxxx)
+        starts = np.ones(len(offsets), dtype=bool)
+        inside = offsets[:-1] < len(data)
+        first_bytes = np.frombuffer(data, dtype=np.uint8)[offsets[:-1][inside]]
+        starts[:-1][inside] = (first_bytes & 0xC0) != 0x80
+        return starts
+
+    def _boundary_levels(self, data, offsets):
+        # level[i] is the strongest separator at the start of token i
+        # (0 = first separator); len(separators) means no separator
+        none = len(self.separators)
+        levels = np.full(len(offsets), none, dtype=np.int8)
+        for level in range(none - 1, -1, -1):
+            separator = re.escape(self.separators[level].encode('utf-8'))
+            positions = []
+            for match in re.finditer(separator, data):
+                # a token may start at or right after the separator
+                positions.append(match.start())
+                positions.append(match.end())
+            if positions:
+                levels[np.isin(offsets, np.asarray(positions, dtype=np.int64))] = level
+        levels[0] = levels[-1] = 0
+        return levels
+
+    def split_tokens(self, tokens, levels, char_starts=None):
+        """
+        Returns (start, end) token ranges of the chunks. With char_starts,
+        chunk and overlap boundaries are moved to tokens that start a
+        character, so no chunk decodes to a split character.
+        """
+        n = len(tokens)
+        none = len(self.separators)
+        ranges = []
+        start = 0
+        while start < n:
+            end = min(start + self.chunk_size, n)
+            if end < n:
+                # prefer a separator that keeps the chunk at least half full
+                lo = start + max(self.chunk_size // 2, self.chunk_overlap + 1)
+                window = levels[lo:end + 1]
+                best = window.min() if len(window) else none
+                if best < none:
+                    end = lo + int(np.flatnonzero(window == best)[-1])
+                elif char_starts is not None and not char_starts[end]:
+                    # back off to the last character start, or go past the
+                    # character when a single one fills the window
+                    clean = np.flatnonzero(char_starts[start + 1:end])
+                    end = start + 1 + int(clean[-1]) if len(clean) else end + int(np.flatnonzero(char_starts[end:])[0])
+            ranges.append((start, end))
+            if end >= n:
+                break
+
+            # start the overlap at the first word boundary inside it
+            next_start = end - self.chunk_overlap
+            if self.chunk_overlap:
+                inside = np.flatnonzero(levels[next_start:end] < none)
+                if len(inside):
+                    next_start += int(inside[0])
+            if char_starts is not None and not char_starts[next_start]:
+                next_start += int(np.flatnonzero(char_starts[next_start:end + 1])[0])
+            start = next_start if next_start > start else end
+        return ranges
+
+    def split_text(self, text):
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if not tokens:
+            return []
+        offsets = self._byte_offsets(tokens)
+        data = text.encode('utf-8')
+        levels = self._boundary_levels(data, offsets)
+
+        chunks = []
+        for start, end in self.split_tokens(tokens, levels, self._char_starts(data, offsets)):
+            chunk = self.encoding.decode(tokens[start:end]).strip()
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def split_texts(self, texts, processes=None):
+        """
+        Splits many texts, in parallel over processes worker processes
+        (default: one per core) when there is more than one text.
+        """
+        if processes == 1 or len(texts) < 2:
+            return [self.split_text(text) for text in texts]
+
+        processes = processes or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(_split_text, [(self.chunk_size, self.chunk_overlap, self.separators, text) for text in texts]))
+
+
+def _split_text(args):
+    # worker entry point; every process builds its own chunker
+    chunk_size, chunk_overlap, separators, text = args
+    return TokenChunker(chunk_size, chunk_overlap, separators).split_text(text)
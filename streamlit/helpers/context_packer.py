@@ -0,0 +1,140 @@
+import tiktoken
+from embeddings import tiktoken_len, tokenizer
+
+# context window (prompt + reply) of the chat and completion models in tokens
+MODEL_CONTEXT = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "text-davinci-003": 4097,
+}
+DEFAULT_CONTEXT = 4096
+
+# tokens the chat format adds around the messages, plus a safety margin
+# for differences between tiktoken and the server-side count
+PROMPT_OVERHEAD = 64
+
+# longest overlap (in characters) looked for when merging neighbouring chunks
+MAX_OVERLAP_CHARS = 2000
+
+SEPARATOR = "\n\n"
+
+_encodings = {}
+
+
+def encoding_for(model):
+    """
+    Returns the tiktoken encoding of model; cl100k_base for unknown models
+    and None.
+    """
+    if model is None:
+        return tokenizer
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tokenizer
+    return _encodings[model]
+
+
+def context_budget(model, max_tokens, prompt=""):
+    """
+    Returns the number of tokens left for context in a request to model
+    that reserves max_tokens for the reply and also contains prompt (the
+    question and instructions without the context).
+    """
+    window = MODEL_CONTEXT.get(model, DEFAULT_CONTEXT)
+    prompt_tokens = len(encoding_for(model).encode(prompt, disallowed_special=()))
+    return max(window - max_tokens - prompt_tokens - PROMPT_OVERHEAD, 0)
+
+
+def fit_text(text, budget, model=None):
+    """
+    Returns text cut to at most budget tokens of model's tokenizer.
+    """
+    encoding = encoding_for(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= budget:
+        return text
+    return encoding.decode(tokens[:budget])
+
+
+def _merge(first, second):
+    # chunks of one page overlap by chunk_overlap tokens; drop the repeated part
+    limit = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for k in range(limit, 0, -1):
+        if first.endswith(second[:k]):
+            return first + second[k:]
+    return first + "\n" + second
+
+
+def merge_chunks(matches):
+    """
+    Deduplicates matches and merges chunks of the same url with adjacent
+    chunk-ids into passages.
+
+    matches are vector store matches with "score" and "metadata" (url,
+    chunk-id, text). Returns a list of dicts with url, chunk_ids, text and
+    score (the best score of its chunks), best first.
+    """
+    best = {}
+    seen_texts = set()
+    for match in sorted(matches, key=lambda m: -m["score"]):
+        metadata = match.get("metadata") or {}
+        text = metadata.get("text")
+        if not text or text in seen_texts:
+            continue
+        key = (metadata.get("url"), metadata.get("chunk-id"))
+        if key in best:
+            continue
+        seen_texts.add(text)
+        best[key] = (int(metadata.get("chunk-id", 0)), text, match["score"])
+
+    by_url = {}
+    for (url, _), chunk in best.items():
+        by_url.setdefault(url, []).append(chunk)
+
+    passages = []
+    for url, chunks in by_url.items():
+        chunks.sort()
+        passage = None
+        for chunk_id, text, score in chunks:
+            if passage is not None and chunk_id == passage["chunk_ids"][-1] + 1:
+                passage["text"] = _merge(passage["text"], text)
+                passage["chunk_ids"].append(chunk_id)
+                passage["score"] = max(passage["score"], score)
+                continue
+            passage = {"url": url, "chunk_ids": [chunk_id], "text": text, "score": score}
+            passages.append(passage)
+
+    passages.sort(key=lambda p: -p["score"])
+    return passages
+
+
+def pack_context(matches, budget):
+    """
+    Builds the context of an answer prompt from retrieved chunks.
+
+    Chunks are deduplicated and merged with merge_chunks, then passages are
+    added best first as long as they fit in budget tokens; a passage that
+    does not fit is skipped so a smaller one can still be used. If not even
+    the best passage fits, it is cut to the budget. Returns the context
+    text and the passages it contains.
+    """
+    passages = merge_chunks(matches)
+    separator_tokens = tiktoken_len(SEPARATOR)
+
+    packed = []
+    used = 0
+    for passage in passages:
+        tokens = tiktoken_len(passage["text"]) + (separator_tokens if packed else 0)
+        if used + tokens > budget:
+            continue
+        packed.append(passage)
+        used += tokens
+
+    if not packed and passages and budget > 0:
+        passage = dict(passages[0], text=fit_text(passages[0]["text"], budget))
+        packed.append(passage)
+
+    return SEPARATOR.join(passage["text"] for passage in packed), packed
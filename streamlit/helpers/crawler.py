@@ -0,0 +1,134 @@
+import logging
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+
+DEFAULT_WORKERS = 16
+DEFAULT_PER_HOST = 8
+DEFAULT_TIMEOUT = 10
+
+
+def create_session(pool_size=DEFAULT_WORKERS, retries=2):
+    """
+    Returns a requests session that keeps connections alive and can hold
+    pool_size connections per host, so concurrent fetches reuse connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": "gpt-vectors-crawler"})
+    return session
+
+
+def normalize_url(url):
+    """
+    Normalizes a url so that trivially different spellings of the same page
+    are only crawled once: lowercase scheme and host, no default port, no
+    fragment and a path of at least "/".
+    """
+    parsed = urllib.parse.urlsplit(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parsed.path or "/"
+    return urllib.parse.urlunsplit((scheme, netloc, path, parsed.query, ""))
+
+
+def extract_links(html, page_url, netloc):
+    # only build a tree of <a> tags, that is all we need here
+    links = []
+    soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("a"))
+    for link in soup.find_all("a"):
+        href = link.get("href")
+        if not href or href.startswith("#"):
+            continue
+
+        full_url = urllib.parse.urljoin(page_url, href)
+        parsed_url = urllib.parse.urlparse(full_url)
+        if parsed_url.scheme in ("http", "https") and parsed_url.netloc.lower() == netloc:
+            links.append(normalize_url(full_url))
+
+    return links
+
+
+class Crawler:
+    """
+    Breadth-first crawler for the pages of a single site.
+
+    Every normalized url is fetched at most once. Pages of one level are
+    fetched concurrently by a bounded pool of workers that share a keep-alive
+    session, with at most per_host requests in flight to the same host.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, timeout=DEFAULT_TIMEOUT, session=None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.session = session or create_session(max_workers)
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_limits[host]
+
+    def fetch_links(self, url, netloc):
+        with self._host_limit(url):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                logging.warning("Failed to fetch URL: %s (%s)", url, e)
+                return []
+
+        if response.status_code != 200:
+            logging.warning("Failed to fetch URL: %s (status %d)", url, response.status_code)
+            return []
+        if "html" not in response.headers.get("Content-Type", "text/html"):
+            return []
+
+        return extract_links(response.text, response.url, netloc)
+
+    def crawl(self, url, depth):
+        """
+        Crawls url up to depth levels deep and yields a dict with the link of
+        every page that is found, as soon as it is found. The start url
+        itself is not yielded.
+        """
+        if depth <= 0:
+            return
+
+        start = normalize_url(url)
+        netloc = urllib.parse.urlsplit(start).netloc
+        visited = {start}
+        level = [start]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for current_depth in range(depth):
+                next_level = []
+                pending = {executor.submit(self.fetch_links, page, netloc) for page in level}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for link in future.result():
+                            if link in visited:
+                                continue
+                            visited.add(link)
+                            next_level.append(link)
+                            yield {'link': link}
+
+                # links found on the last level are reported but not fetched
+                if current_depth == depth - 1:
+                    break
+                level = next_level
+
+
+def crawl_website(url, depth, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST):
+    return Crawler(max_workers=max_workers, per_host=per_host).crawl(url, depth)
@@ -0,0 +1,126 @@
+import collections
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from extract import extract_article
+
+DEFAULT_PATH = os.getenv('DOCUMENT_STORE', os.path.join(os.path.expanduser('~'), '.cache', 'gpt-vectors', 'documents.sqlite'))
+DEFAULT_HOT_ENTRIES = int(os.getenv('DOCUMENT_STORE_HOT_ENTRIES', 256))
+
+
+class DocumentStore:
+    """
+    Local store for extracted article text, keyed by url and content hash.
+
+    Ingestion saves the article text of every page it processes, compressed
+    with zlib in SQLite. Reads go through a small in-memory LRU of
+    decompressed articles, so the query path does not have to scrape and
+    parse the page again.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, hot_entries=DEFAULT_HOT_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS documents (url TEXT PRIMARY KEY, content_hash TEXT, text BLOB, updated REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS documents_hash ON documents (content_hash)')
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.hot = collections.OrderedDict()
+        self.hot_entries = hot_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, url, text):
+        self.hot[url] = text
+        self.hot.move_to_end(url)
+        while len(self.hot) > self.hot_entries:
+            self.hot.popitem(last=False)
+
+    def put(self, url, text):
+        """
+        Saves the article text for url and returns its content hash. The
+        row is only rewritten when the text changed.
+        """
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self.lock:
+            row = self.db.execute('SELECT content_hash FROM documents WHERE url = ?', (url,)).fetchone()
+            if row is None or row[0] != content_hash:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO documents (url, content_hash, text, updated) VALUES (?, ?, ?, ?)',
+                    (url, content_hash, zlib.compress(text.encode('utf-8')), time.time())
+                )
+                self.db.commit()
+            self._remember(url, text)
+        return content_hash
+
+    def get(self, url):
+        with self.lock:
+            text = self.hot.get(url)
+            if text is not None:
+                self.hot.move_to_end(url)
+                self.hits += 1
+                return text
+
+            row = self.db.execute('SELECT text FROM documents WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            text = zlib.decompress(row[0]).decode('utf-8')
+            self._remember(url, text)
+            self.hits += 1
+            return text
+
+    def get_by_hash(self, content_hash):
+        with self.lock:
+            row = self.db.execute('SELECT text FROM documents WHERE content_hash = ?', (content_hash,)).fetchone()
+        return zlib.decompress(row[0]).decode('utf-8') if row else None
+
+    def delete(self, url):
+        with self.lock:
+            self.db.execute('DELETE FROM documents WHERE url = ?', (url,))
+            self.db.commit()
+            self.hot.pop(url, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+_document_store = None
+_session = None
+
+def get_document_store():
+    global _document_store
+    if _document_store is None:
+        _document_store = DocumentStore()
+    return _document_store
+
+
+def get_article(url):
+    """
+    Returns the article text of a blog post. The text comes from the local
+    document store; the page is only fetched and parsed when it was never
+    ingested, and the result is saved for the next query.
+    """
+    global _session
+    store = get_document_store()
+    article = store.get(url)
+    if article is not None:
+        return article
+
+    logging.debug("Document store miss, fetching %s", url)
+    if _session is None:
+        from crawler import create_session
+        _session = create_session()
+
+    r = _session.get(url, timeout=30)
+    # an error page must not be stored as the article
+    r.raise_for_status()
+    article = extract_article(r.text)
+    store.put(url, article)
+    return article
@@ -0,0 +1,231 @@
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no lock between processes
+    fcntl = None
+
+# the cache lives outside the repo so every script and app shares it
+DEFAULT_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'gpt-vectors', 'embeddings'))
+DEFAULT_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# when the cache is over its size, evict down to this fraction of max_bytes
+EVICT_TO = 0.8
+
+
+def normalize_text(text):
+    # the same text with different unicode forms or whitespace maps to one entry
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(model, text):
+    return hashlib.sha256((model + '\0' + normalize_text(text)).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache for embeddings.
+
+    Vectors are appended as float32 to a single data file that is read back
+    through a memory map. A SQLite index maps (model, hash of normalized text)
+    to the offset of the vector in the data file and tracks when it was last
+    used. When the data file grows beyond max_bytes, the least recently used
+    entries are evicted and the data file is compacted.
+
+    Processes sharing a cache directory take a lock file around every
+    append, lookup and eviction (on platforms with fcntl), so concurrent
+    writers never compute the same append offset.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.data_path = os.path.join(path, 'vectors.f32')
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, offset INTEGER, dim INTEGER, last_used REAL)')
+        self.db.commit()
+
+        self.lock_path = os.path.join(path, 'lock')
+        self._mmap = None
+        self._mmap_stat = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        # shared for lookups, exclusive for appends and evictions
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _vectors(self):
+        # (re)map the data file when it has grown or was compacted, possibly
+        # by another process, since the last read
+        try:
+            st = os.stat(self.data_path)
+        except FileNotFoundError:
+            return None
+        if st.st_size == 0:
+            return None
+        stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if self._mmap is None or stat != self._mmap_stat:
+            self._mmap = np.memmap(self.data_path, dtype=np.float32, mode='r')
+            self._mmap_stat = stat
+        return self._mmap
+
+    def get_many(self, model, texts):
+        """
+        Returns a list with the cached vector (list of float) for every text,
+        or None where the text is not in the cache.
+        """
+        keys = [cache_key(model, text) for text in texts]
+        results = [None] * len(texts)
+
+        with self.lock, self._file_lock(exclusive=False):
+            found = {}
+            unique_keys = list(set(keys))
+            # stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                rows = self.db.execute(
+                    'SELECT key, offset, dim FROM entries WHERE key IN (%s)' % ','.join('?' * len(part)),
+                    part
+                ).fetchall()
+                for key, offset, dim in rows:
+                    found[key] = (offset, dim)
+
+            vectors = self._vectors() if found else None
+            for i, key in enumerate(keys):
+                if key in found and vectors is not None:
+                    offset, dim = found[key]
+                    results[i] = vectors[offset:offset + dim].tolist()
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+            if found:
+                now = time.time()
+                self.db.executemany('UPDATE entries SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+                self.db.commit()
+
+        return results
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, vectors):
+        """
+        Stores vectors for texts. Texts that are already cached are skipped.
+        """
+        with self.lock, self._file_lock(exclusive=True):
+            now = time.time()
+            rows = []
+            seen = set()
+            with open(self.data_path, 'ab') as f:
+                # offsets are counted in float32 elements
+                offset = f.tell() // 4
+                for text, vector in zip(texts, vectors):
+                    key = cache_key(model, text)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if self.db.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone():
+                        continue
+                    data = np.asarray(vector, dtype=np.float32)
+                    f.write(data.tobytes())
+                    rows.append((key, offset, len(data), now))
+                    offset += len(data)
+
+            self.db.executemany('INSERT OR REPLACE INTO entries (key, offset, dim, last_used) VALUES (?, ?, ?, ?)', rows)
+            self.db.commit()
+
+            if self._size() > self.max_bytes:
+                self._evict()
+
+    def put(self, model, text, vector):
+        self.put_many(model, [text], [vector])
+
+    def _size(self):
+        return os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+
+    def _evict(self):
+        # keep the most recently used entries that fit in EVICT_TO * max_bytes
+        # and rewrite them into a new, compact data file
+        budget = int(self.max_bytes * EVICT_TO) // 4
+        rows = self.db.execute('SELECT key, offset, dim FROM entries ORDER BY last_used DESC').fetchall()
+
+        vectors = self._vectors()
+        keep = []
+        used = 0
+        tmp_path = self.data_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for key, offset, dim in rows:
+                if used + dim > budget:
+                    break
+                f.write(np.asarray(vectors[offset:offset + dim], dtype=np.float32).tobytes())
+                keep.append((used, key))
+                used += dim
+
+        evicted = len(rows) - len(keep)
+        self._mmap = None
+        os.replace(tmp_path, self.data_path)
+
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS keep (key TEXT PRIMARY KEY, offset INTEGER)')
+        self.db.execute('DELETE FROM keep')
+        self.db.executemany('INSERT INTO keep (offset, key) VALUES (?, ?)', keep)
+        self.db.execute('DELETE FROM entries WHERE key NOT IN (SELECT key FROM keep)')
+        self.db.execute('UPDATE entries SET offset = (SELECT offset FROM keep WHERE keep.key = entries.key)')
+        self.db.commit()
+
+        self.evictions += evicted
+        logging.info("Evicted %d embeddings from cache %s", evicted, self.path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': self._size(),
+        }
+
+
+_default_cache = None
+
+def get_default_cache():
+    """
+    Returns the process-wide embedding cache, or None when it is disabled
+    by setting EMBEDDING_CACHE=0.
+    """
+    global _default_cache
+    if os.getenv('EMBEDDING_CACHE', '1') == '0':
+        return None
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
@@ -0,0 +1,180 @@
+import logging
+import os
+import time
+import openai
+import tiktoken
+from retrying import retry
+from embedding_cache import get_default_cache
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# ada-002 accepts up to 8191 tokens per input and 2048 inputs per request
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_INPUTS = 2048
+# token budget of one embeddings request, all inputs together; the API
+# accepts more, a smaller budget keeps a failed request cheap to retry
+MAX_BATCH_TOKENS = int(os.getenv('EMBEDDING_BATCH_TOKENS', 100000))
+
+tokenizer = tiktoken.get_encoding('cl100k_base')
+
+def tiktoken_len(text):
+    """
+    Calculates the number of tokens in the given input text using a tokenizer.
+
+    Args:
+    - text (str): the text to tokenize and count the number of tokens
+
+    Returns:
+    - The number of tokens (int) in the input text.
+
+    Description:
+    This function uses a tokenizer to encode the input text into tokens, and then returns the number of tokens in the text. The tokenizer used must have a method called "encode" that takes the input text and an optional list of special characters to disallow during tokenization. The function uses the "len" built-in function to count the number of tokens returned by the tokenizer's "encode" method.
+    """
+    tokens = tokenizer.encode(
+        text,
+        disallowed_special=()
+    )
+    return len(tokens)
+
+
+@retry(wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=6)
+def _create_embedding(article, model):
+    # vectorize with OpenAI text-emebdding-ada-002
+    embedding = openai.Embedding.create(
+        input=article,
+        model=model
+    )
+
+    return embedding["data"][0]["embedding"]
+
+
+def create_embedding(article, model=EMBEDDING_MODEL):
+    # consult the embedding cache before calling the API
+    cache = get_default_cache()
+    if cache is not None:
+        vector = cache.get(model, article)
+        if vector is not None:
+            return vector
+
+    vector = _create_embedding(article, model)
+    if cache is not None:
+        cache.put(model, article, vector)
+
+    return vector
+
+
+def make_batches(texts, max_tokens=MAX_BATCH_TOKENS, max_inputs=MAX_BATCH_INPUTS, lengths=None):
+    """
+    Packs texts into batches that fit a per-request token and input budget.
+
+    Args:
+    - texts (list of str): the texts to pack, in order
+    - max_tokens (int): maximum number of tokens per batch
+    - max_inputs (int): maximum number of texts per batch
+    - lengths (list of int): optional precomputed token counts for texts
+
+    Returns:
+    - A list of batches; each batch is a list of positions into texts.
+
+    Description:
+    Texts are packed greedily in their original order. A single text that is
+    larger than max_tokens gets a batch of its own. max_tokens budgets the
+    whole request; each text must also stay within MAX_INPUT_TOKENS.
+    """
+    if lengths is None:
+        lengths = [tiktoken_len(text) for text in texts]
+
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, length in enumerate(lengths):
+        if batch and (batch_tokens + length > max_tokens or len(batch) >= max_inputs):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += length
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+# errors that go away when the same request is sent again later
+TRANSIENT_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
+def _embed_batch(texts, model, attempts=5):
+    # embed one batch; transient errors are retried with backoff, a batch
+    # the API rejects is split in half so only the failing part is retried
+    for attempt in range(attempts):
+        try:
+            response = openai.Embedding.create(input=texts, model=model)
+            # the API does not guarantee order, map by index
+            data = sorted(response["data"], key=lambda item: item["index"])
+            return [item["embedding"] for item in data]
+        except TRANSIENT_ERRORS as e:
+            if attempt == attempts - 1:
+                raise
+            logging.warning("Embedding %d inputs failed (attempt %d), retrying: %s", len(texts), attempt + 1, e)
+            time.sleep(min(2 ** attempt, 10))
+        except openai.error.InvalidRequestError:
+            # request too large or an invalid input: retrying the same
+            # request will not help
+            if len(texts) == 1:
+                raise
+            break
+
+    middle = len(texts) // 2
+    return _embed_batch(texts[:middle], model, attempts) + _embed_batch(texts[middle:], model, attempts)
+
+
+def create_embeddings(texts, max_tokens=MAX_BATCH_TOKENS, max_inputs=MAX_BATCH_INPUTS, model=EMBEDDING_MODEL):
+    """
+    Creates embeddings for many texts with as few API requests as possible.
+
+    Args:
+    - texts (list of str): the texts to embed
+    - max_tokens (int): token budget per embeddings request, all inputs together (measured with tiktoken_len)
+    - max_inputs (int): maximum number of inputs per embeddings request
+
+    Returns:
+    - A list of embeddings (list of float), in the same order as texts.
+
+    Description:
+    Texts found in the embedding cache are not sent to the API. The others are
+    packed into batches with make_batches and every batch is sent as one
+    embeddings request. A text longer than MAX_INPUT_TOKENS raises
+    ValueError before any request is sent. Rate limits, timeouts and server errors are retried
+    with backoff. If the API rejects a batch, it is split in half and only
+    the failing halves are retried, down to single inputs.
+    """
+    cache = get_default_cache()
+    if cache is not None:
+        vectors = cache.get_many(model, texts)
+    else:
+        vectors = [None] * len(texts)
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    missing_texts = [texts[i] for i in missing]
+    lengths = [tiktoken_len(text) for text in missing_texts]
+    too_long = [i for i, length in zip(missing, lengths) if length > MAX_INPUT_TOKENS]
+    if too_long:
+        raise ValueError(f"{len(too_long)} texts are longer than {MAX_INPUT_TOKENS} tokens, the first at position {too_long[0]}")
+    for batch in make_batches(missing_texts, max_tokens, max_inputs, lengths):
+        batch_texts = [missing_texts[i] for i in batch]
+        embeddings = _embed_batch(batch_texts, model)
+        for i, embedding in zip(batch, embeddings):
+            vectors[missing[i]] = embedding
+        if cache is not None:
+            cache.put_many(model, batch_texts, embeddings)
+
+    return vectors
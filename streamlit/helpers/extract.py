@@ -0,0 +1,137 @@
+import os
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+
+# chunk size used to feed the streaming extractor
+STREAM_CHUNK = 16 * 1024
+
+# elements whose content is not text; bs4 leaves it out of .text too
+SKIP_ELEMENTS = {'script', 'style', 'template'}
+
+# elements without a closing tag; they never change the nesting depth
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+
+def extract_bs4(html, tag=None, class_name=None):
+    # the original approach: build the full tree with the pure-Python parser
+    soup = BeautifulSoup(html, 'html.parser')
+    if tag is None:
+        return soup.text
+    element = soup.find(tag, {'class': class_name})
+    return element.text if element is not None else None
+
+
+def extract_lxml(html, tag=None, class_name=None):
+    # libxml2 builds the tree in C
+    import lxml.html
+
+    root = lxml.html.document_fromstring(html)
+    if tag is not None:
+        elements = root.xpath(f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]")
+        if not elements:
+            return None
+        root = elements[0]
+    for element in root.xpath('|'.join(f'.//{name}' for name in SKIP_ELEMENTS)):
+        element.drop_tree()
+    return root.text_content()
+
+
+class _StreamingExtractor(HTMLParser):
+    """
+    Collects the text inside the first tag with class class_name and stops
+    as soon as that element is closed. Without a tag, collects all text.
+    """
+
+    def __init__(self, tag, class_name):
+        super().__init__(convert_charrefs=True)
+        self.tag = tag
+        self.class_name = class_name
+        self.depth = 0 if tag is not None else 1
+        self.found = tag is None
+        self.done = False
+        self.skip = 0
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done or tag in VOID_ELEMENTS:
+            return
+        if tag in SKIP_ELEMENTS:
+            self.skip += 1
+        if self.depth:
+            self.depth += 1
+        elif tag == self.tag:
+            classes = (dict(attrs).get('class') or '').split()
+            if self.class_name in classes:
+                self.found = True
+                self.depth = 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_ELEMENTS and self.skip:
+            self.skip -= 1
+        if self.done or not self.depth or tag in VOID_ELEMENTS:
+            return
+        if self.tag is not None:
+            self.depth -= 1
+            if self.depth == 0:
+                self.done = True
+
+    def handle_data(self, data):
+        if self.depth and not self.done and not self.skip:
+            self.parts.append(data)
+
+
+def extract_stream(html, tag=None, class_name=None):
+    # feed the document in chunks and stop once the target element closed
+    parser = _StreamingExtractor(tag, class_name)
+    for start in range(0, len(html), STREAM_CHUNK):
+        parser.feed(html[start:start + STREAM_CHUNK])
+        if parser.done:
+            break
+    else:
+        parser.close()
+    return ''.join(parser.parts) if parser.found else None
+
+
+BACKENDS = {
+    'bs4': extract_bs4,
+    'lxml': extract_lxml,
+    'stream': extract_stream,
+}
+
+
+def _default_backend():
+    backend = os.getenv('HTML_EXTRACTOR')
+    if backend:
+        return backend
+    try:
+        import lxml.html  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'bs4'
+
+
+DEFAULT_BACKEND = _default_backend()
+
+
+def extract_text(html, tag=None, class_name=None, backend=None):
+    """
+    Returns the text of the first tag element with class class_name, or
+    the text of the whole page when tag is None. Returns None when the
+    element is not found.
+
+    The backend is "bs4" (BeautifulSoup with html.parser), "lxml" (C parser)
+    or "stream" (stops parsing once the element is closed) and defaults to
+    the HTML_EXTRACTOR environment variable, or lxml when it is installed.
+    """
+    return BACKENDS[backend or DEFAULT_BACKEND](html, tag, class_name)
+
+
+def extract_article(html, backend=None):
+    """
+    Returns the text of the div.entry-content of a WordPress post.
+    Raises ValueError when the page has no such element.
+    """
+    article = extract_text(html, 'div', 'entry-content', backend)
+    if article is None:
+        raise ValueError("Page has no div.entry-content")
+    return article
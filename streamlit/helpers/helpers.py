@@ -1,81 +1,83 @@
-import pinecone
 import openai
-import tiktoken
 import os
 import streamlit as st
-from retrying import retry
 import requests
 from bs4 import BeautifulSoup
 import urllib.parse
 import dotenv
-from urllib.parse import urlparse, urljoin
+from crawler import crawl_website
+from embeddings import tokenizer, tiktoken_len, create_embedding, create_embeddings
+from vector_store import get_vector_store
+from query_cache import embed_query
+from context_packer import pack_context
 
 dotenv.load_dotenv(dotenv_path='./.env')
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-tokenizer = tiktoken.get_encoding('cl100k_base')
+# seconds a (query, chunks) search result is reused
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 600))
 
-def tiktoken_len(text):
-    """
-    Calculates the number of tokens in the given input text using a tokenizer.
 
-    Args:
-    - text (str): the text to tokenize and count the number of tokens
+@st.cache_resource
+def get_index():
+    # created once per process and shared by all sessions and reruns;
+    # the vector store is Pinecone unless VECTOR_STORE selects another backend
+    return get_vector_store('blog-index')
 
-    Returns:
-    - The number of tokens (int) in the input text.
 
-    Description:
-    This function uses a tokenizer to encode the input text into tokens, and then returns the number of tokens in the text. The tokenizer used must have a method called "encode" that takes the input text and an optional list of special characters to disallow during tokenization. The function uses the "len" built-in function to count the number of tokens returned by the tokenizer's "encode" method.
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def cached_search(query, chunks, budget=None):
     """
-    tokens = tokenizer.encode(
-        text,
-        disallowed_special=()
-    )
-    return len(tokens)
-
-
-def search_pinecone(query, chunks):
-    # get the Pinecone API key and environment
-    pinecone_api = os.getenv('PINECONE_API_KEY')
-    pinecone_env = os.getenv('PINECONE_ENVIRONMENT')
-
-    # inititalize and set index
-    pinecone.init(api_key=pinecone_api, environment=pinecone_env)
-    index = pinecone.Index('blog-index')
+    Returns the urls, chunk texts and joined chunks of the chunks most
+    similar to query. With a token budget, duplicate chunks are dropped,
+    neighbouring chunks are merged and the joined text fits the budget (see
+    context_packer.py); the chunk texts are then the packed passages.
+    Results are cached per (query, chunks, budget) for SEARCH_CACHE_TTL
+    seconds; errors are raised and not cached.
+    """
+    index = get_index()
 
-    # vectorize query with openai
+    # vectorize query with openai; repeated queries come from the query cache
     try:
-        query_vector = openai.Embedding.create(
-            input=query,
-            model="text-embedding-ada-002"
-        )["data"][0]["embedding"]
+        query_vector = embed_query(query)
     except Exception as e:
-        st.error(f"Error calling OpenAI Embedding API: {e}")
-        st.stop()
+        raise RuntimeError(f"Error calling OpenAI Embedding API: {e}") from e
 
-    # search for the most similar vector in Pinecone
+    # search for the most similar vector in the vector store
     try:
         search_response = index.query(
             top_k=chunks,
             vector=query_vector,
             include_metadata=True)
     except Exception as e:
-        st.error(f"Error calling Pinecone Index API: {e}")
-        st.stop()
-    
+        raise RuntimeError(f"Error calling vector store: {e}") from e
+
+    matches = [{"score": item["score"], "metadata": dict(item["metadata"])} for item in search_response['matches']]
+
     # create a unique list of urls from search_response
-    urls = [item["metadata"]['url'] for item in search_response['matches']]
+    urls = [item["metadata"]['url'] for item in matches]
     urls = list(set(urls))
 
+    if budget is not None:
+        all_chunks, passages = pack_context(matches, budget)
+        return urls, [passage["text"] for passage in passages], all_chunks
+
     # create a list of texts from search_response and join them into one string
-    chunk_texts = [item["metadata"]['text'] for item in search_response['matches']]
+    chunk_texts = [item["metadata"]['text'] for item in matches]
     all_chunks = "\n".join(chunk_texts)
 
     return urls, chunk_texts, all_chunks
 
 
+def search_pinecone(query, chunks, budget=None):
+    try:
+        return cached_search(query, chunks, budget)
+    except RuntimeError as e:
+        st.error(str(e))
+        st.stop()
+
+
 def gpt(prompt, model, temperature, max_reply_tokens):
 
     response_text = None
@@ -98,15 +100,33 @@ def gpt(prompt, model, temperature, max_reply_tokens):
     return response_text, response
 
 
-@retry(wait_exponential_multiplier=1000, wait_exponential_max=10000)
-def create_embedding(article):
-    # vectorize with OpenAI text-emebdding-ada-002
-    embedding = openai.Embedding.create(
-        input=article,
-        model="text-embedding-ada-002"
-    )
+def gpt_stream(prompt, model, temperature, max_reply_tokens):
+    """
+    Like gpt, but yields the answer in pieces as the model produces them,
+    so the first words can be shown after a few hundred milliseconds
+    instead of after the whole answer. Errors are reported with st.error
+    and end the stream.
+    """
+    try:
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=[
+                { "role": "system", "content":  "You are a truthful assistant!" },
+                { "role": "user", "content": prompt }
+            ],
+            temperature=temperature,
+            max_tokens=max_reply_tokens,
+            stream=True
+        )
+
+        for chunk in response:
+            # the first chunk only carries the role, the last one only the finish reason
+            delta = chunk.choices[0].get('delta', {}).get('content')
+            if delta:
+                yield delta
+    except Exception as e:
+        st.error(f"Error calling OpenAI ChatCompletion API: {e}")
 
-    return embedding["data"][0]["embedding"]
 
 # get the html from a url
 def get_html(url):
@@ -126,45 +146,11 @@ def get_links(html, base_url):
                 links.append(urllib.parse.urljoin(base_url, href))
     return links
 
-# recursively crawl a website and return all pages as a list of dicts
+# crawl a website breadth-first and return all pages as a list of dicts
 def crawl(url, depth):
-    pages = []
-    if depth == 0:
-        return
-    html = get_html(url)
-    links = get_links(html, url)
-    for link in links:
-        pages.append({'link': link})
-        crawl(link, depth-1)
-
-    return pages
+    return list(crawl_website(url, depth))
 
+# crawl a website and return all internal pages as a list of dicts;
+# every page is fetched only once, see crawler.py
 def scrape_website(url, depth, base_url=None):
-    if depth <= 0:
-        return []
-
-    if not base_url:
-        base_url = urlparse(url).scheme + "://" + urlparse(url).netloc
-
-    internal_links = []
-    response = requests.get(url)
-    if response.status_code != 200:
-        return []
-
-    soup = BeautifulSoup(response.text, "html.parser")
-    for link in soup.find_all("a"):
-        href = link.get("href")
-        if not href:
-            continue
-
-        full_url = urljoin(base_url, href)
-        parsed_url = urlparse(full_url)
-
-        if parsed_url.netloc == urlparse(base_url).netloc and parsed_url.scheme in ["http", "https"] and "#" not in parsed_url.path:
-            internal_links.append({'link': full_url})
-
-    scraped_links = []
-    for link in internal_links:
-        scraped_links.extend(scrape_website(link["link"], depth - 1, base_url))
-
-    return internal_links + scraped_links
\ No newline at end of file
+    return list(crawl_website(url, depth))
@@ -0,0 +1,272 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import requests
+from answer_cache import log_invalidations
+from chunker import DEFAULT_SEPARATORS, TokenChunker
+from crawler import DEFAULT_WORKERS, create_session
+from embeddings import MAX_BATCH_TOKENS, create_embeddings, tiktoken_len
+from extract import extract_article, extract_text
+from manifest import content_hash
+from pipeline import Pipeline, Stage
+
+DEFAULT_PROCESSES = int(os.getenv('INGEST_PROCESSES', 0)) or os.cpu_count()
+DEFAULT_EMBED_WORKERS = int(os.getenv('INGEST_EMBED_WORKERS', 4))
+DEFAULT_UPSERT_WORKERS = int(os.getenv('INGEST_UPSERT_WORKERS', 4))
+UPSERT_BATCH = 100
+
+# chunkers of a worker process, by (chunk_size, chunk_overlap, separators)
+_chunkers = {}
+
+
+def _parse_page(html, use_entry_content, chunk_options, known_hash):
+    """
+    Extracts the article from html and splits it into chunks. Runs in a
+    worker process. Returns (article, article_hash, chunks, lengths, error);
+    chunks is None when the article hash equals known_hash.
+    """
+    try:
+        article = extract_article(html) if use_entry_content else extract_text(html)
+    except ValueError as e:
+        return None, None, None, None, str(e)
+
+    article_hash = content_hash(article)
+    if article_hash == known_hash:
+        return article, article_hash, None, None, None
+
+    if chunk_options is None:
+        # the whole article is embedded as a single chunk
+        chunks = [article]
+    else:
+        chunker = _chunkers.get(chunk_options)
+        if chunker is None:
+            chunker = _chunkers[chunk_options] = TokenChunker(*chunk_options)
+        chunks = chunker.split_text(article)
+    return article, article_hash, chunks, [tiktoken_len(chunk) for chunk in chunks], None
+
+
+class Ingestion:
+    """
+    Incremental ingestion of web pages into a vector index, run as a
+    Pipeline of overlapping stages:
+
+    - fetch: conditional GETs, on fetch_workers threads
+    - parse: article extraction and chunking, on a pool of processes
+    - plan: document store, manifest and chunk plan, on one thread because
+      it owns the manifest
+    - embed: token-budgeted embedding requests, on embed_workers threads
+    - upsert: batches of UPSERT_BATCH vectors, on upsert_workers threads
+
+    With chunk_size None every article is embedded as a single chunk. run()
+    yields log messages (and None while waiting) on the caller's thread;
+    call finish() afterwards to delete stale vectors, flush the index, save
+    the manifest and invalidate cached answers of the changed pages.
+
+    The parse processes are started fresh (forkserver or spawn) and import
+    the main module, so scripts that run an Ingestion with processes > 1
+    must guard their entry point with if __name__ == "__main__".
+    """
+
+    def __init__(self, index, manifest, documents, session=None, use_entry_content=True, index_existed=True,
+                 chunk_size=400, chunk_overlap=20, separators=DEFAULT_SEPARATORS, include_text=True,
+                 fetch_workers=DEFAULT_WORKERS, processes=DEFAULT_PROCESSES,
+                 embed_workers=DEFAULT_EMBED_WORKERS, upsert_workers=DEFAULT_UPSERT_WORKERS):
+        self.index = index
+        self.manifest = manifest
+        self.documents = documents
+        self.session = session or create_session(pool_size=fetch_workers)
+        self.use_entry_content = use_entry_content
+        self.index_existed = index_existed
+        self.chunk_options = (chunk_size, chunk_overlap, tuple(separators)) if chunk_size else None
+        # the chunker settings as recorded in the manifest
+        self.chunker = json.loads(json.dumps(self.chunk_options)) if chunk_size else 'article'
+        self.include_text = include_text
+        self.processes = processes
+
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.skipped = 0
+        self.failed = 0
+        self.chunks = 0
+        self.vectors = 0
+        self.stale_ids = []
+        # urls whose vectors changed; cached answers based on them are dropped
+        self.changed_urls = set()
+
+        self.pipeline = Pipeline([
+            Stage('fetch', self._fetch, workers=fetch_workers),
+            Stage('parse', self._parse, workers=max(processes, 1)),
+            Stage('plan', self._plan),
+            Stage('embed', self._embed, workers=embed_workers, batch_size=MAX_BATCH_TOKENS, weight=lambda pending: pending[3]),
+            Stage('upsert', self._upsert, workers=upsert_workers, batch_size=UPSERT_BATCH),
+        ])
+        self.pool = None
+
+    def _log(self, message):
+        self.pipeline.emit(message)
+
+    def _fetch(self, url):
+        try:
+            response = self.manifest.fetch(self.session, url)
+        except requests.RequestException as e:
+            self._log(f"Could not fetch {url}: {e}")
+            with self.lock:
+                self.pages += 1
+                self.failed += 1
+            return None
+        return [(url, response)]
+
+    def _parse(self, item):
+        url, response = item
+        if response is None or not 200 <= response.status_code < 300:
+            return [(url, response, None)]
+
+        # an article chunked with other settings is never skipped
+        entry = self.manifest.get(url)
+        known_hash = entry['content_hash'] if entry and entry.get('chunker') == self.chunker else None
+        args = (response.text, self.use_entry_content, self.chunk_options, known_hash)
+        if self.pool is not None:
+            parsed = self.pool.submit(_parse_page, *args).result()
+        else:
+            parsed = _parse_page(*args)
+        return [(url, response, parsed)]
+
+    def _plan(self, item):
+        url, response, parsed = item
+        with self.lock:
+            self.pages += 1
+
+        # conditional GET; None means the page was not modified
+        if response is None:
+            self._log(f"Not modified, skipping: {url}")
+            with self.lock:
+                self.skipped += 1
+            return None
+
+        # the page is gone; remove its vectors
+        if response.status_code in (404, 410):
+            self._log(f"Page removed, deleting its vectors: {url}")
+            self.changed_urls.add(url)
+            self.stale_ids.extend(self.manifest.remove(url))
+            self.documents.delete(url)
+            return None
+
+        # any other error status (403, 5xx, ...) says nothing about the
+        # page; keep its vectors and manifest entry for the next run
+        if not 200 <= response.status_code < 300:
+            self._log(f"HTTP {response.status_code}, keeping the previous version: {url}")
+            with self.lock:
+                self.failed += 1
+            return None
+
+        article, article_hash, chunks, lengths, error = parsed
+        if error is not None:
+            self._log(f"Could not extract {url}: {error}")
+            with self.lock:
+                self.failed += 1
+            return None
+
+        # keep the article text for the query path
+        self.documents.put(url, article)
+
+        # the page was served again but the article did not change
+        if chunks is None:
+            self._log(f"Content unchanged, skipping: {url}")
+            self.manifest.update(url, response, article_hash, chunker=self.chunker)
+            with self.lock:
+                self.skipped += 1
+            return None
+
+        # vectors of pages ingested before the manifest existed use
+        # positional ids; remove them by url
+        if self.manifest.get(url) is None and self.index_existed and self.manifest.untracked:
+            try:
+                self.index.delete(filter={"url": url})
+            except Exception as e:
+                self._log(f"Could not delete old vectors for {url}: {e}")
+
+        # compare the chunks with the previous ingestion
+        plan = self.manifest.plan(url, chunks)
+        self._log(f"{url}: {len(chunks)} chunks, {len(plan.new)} new, {len(plan.moved)} moved, {len(plan.stale)} removed")
+
+        # unchanged chunks that moved only need their chunk-id updated
+        for vector_id, j in plan.moved:
+            self.index.update_metadata(vector_id, {"chunk-id": j})
+
+        self.stale_ids.extend(plan.stale)
+        self.manifest.update(url, response, article_hash, plan, self.chunker)
+        if plan.new or plan.moved or plan.stale:
+            self.changed_urls.add(url)
+
+        pending = []
+        for j, vector_id, chunk in plan.new:
+            metadata = {"url": url, "chunk-id": j}
+            if self.include_text:
+                metadata["text"] = chunk
+            pending.append((vector_id, chunk, metadata, lengths[j]))
+        with self.lock:
+            self.chunks += len(pending)
+        return pending
+
+    def _embed(self, batch):
+        vectors = create_embeddings([chunk for _, chunk, _, _ in batch])
+        return [(vector_id, vector, metadata) for (vector_id, _, metadata, _), vector in zip(batch, vectors)]
+
+    def _upsert(self, batch):
+        self.index.upsert(vectors=batch)
+        with self.lock:
+            self.vectors += len(batch)
+        return None
+
+    def run(self, urls):
+        """
+        Ingests urls and yields log messages, or None when there is nothing
+        new, so the caller can refresh its progress display.
+        """
+        if self.processes > 1:
+            # the workers start when the first pages are parsed, from a stage
+            # thread; forking a process with running threads can deadlock on
+            # the locks they hold, so the workers are started fresh
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context(method))
+        try:
+            yield from self.pipeline.run(urls)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+    def prune(self, listed):
+        """
+        Removes the vectors of ingested pages that are not in listed and
+        returns their urls.
+        """
+        listed = set(listed)
+        removed = [url for url in self.manifest.urls() if url not in listed]
+        for url in removed:
+            self.changed_urls.add(url)
+            self.stale_ids.extend(self.manifest.remove(url))
+            self.documents.delete(url)
+        return removed
+
+    def finish(self):
+        # delete vectors of removed chunks and pages
+        for start in range(0, len(self.stale_ids), 1000):
+            self.index.delete(ids=self.stale_ids[start:start + 1000])
+
+        # only record the ingestion once the index is up to date
+        self.index.flush()
+        self.manifest.save()
+        log_invalidations(self.changed_urls)
+
+    def progress(self):
+        """
+        Returns a one-line summary of the throughput of every stage.
+        """
+        stats = self.pipeline.stats()
+        return ", ".join(
+            f"{name} {stage['per_second']:.1f}/s ({stage['utilization']:.0%} busy)"
+            for name, stage in stats.items()
+        )
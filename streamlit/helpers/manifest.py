@@ -0,0 +1,194 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_MANIFEST_DIR = os.getenv('INGEST_MANIFEST_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'gpt-vectors'))
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def url_hash(url):
+    return hashlib.md5(url.encode('utf-8')).hexdigest()
+
+
+def chunk_vector_ids(url, chunk_hashes):
+    # vector ids are derived from the chunk content, so an unchanged chunk
+    # keeps its id even if text is added or removed before it
+    prefix = url_hash(url)
+    ids = []
+    seen = {}
+    for chunk_hash in chunk_hashes:
+        n = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = n + 1
+        vector_id = f"{prefix}-{chunk_hash[:16]}"
+        if n > 0:
+            vector_id += f"-{n}"
+        ids.append(vector_id)
+    return ids
+
+
+class ChunkPlan:
+    """
+    What has to happen in the vector index to bring one page up to date.
+
+    - new: list of (position, vector id, chunk) that must be embedded and upserted
+    - moved: list of (vector id, position) whose text is unchanged but whose
+      chunk-id metadata must be updated
+    - stale: list of vector ids that no longer exist on the page
+    - ids: vector ids of all chunks, in page order
+    - chunk_hashes: hashes of all chunks, in page order
+    """
+
+    def __init__(self, new, moved, stale, ids, chunk_hashes):
+        self.new = new
+        self.moved = moved
+        self.stale = stale
+        self.ids = ids
+        self.chunk_hashes = chunk_hashes
+
+
+class IngestManifest:
+    """
+    Local record of what has been ingested into a vector index.
+
+    For every url it stores the ETag and Last-Modified headers of the last
+    fetch, a hash of the extracted article, the chunker settings, and the
+    hashes and vector ids of its chunks. Ingestion uses it to send
+    conditional GETs, to skip pages that did not change and to re-embed only
+    the chunks that did.
+
+    untracked is True when no manifest of the index existed yet, so vectors
+    already in the index may have been written without one.
+    """
+
+    def __init__(self, path, untracked=None):
+        self.path = path
+        self.pages = {}
+        self.untracked = not os.path.exists(path) if untracked is None else untracked
+        if os.path.exists(path):
+            with open(path) as f:
+                self.pages = json.load(f)
+
+    @classmethod
+    def for_index(cls, index_name, name=None):
+        """
+        Returns the manifest of index_name. Tools that chunk the same index
+        differently pass their own name, so each keeps its own record instead
+        of undoing the other's chunks.
+        """
+        shared = os.path.join(DEFAULT_MANIFEST_DIR, f"manifest-{index_name}.json")
+        if name is None:
+            return cls(shared)
+
+        existing = cls._index_manifests(index_name)
+        manifest = cls(os.path.join(DEFAULT_MANIFEST_DIR, f"manifest-{index_name}-{name}.json"), untracked=not existing)
+        if not os.path.exists(manifest.path) and os.path.exists(shared):
+            # start from the manifest the tools used to share; its entries
+            # have no chunker settings, so their pages are chunked again once
+            with open(shared) as f:
+                manifest.pages = json.load(f)
+        return manifest
+
+    @staticmethod
+    def _index_manifests(index_name):
+        return glob.glob(os.path.join(glob.escape(DEFAULT_MANIFEST_DIR), f"manifest-{glob.escape(index_name)}*.json"))
+
+    @classmethod
+    def forget_index(cls, index_name):
+        """
+        Deletes the manifests of every tool for index_name, for when the
+        index was (re)created and their vectors are gone.
+        """
+        for path in cls._index_manifests(index_name):
+            os.remove(path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.pages, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.pages = {}
+
+    def get(self, url):
+        return self.pages.get(url)
+
+    def urls(self):
+        return list(self.pages)
+
+    def conditional_headers(self, url):
+        entry = self.pages.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def fetch(self, session, url, timeout=30):
+        """
+        Fetches url with a conditional GET. Returns None when the server
+        reports the page as not modified since the last ingestion.
+        """
+        response = session.get(url, headers=self.conditional_headers(url), timeout=timeout)
+        if response.status_code == 304:
+            return None
+        return response
+
+    def is_unchanged(self, url, article_hash, chunker=None):
+        # a page chunked with other settings has to be chunked again
+        entry = self.pages.get(url)
+        return entry is not None and entry['content_hash'] == article_hash and entry.get('chunker') == chunker
+
+    def plan(self, url, chunks):
+        """
+        Compares the chunks of a page with the manifest and returns a ChunkPlan.
+        """
+        chunk_hashes = [content_hash(chunk) for chunk in chunks]
+        ids = chunk_vector_ids(url, chunk_hashes)
+
+        entry = self.pages.get(url) or {'ids': []}
+        old_positions = {vector_id: j for j, vector_id in enumerate(entry['ids'])}
+
+        new = []
+        moved = []
+        for j, (vector_id, chunk) in enumerate(zip(ids, chunks)):
+            if vector_id not in old_positions:
+                new.append((j, vector_id, chunk))
+            elif old_positions[vector_id] != j:
+                moved.append((vector_id, j))
+
+        current = set(ids)
+        stale = [vector_id for vector_id in entry['ids'] if vector_id not in current]
+
+        return ChunkPlan(new, moved, stale, ids, chunk_hashes)
+
+    def update(self, url, response, article_hash, plan=None, chunker=None):
+        """
+        Records the result of ingesting url with the chunker settings.
+        Without a plan only the validators of the response are refreshed.
+        """
+        entry = self.pages.get(url) or {'chunk_hashes': [], 'ids': []}
+        entry['etag'] = response.headers.get('ETag') if response is not None else entry.get('etag')
+        entry['last_modified'] = response.headers.get('Last-Modified') if response is not None else entry.get('last_modified')
+        entry['content_hash'] = article_hash
+        entry['chunker'] = chunker
+        if plan is not None:
+            entry['chunk_hashes'] = plan.chunk_hashes
+            entry['ids'] = plan.ids
+        entry['updated'] = time.time()
+        self.pages[url] = entry
+
+    def remove(self, url):
+        """
+        Forgets url and returns the vector ids that belonged to it.
+        """
+        entry = self.pages.pop(url, None)
+        return entry['ids'] if entry else []
@@ -0,0 +1,193 @@
+import bisect
+import collections
+import contextlib
+import os
+import threading
+import time
+import numpy as np
+
+# upper bounds of the latency buckets in seconds; completions take seconds,
+# cache lookups microseconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# recent observations per series that p50/p95/p99 are computed from
+DEFAULT_WINDOW = int(os.getenv('METRICS_WINDOW', 1024))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _labels(labels):
+    # a hashable, ordered label set
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """
+    Latency histogram of one label set: cumulative bucket counts, sum and
+    count for Prometheus, and a window of the most recent observations for
+    exact quantiles.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=DEFAULT_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=QUANTILES):
+        if not self.recent:
+            return {q: None for q in quantiles}
+        values = np.quantile(np.fromiter(self.recent, dtype=float), quantiles)
+        return dict(zip(quantiles, values.tolist()))
+
+
+class Metrics:
+    """
+    Registry of histograms and counters with labels, rendered in the
+    Prometheus text format by render().
+
+    observe() adds an observation to a histogram, inc() increments a
+    counter. Values owned by other objects, such as cache statistics, are
+    read when the metrics are rendered from callbacks registered with
+    collect(); a callback returns (name, type, labels, value) tuples.
+    """
+
+    def __init__(self, prefix='', buckets=LATENCY_BUCKETS, window=DEFAULT_WINDOW):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.window = window
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+        self.collectors = []
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets, self.window)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def collect(self, callback):
+        self.collectors.append(callback)
+
+    def summary(self, name):
+        """
+        Returns count, mean and quantiles (in seconds) of every label set of
+        histogram name, as a list of dicts.
+        """
+        with self.lock:
+            series = [(labels, histogram) for (n, labels), histogram in self.histograms.items() if n == name]
+            return [
+                dict(labels, count=histogram.count, mean=histogram.sum / histogram.count,
+                     **{f"p{int(q * 100)}": value for q, value in histogram.quantiles().items()})
+                for labels, histogram in series
+            ]
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format. Every
+        histogram is also exported as a summary named <name>_recent with the
+        quantiles of its recent observations.
+        """
+        lines = []
+        families = collections.defaultdict(list)
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                families[(name, 'histogram')].append((labels, histogram))
+            for (name, labels), value in sorted(self.counters.items()):
+                families[(name, 'counter')].append((labels, value))
+            histograms = {key: [(labels, histogram.counts[:], histogram.sum, histogram.count, histogram.quantiles())
+                                for labels, histogram in series]
+                          for key, series in families.items() if key[1] == 'histogram'}
+        for callback in self.collectors:
+            for name, kind, labels, value in callback():
+                families[(name, kind)].append((_labels(labels), value))
+
+        for (name, kind), series in families.items():
+            full = self.prefix + name
+            if name in self.help:
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            if kind != 'histogram':
+                for labels, value in series:
+                    lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            snapshot = histograms[(name, kind)]
+            for labels, counts, total, count, _ in snapshot:
+                cumulative = 0
+                for bound, n in zip(list(self.buckets) + ['+Inf'], counts):
+                    cumulative += n
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f"{full}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{full}_count{_format_labels(labels)} {count}")
+            lines.append(f"# TYPE {full}_recent summary")
+            for labels, _, total, count, quantiles in snapshot:
+                for q, value in quantiles.items():
+                    if value is not None:
+                        lines.append(f"{full}_recent{_format_labels(labels, [('quantile', str(q))])} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class Timings:
+    """
+    Stage timer of one request. Every stage is observed in the histogram
+    name of metrics with the stage and the labels of the timer (which may be
+    filled in while the request runs, e.g. the model once it is validated),
+    and kept for as_dict(). finish() observes the total as stage "total".
+    """
+
+    def __init__(self, metrics, name='stage_seconds', **labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.metrics.observe(self.name, seconds, stage=stage, **self.labels)
+
+    def finish(self):
+        self.record('total', time.perf_counter() - self.started)
+
+    def as_dict(self):
+        # milliseconds per stage, for responses
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
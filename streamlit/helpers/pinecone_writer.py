@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Pinecone rejects upsert requests larger than 2 MB or with more than 1000
+# vectors; keep some room for the request envelope
+MAX_REQUEST_BYTES = int(os.getenv('PINECONE_UPSERT_MAX_BYTES', 2 * 1000 * 1000 - 64 * 1024))
+MAX_REQUEST_VECTORS = 1000
+DEFAULT_IN_FLIGHT = int(os.getenv('PINECONE_UPSERT_IN_FLIGHT', 4))
+# hosts of the Pinecone API instead of the ones derived from the environment
+# and project, e.g. a local fake (benchmarks/fake_services.py). In the index
+# host, "{index_name}" is replaced by the name of the index
+CONTROLLER_HOST = os.getenv('PINECONE_CONTROLLER_HOST')
+INDEX_HOST = os.getenv('PINECONE_INDEX_HOST')
+# keep-alive connections per index client; the client default (5 per core)
+# is smaller than the number of threads that may query at once
+CONNECTION_POOL_SIZE = int(os.getenv('PINECONE_CONNECTION_POOL_SIZE', 32))
+
+
+def init_pinecone():
+    """
+    Calls pinecone.init() with PINECONE_API_KEY and PINECONE_ENVIRONMENT and
+    a connection pool of at least PINECONE_CONNECTION_POOL_SIZE; index
+    management goes to PINECONE_CONTROLLER_HOST when it is set.
+    """
+    import certifi
+    import pinecone
+    from pinecone.core.client.configuration import Configuration
+
+    openapi_config = Configuration.get_default_copy()
+    openapi_config.ssl_ca_cert = certifi.where()
+    openapi_config.connection_pool_maxsize = max(openapi_config.connection_pool_maxsize or 0, CONNECTION_POOL_SIZE)
+    options = dict(openapi_config=openapi_config)
+    if CONTROLLER_HOST:
+        # the client only reads the controller host for whoami; the index
+        # operations use the host of the OpenAPI configuration
+        openapi_config.host = CONTROLLER_HOST
+        options.update(host=CONTROLLER_HOST)
+    pinecone.init(api_key=os.getenv('PINECONE_API_KEY'), environment=os.getenv('PINECONE_ENVIRONMENT'), **options)
+
+
+def open_index(index_name, pool_threads=DEFAULT_IN_FLIGHT):
+    """
+    Returns a pinecone.Index for index_name; pinecone.init() must have been
+    called. Requests go to PINECONE_INDEX_HOST when it is set.
+    """
+    import pinecone
+
+    index = pinecone.Index(index_name, pool_threads=pool_threads)
+    if INDEX_HOST:
+        index.configuration.host = INDEX_HOST.format(index_name=index_name)
+    return index
+
+
+def vector_bytes(vector):
+    """
+    Size of one (id, values, metadata) tuple in a JSON upsert request.
+    """
+    id, values, metadata = vector
+    values = values.tolist() if hasattr(values, 'tolist') else list(values)
+    return len(json.dumps({"id": id, "values": values, "metadata": metadata or {}}))
+
+
+def make_upsert_batches(vectors, max_bytes=MAX_REQUEST_BYTES, max_vectors=MAX_REQUEST_VECTORS):
+    """
+    Packs vectors, in order, into batches whose serialized size stays
+    within max_bytes and that hold at most max_vectors vectors. A single
+    vector larger than max_bytes gets a batch of its own. Returns a list of
+    (batch, size in bytes) pairs.
+    """
+    batches = []
+    batch = []
+    size = 0
+    for vector in vectors:
+        n = vector_bytes(vector)
+        if batch and (size + n > max_bytes or len(batch) >= max_vectors):
+            batches.append((batch, size))
+            batch = []
+            size = 0
+        batch.append(vector)
+        size += n
+    if batch:
+        batches.append((batch, size))
+    return batches
+
+
+def _retryable(e):
+    # network errors, throttling and server errors; other 4xx are the request's fault
+    status = getattr(e, 'status', None)
+    return status is None or status == 429 or status >= 500
+
+
+def _splittable(e):
+    # the request was rejected for its content or size; smaller ones may pass
+    return getattr(e, 'status', None) in (400, 413)
+
+
+class PineconeWriter:
+    """
+    Upserts vectors to a Pinecone index in size-aware batches that are sent
+    concurrently.
+
+    write() splits the vectors with make_upsert_batches and hands every batch
+    to a pool of in_flight threads. It only blocks when in_flight batches are
+    already being sent, so the caller (the embedding stage) keeps working
+    while earlier batches are uploaded. A batch that fails with a network
+    error, 429 or 5xx is retried on its own with exponential backoff and
+    fails once its attempts are used up; splitting it would only multiply
+    the requests of a throttled or failing service. A batch rejected as
+    invalid or too large (400, 413) is split in half to isolate the
+    offending vectors. flush() waits for all batches and raises the first
+    error that could not be recovered.
+    """
+
+    def __init__(self, index, max_bytes=MAX_REQUEST_BYTES, max_vectors=MAX_REQUEST_VECTORS, in_flight=DEFAULT_IN_FLIGHT, attempts=3):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_vectors = max_vectors
+        self.attempts = attempts
+        self.executor = ThreadPoolExecutor(max_workers=in_flight)
+        self.slots = threading.BoundedSemaphore(in_flight)
+        self.lock = threading.Lock()
+        self.futures = []
+        self.errors = []
+        self.vectors = 0
+        self.batches = 0
+        self.bytes = 0
+        self.retries = 0
+        self.started = None
+        self.finished = None
+
+    def _upsert(self, batch, size):
+        for attempt in range(self.attempts):
+            try:
+                self.index.upsert(vectors=batch)
+                with self.lock:
+                    self.vectors += len(batch)
+                    self.batches += 1
+                    self.bytes += size
+                    self.finished = time.perf_counter()
+                return
+            except Exception as e:
+                if not _retryable(e) or attempt == self.attempts - 1:
+                    error = e
+                    break
+                logging.warning("Upsert of %d vectors failed, retrying: %s", len(batch), e)
+                with self.lock:
+                    self.retries += 1
+                time.sleep(2 ** attempt)
+
+        if len(batch) == 1 or not _splittable(error):
+            raise error
+
+        # isolate the vectors that make the request fail
+        logging.warning("Upsert of %d vectors failed, splitting the batch: %s", len(batch), error)
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            self._upsert(half, sum(vector_bytes(vector) for vector in half))
+
+    def _send(self, batch, size):
+        try:
+            self._upsert(batch, size)
+        except Exception as e:
+            with self.lock:
+                self.errors.append(e)
+        finally:
+            self.slots.release()
+
+    def write(self, vectors):
+        """
+        Queues vectors for upserting; returns once every batch is in flight.
+        """
+        if self.started is None:
+            self.started = time.perf_counter()
+        for batch, size in make_upsert_batches(vectors, self.max_bytes, self.max_vectors):
+            self.slots.acquire()
+            future = self.executor.submit(self._send, batch, size)
+            with self.lock:
+                self.futures.append(future)
+
+    def flush(self):
+        """
+        Waits until all queued batches are written. Raises the first error
+        of a batch that could not be written.
+        """
+        with self.lock:
+            futures = self.futures
+            self.futures = []
+        for future in futures:
+            future.result()
+
+        with self.lock:
+            errors = self.errors
+            self.errors = []
+        if errors:
+            raise RuntimeError(f"{len(errors)} upsert batches failed") from errors[0]
+
+    def stats(self):
+        with self.lock:
+            seconds = self.finished - self.started if self.finished else 0.0
+            return {
+                'vectors': self.vectors,
+                'batches': self.batches,
+                'bytes': self.bytes,
+                'retries': self.retries,
+                'seconds': seconds,
+                'vectors_per_s': self.vectors / seconds if seconds > 0 else 0.0,
+            }
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
@@ -0,0 +1,226 @@
+import queue
+import threading
+import time
+
+# end-of-stream marker passed between stages
+_DONE = object()
+
+# seconds a blocked worker waits before it checks whether the pipeline stopped
+_POLL = 0.1
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    func is called with every item that reaches the stage, on one of workers
+    threads, and returns an iterable of items for the next stage (or None).
+    With batch_size, items are first grouped into lists whose total
+    weight(item) stays within batch_size, and func is called with a list;
+    weight defaults to 1, so batch_size is then a number of items.
+
+    The input queue of the stage holds at most queue_size items (by default
+    twice the number of workers); a stage that cannot keep up blocks the
+    stage before it.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None, batch_size=None, weight=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+        self.batch_size = batch_size
+        self.weight = weight or (lambda item: 1)
+        self.lock = threading.Lock()
+        self.inbox = None
+        self._reset()
+
+    def _reset(self):
+        self.items = 0
+        self.outputs = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def _record(self, items, outputs, started):
+        now = time.perf_counter()
+        with self.lock:
+            if self.started is None:
+                self.started = started
+            self.items += items
+            self.outputs += outputs
+            self.busy += now - started
+
+    def stats(self):
+        """
+        Returns the number of items processed and produced, the wall time
+        since the first item, the throughput in items per second and the
+        utilization of the workers (busy time / (wall time * workers)).
+        """
+        with self.lock:
+            if self.started is None:
+                wall = 0.0
+            else:
+                wall = (self.finished or time.perf_counter()) - self.started
+            return {
+                'items': self.items,
+                'outputs': self.outputs,
+                'queued': self.inbox.qsize() if self.inbox is not None else 0,
+                'seconds': wall,
+                'per_second': self.items / wall if wall > 0 else 0.0,
+                'utilization': self.busy / (wall * self.workers) if wall > 0 else 0.0,
+            }
+
+
+class Pipeline:
+    """
+    Runs items through a list of stages connected by bounded queues. Every
+    stage works on its own threads, so all stages run at the same time and
+    the slowest one sets the pace.
+
+    run() is a generator that runs on the caller's thread and yields the
+    items produced by the last stage and anything a stage passed to emit(),
+    so the caller can update a UI without touching it from worker threads.
+    The first exception raised by a stage stops the pipeline and is raised
+    again by run().
+    """
+
+    def __init__(self, stages, poll_interval=0.5):
+        self.stages = stages
+        self.poll_interval = poll_interval
+        self.events = queue.Queue()
+        self.stop = threading.Event()
+        self.errors = []
+
+    def emit(self, event):
+        # stage functions report to the caller of run() through this
+        self.events.put(event)
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def _fail(self, e):
+        self.errors.append(e)
+        self.stop.set()
+        self.events.put(_DONE)
+
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, items, outbox):
+        try:
+            for item in items:
+                if not self._put(outbox, item):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(outbox, _DONE)
+
+    def _batch(self, stage, inbox, outbox):
+        batch = []
+        weight = 0
+        try:
+            while True:
+                item = self._get(inbox)
+                if item is _DONE:
+                    break
+                item_weight = stage.weight(item)
+                if batch and weight + item_weight > stage.batch_size:
+                    if not self._put(outbox, batch):
+                        return
+                    batch = []
+                    weight = 0
+                batch.append(item)
+                weight += item_weight
+                if weight >= stage.batch_size:
+                    if not self._put(outbox, batch):
+                        return
+                    batch = []
+                    weight = 0
+            if batch:
+                self._put(outbox, batch)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(outbox, _DONE)
+
+    def _work(self, stage, inbox, outbox, remaining):
+        try:
+            while True:
+                item = self._get(inbox)
+                if item is _DONE:
+                    # leave the marker for the other workers of the stage
+                    self._put(inbox, _DONE)
+                    break
+                started = time.perf_counter()
+                outputs = list(stage.func(item) or ())
+                stage._record(len(item) if stage.batch_size else 1, len(outputs), started)
+                for output in outputs:
+                    if not self._put(outbox, output):
+                        return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with stage.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+                if last:
+                    stage.finished = time.perf_counter()
+            if last:
+                self._put(outbox, _DONE)
+
+    def run(self, items):
+        self.stop.clear()
+        self.errors = []
+        for stage in self.stages:
+            stage._reset()
+            stage.inbox = queue.Queue(stage.queue_size)
+
+        # the last stage writes to the (unbounded) event queue
+        outboxes = [stage.inbox for stage in self.stages[1:]] + [self.events]
+        threads = [threading.Thread(target=self._feed, args=(items, self.stages[0].inbox), daemon=True)]
+        for stage, outbox in zip(self.stages, outboxes):
+            inbox = stage.inbox
+            if stage.batch_size:
+                batches = queue.Queue(stage.workers + 1)
+                threads.append(threading.Thread(target=self._batch, args=(stage, inbox, batches), daemon=True))
+                inbox = batches
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(stage, inbox, outbox, remaining), daemon=True))
+
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                try:
+                    event = self.events.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    # nothing happened; give the caller a chance to refresh progress
+                    yield None
+                    continue
+                if event is _DONE:
+                    break
+                yield event
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
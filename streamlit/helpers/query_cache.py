@@ -0,0 +1,167 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import openai
+from embedding_cache import cache_key, normalize_text
+from embeddings import EMBEDDING_MODEL
+
+DEFAULT_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+DEFAULT_TTL = int(os.getenv('QUERY_CACHE_TTL', 24 * 3600))
+# optional shared second level: "file" or "redis"
+DEFAULT_BACKEND = os.getenv('QUERY_CACHE_BACKEND', '')
+DEFAULT_FILE = os.getenv('QUERY_CACHE_FILE', os.path.join(os.path.expanduser('~'), '.cache', 'gpt-vectors', 'query-embeddings.sqlite'))
+
+
+def normalize_query(text):
+    # questions typed again rarely match byte for byte
+    return normalize_text(text).lower()
+
+
+class FileBackend:
+    """
+    Query embeddings shared between processes on one machine, in SQLite.
+    """
+
+    def __init__(self, path=DEFAULT_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, vector BLOB, expires REAL)')
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT vector, expires FROM queries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, key, vector, ttl):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO queries (key, vector, expires) VALUES (?, ?, ?)',
+                (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time() + ttl)
+            )
+            # drop expired entries while we are here
+            self.db.execute('DELETE FROM queries WHERE expires < ?', (time.time(),))
+            self.db.commit()
+
+
+class RedisBackend:
+    """
+    Query embeddings shared between processes and machines, in Redis.
+    """
+
+    def __init__(self, prefix='query-embedding:'):
+        import redis
+
+        self.conn = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), password=os.getenv('REDIS_PASSWORD'))
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.conn.get(self.prefix + key)
+        if data is None:
+            return None
+        return np.frombuffer(data, dtype=np.float32).tolist()
+
+    def put(self, key, vector, ttl):
+        self.conn.set(self.prefix + key, np.asarray(vector, dtype=np.float32).tobytes(), ex=ttl)
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache with a TTL for query embeddings, keyed by model and
+    normalized query text. An optional shared backend is consulted on a
+    local miss, so processes can reuse each other's embeddings.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+
+    def get(self, model, text):
+        key = cache_key(model, normalize_query(text))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                vector, expires = entry
+                if expires >= time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self.entries[key]
+
+        if self.backend is not None:
+            vector = self.backend.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+                with self.lock:
+                    self.backend_hits += 1
+                return vector
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, vector):
+        with self.lock:
+            self.entries[key] = (vector, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def put(self, model, text, vector):
+        key = cache_key(model, normalize_query(text))
+        self._remember(key, vector)
+        if self.backend is not None:
+            self.backend.put(key, vector, self.ttl)
+
+    def stats(self):
+        lookups = self.hits + self.backend_hits + self.misses
+        return {
+            'hits': self.hits,
+            'backend_hits': self.backend_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.backend_hits) / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
+
+
+_query_cache = None
+
+def get_query_cache():
+    global _query_cache
+    if _query_cache is None:
+        backend = None
+        if DEFAULT_BACKEND == 'file':
+            backend = FileBackend()
+        elif DEFAULT_BACKEND == 'redis':
+            backend = RedisBackend()
+        _query_cache = QueryEmbeddingCache(backend=backend)
+    return _query_cache
+
+
+def embed_query(query, model=EMBEDDING_MODEL):
+    """
+    Returns the embedding of a search query, from the query cache when the
+    same query was embedded recently. Errors of the embeddings API are raised
+    to the caller.
+    """
+    cache = get_query_cache()
+    vector = cache.get(model, query)
+    if vector is None:
+        vector = openai.Embedding.create(
+            input=query,
+            model=model
+        )["data"][0]["embedding"]
+        cache.put(model, query, vector)
+    return vector
@@ -0,0 +1,245 @@
+import os
+import time
+import numpy as np
+import redis
+from redis.commands.search.field import NumericField, TagField, TextField, VectorField
+
+try:
+    from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+except ImportError:
+    # redis-py 5 renamed the module
+    from redis.commands.search.index_definition import IndexDefinition, IndexType
+
+INDEX_NAME = 'posts'
+PREFIX = 'post:'
+DEFAULT_BATCH_SIZE = int(os.getenv('REDIS_PIPELINE_BATCH', 500))
+
+_pools = {}
+
+
+def get_connection(host=None, port=None, password=None):
+    """
+    Returns a binary-safe connection (decode_responses=False, embeddings are
+    FLOAT32 blobs) from a connection pool shared by the process. Connection
+    details default to REDIS_HOST, REDIS_PORT and REDIS_PASSWORD.
+    """
+    key = (host or os.getenv('REDIS_HOST'), port or os.getenv('REDIS_PORT'), password or os.getenv('REDIS_PASSWORD'))
+    if key not in _pools:
+        _pools[key] = redis.ConnectionPool(host=key[0], port=key[1] or 6379, password=key[2])
+    return redis.Redis(connection_pool=_pools[key])
+
+
+def prefix_for(index_name):
+    # key prefix of the hashes of an index; "posts" keeps its "post:" prefix
+    return PREFIX if index_name == INDEX_NAME else f"{index_name}:"
+
+
+def index_schema(dimension=1536):
+    # url is a tag, so url filters match the whole url exactly
+    return [
+        TagField("url"),
+        TextField("text"),
+        NumericField("chunk-id"),
+        VectorField("embedding", "HNSW", {"TYPE": "FLOAT32", "DIM": dimension, "DISTANCE_METRIC": "COSINE"}),
+    ]
+
+
+def hash_metadata(fields):
+    """
+    Converts the fields of a post hash (or search result) to metadata like
+    the other vector stores return it.
+    """
+    metadata = {}
+    for key, value in fields.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        if key in ("embedding", "vector_score", "id", "payload"):
+            continue
+        value = value.decode() if isinstance(value, bytes) else value
+        metadata[key] = int(value) if key == "chunk-id" else value
+    return metadata
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _pairs(values):
+    # FT.INFO returns flat [key, value, key, value, ...] lists
+    return {_text(key): value for key, value in zip(values[::2], values[1::2])}
+
+
+def index_info(conn, index_name=INDEX_NAME):
+    """
+    Returns FT.INFO of the index, or None when it does not exist.
+    """
+    try:
+        return conn.ft(index_name).info()
+    except redis.ResponseError as e:
+        if 'unknown index' in str(e).lower() or 'no such index' in str(e).lower():
+            return None
+        raise
+
+
+def validate_index(info, prefix=PREFIX, dimension=1536):
+    """
+    Returns a list of differences between an existing index (FT.INFO) and
+    index_schema(dimension) on prefix; empty when the index matches.
+    """
+    problems = []
+    definition = _pairs(info.get('index_definition', []))
+    prefixes = [_text(p) for p in definition.get('prefixes', [])]
+    if definition and prefix not in prefixes:
+        problems.append(f"prefixes are {prefixes}, expected {prefix!r}")
+
+    fields = {}
+    for attribute in info.get('attributes', []):
+        attribute = _pairs(attribute)
+        fields[_text(attribute.get('attribute', attribute.get('identifier')))] = attribute
+
+    for field in index_schema(dimension):
+        name = field.name
+        attribute = fields.get(name)
+        if attribute is None:
+            problems.append(f"field {name} is missing")
+            continue
+        expected = field.args[0] if field.args else None
+        actual = _text(attribute.get('type'))
+        if expected is not None and actual != expected:
+            problems.append(f"field {name} is {actual}, expected {expected}")
+        if actual == 'VECTOR':
+            # recent RediSearch versions report the vector parameters
+            if 'dim' in attribute and int(attribute['dim']) != dimension:
+                problems.append(f"field {name} has dimension {_text(attribute['dim'])}, expected {dimension}")
+            if 'distance_metric' in attribute and _text(attribute['distance_metric']) != 'COSINE':
+                problems.append(f"field {name} uses {_text(attribute['distance_metric'])}, expected COSINE")
+    return problems
+
+
+class RedisBulkLoader:
+    """
+    Loads vectors into Redis hashes with pipelined HSETs and manages the
+    RediSearch index over them.
+
+    Every batch_size hashes are sent as one non-transactional pipeline, so a
+    batch costs one round trip instead of one per vector. With
+    defer_index=True and no index yet, load() creates the index after the
+    hashes are written; RediSearch then indexes all of them in the
+    background, which is much faster than indexing every HSET as it
+    arrives. An existing index is never dropped for a load, so it keeps
+    answering queries and indexes the new hashes as they arrive.
+    """
+
+    def __init__(self, conn=None, index_name=INDEX_NAME, prefix=PREFIX, batch_size=DEFAULT_BATCH_SIZE, dimension=1536):
+        self.conn = conn or get_connection()
+        self.index_name = index_name
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.dimension = dimension
+
+    def create_index(self):
+        self.conn.ft(self.index_name).create_index(
+            fields=index_schema(self.dimension),
+            definition=IndexDefinition(prefix=[self.prefix], index_type=IndexType.HASH)
+        )
+
+    def ensure_index(self, dimension=None, recreate=False):
+        """
+        Creates the index unless it exists and returns True if an existing
+        index is reused. Raises ValueError when the existing index does not
+        match the expected schema; reindex() migrates it to the current
+        schema and keeps the hashes, recreate drops them too.
+        """
+        self.dimension = dimension or self.dimension
+        info = index_info(self.conn, self.index_name)
+        if info is not None and recreate:
+            self.conn.ft(self.index_name).dropindex(delete_documents=True)
+            info = None
+        if info is None:
+            self.create_index()
+            return False
+
+        problems = validate_index(info, self.prefix, self.dimension)
+        if problems:
+            raise ValueError(f"Redis index {self.index_name} does not match the expected schema: " + "; ".join(problems)
+                             + " (reindex to migrate it, e.g. console/upload_vectors_redis.py --reindex)")
+        return True
+
+    def reindex(self):
+        """
+        Replaces the index with one of the current schema over the same
+        hashes, e.g. after url became a tag field. The hashes are kept and
+        indexed again in the background; see wait_for_indexing().
+        """
+        self.drop_index(delete_documents=False)
+        self.create_index()
+
+    def drop_index(self, delete_documents=True):
+        if index_info(self.conn, self.index_name) is not None:
+            self.conn.ft(self.index_name).dropindex(delete_documents=delete_documents)
+
+    def _mapping(self, values, metadata):
+        mapping = {key: str(value) for key, value in (metadata or {}).items()}
+        mapping["embedding"] = np.asarray(values, dtype=np.float32).tobytes()
+        return mapping
+
+    def load(self, vectors, defer_index=False):
+        """
+        Writes (id, values, metadata) tuples as hashes and returns load
+        statistics: vectors, batches, bytes, seconds and vectors_per_s.
+        vectors may be any iterable, so large corpora can be streamed.
+        """
+        # only a missing index is deferred; dropping a live one would leave
+        # queries without an index for the whole load
+        create_index = defer_index and index_info(self.conn, self.index_name) is None
+
+        start = time.perf_counter()
+        count = 0
+        batches = 0
+        size = 0
+        p = self.conn.pipeline(transaction=False)
+        for id, values, metadata in vectors:
+            mapping = self._mapping(values, metadata)
+            size += len(mapping["embedding"])
+            p.hset(self.prefix + id, mapping=mapping)
+            count += 1
+            if count % self.batch_size == 0:
+                p.execute()
+                batches += 1
+        if len(p):
+            p.execute()
+            batches += 1
+        elapsed = time.perf_counter() - start
+
+        if create_index:
+            self.create_index()
+
+        return {
+            'vectors': count,
+            'batches': batches,
+            'bytes': size,
+            'seconds': elapsed,
+            'vectors_per_s': count / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def wait_for_indexing(self, timeout=None, interval=0.5):
+        """
+        Waits until RediSearch finished indexing the existing hashes and
+        returns the number of indexed documents.
+        """
+        start = time.monotonic()
+        while True:
+            info = self.conn.ft(self.index_name).info()
+            if int(info.get('indexing', 0)) == 0:
+                return int(info.get('num_docs', 0))
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"Redis index {self.index_name} is still indexing")
+            time.sleep(interval)
+
+    def update(self, id, metadata):
+        self.conn.hset(self.prefix + id, mapping={key: str(value) for key, value in metadata.items()})
+
+    def delete(self, ids):
+        p = self.conn.pipeline(transaction=False)
+        for start in range(0, len(ids), self.batch_size):
+            p.delete(*[self.prefix + id for id in ids[start:start + self.batch_size]])
+        p.execute()
@@ -0,0 +1,144 @@
+import os
+import re
+import numpy as np
+from redis_index import INDEX_NAME, PREFIX, get_connection, hash_metadata, index_schema
+
+# HNSW candidate list size per query; None uses the EF_RUNTIME of the index (10)
+DEFAULT_EF_RUNTIME = int(os.getenv('REDIS_EF_RUNTIME', 0)) or None
+
+RETURN_FIELDS = ("url", "text", "chunk-id")
+
+# field types of the posts schema, used to translate filters
+FIELD_TYPES = {field.name: field.args[0] for field in index_schema()}
+
+_SPECIAL = re.compile(r'([,.<>{}\[\]"\':;!@#$%^&*()\-+=~/|\\\s])')
+
+
+def escape(value):
+    # RediSearch query syntax treats punctuation as separators or operators
+    return _SPECIAL.sub(r'\\\1', str(value))
+
+
+def _condition(field, value):
+    kind = FIELD_TYPES.get(field)
+    if kind is None:
+        raise ValueError(f"Cannot filter on unknown field: {field}")
+    name = '@' + escape(field)
+
+    if isinstance(value, dict):
+        if '$eq' in value:
+            return _condition(field, value['$eq'])
+        if '$in' in value:
+            if kind == 'TAG':
+                return f"{name}:{{{'|'.join(escape(v) for v in value['$in'])}}}"
+            return '(' + '|'.join(_condition(field, v) for v in value['$in']) + ')'
+        if kind == 'NUMERIC' and set(value) <= {'$gt', '$gte', '$lt', '$lte'}:
+            low = f"({value['$gt']}" if '$gt' in value else value.get('$gte', '-inf')
+            high = f"({value['$lt']}" if '$lt' in value else value.get('$lte', '+inf')
+            return f"{name}:[{low} {high}]"
+        raise ValueError(f"Unsupported filter on {field}: {value}")
+
+    if kind == 'NUMERIC':
+        return f"{name}:[{value} {value}]"
+    if kind == 'TAG':
+        return f"{name}:{{{escape(value)}}}"
+    return f'{name}:"{escape(value)}"'
+
+
+def filter_query(filter):
+    """
+    Translates a filter into a RediSearch pre-filter for the KNN query.
+
+    A string is used as is, so any RediSearch query can be combined with the
+    vector search. A dict uses the Pinecone subset understood by the other
+    backends: {"field": value}, {"field": {"$eq": value}} and
+    {"field": {"$in": [values]}}, plus $gt/$gte/$lt/$lte on numeric fields.
+    Text fields match the value as a phrase, tag fields exactly.
+    """
+    if not filter:
+        return '*'
+    if isinstance(filter, str):
+        return filter
+    return '(' + ' '.join(_condition(field, value) for field, value in filter.items()) + ')'
+
+
+def _search_args(index_name, vector, top_k, filter, ef_runtime, return_fields):
+    knn = "KNN $K @embedding $vector"
+    params = {"K": top_k, "vector": np.asarray(vector, dtype=np.float32).tobytes()}
+    if ef_runtime:
+        knn += " EF_RUNTIME $EF"
+        params["EF"] = ef_runtime
+    query = f"{filter_query(filter)}=>[{knn} AS vector_score]"
+
+    args = ["FT.SEARCH", index_name, query, "PARAMS", 2 * len(params)]
+    for key, value in params.items():
+        args.extend([key, value])
+    fields = list(return_fields) + ["vector_score"]
+    args.extend(["SORTBY", "vector_score", "RETURN", len(fields), *fields, "LIMIT", 0, top_k, "DIALECT", 2])
+    return args
+
+
+def _parse(response, prefix, include_metadata):
+    # [total, id, [field, value, ...], id, [field, value, ...], ...]
+    matches = []
+    for id, fields in zip(response[1::2], response[2::2]):
+        id = id.decode() if isinstance(id, bytes) else id
+        fields = dict(zip(fields[::2], fields[1::2]))
+        score = fields.get(b"vector_score", fields.get("vector_score"))
+        match = {
+            "id": id[len(prefix):] if id.startswith(prefix) else id,
+            # cosine distance to similarity
+            "score": 1 - float(score),
+        }
+        if include_metadata:
+            match["metadata"] = hash_metadata(fields)
+        matches.append(match)
+    return matches
+
+
+class RedisSearch:
+    """
+    KNN search over the posts index.
+
+    search() runs one query and honours top_k, an optional pre-filter (see
+    filter_query) and a per-query EF_RUNTIME; a larger ef_runtime improves
+    recall of the HNSW index at the cost of latency. search_many() sends
+    many queries in one pipeline, so a batch of searches costs a single
+    round trip. Results are lists of {"id", "score", "metadata"} dicts,
+    best first.
+    """
+
+    def __init__(self, conn=None, index_name=INDEX_NAME, prefix=PREFIX, ef_runtime=DEFAULT_EF_RUNTIME, return_fields=RETURN_FIELDS):
+        self.conn = conn or get_connection()
+        self.index_name = index_name
+        self.prefix = prefix
+        self.ef_runtime = ef_runtime
+        self.return_fields = return_fields
+
+    def search(self, vector, top_k=5, filter=None, ef_runtime=None, include_metadata=True):
+        args = _search_args(self.index_name, vector, top_k, filter, ef_runtime or self.ef_runtime, self.return_fields)
+        return _parse(self.conn.execute_command(*args), self.prefix, include_metadata)
+
+    def ids(self, filter, limit=1000):
+        """
+        Returns the ids of up to limit hashes matching filter (see
+        filter_query), without their fields.
+        """
+        response = self.conn.execute_command("FT.SEARCH", self.index_name, filter_query(filter),
+                                             "NOCONTENT", "LIMIT", 0, limit, "DIALECT", 2)
+        ids = [id.decode() if isinstance(id, bytes) else id for id in response[1:]]
+        return [id[len(self.prefix):] if id.startswith(self.prefix) else id for id in ids]
+
+    def search_many(self, vectors, top_k=5, filter=None, ef_runtime=None, include_metadata=True, batch_size=256):
+        """
+        Searches every vector in vectors and returns a list of results in the
+        same order. Queries are pipelined in groups of batch_size.
+        """
+        results = []
+        vectors = list(vectors)
+        for start in range(0, len(vectors), batch_size):
+            p = self.conn.pipeline(transaction=False)
+            for vector in vectors[start:start + batch_size]:
+                p.execute_command(*_search_args(self.index_name, vector, top_k, filter, ef_runtime or self.ef_runtime, self.return_fields))
+            results.extend(_parse(response, self.prefix, include_metadata) for response in p.execute())
+        return results
@@ -0,0 +1,460 @@
+import functools
+import json
+import os
+import threading
+import numpy as np
+from ann_index import IVFIndex, DEFAULT_NLIST, DEFAULT_NPROBE
+
+DEFAULT_BACKEND = os.getenv('VECTOR_STORE', 'pinecone')
+# index type of the local backend: "flat" (exact) or "ivf" (approximate)
+DEFAULT_LOCAL_INDEX = os.getenv('LOCAL_INDEX_TYPE', 'flat')
+DEFAULT_LOCAL_DIR = os.getenv('LOCAL_VECTOR_STORE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'gpt-vectors', 'vector-store'))
+
+# metadata fields that are indexed by every backend
+INDEXED_FIELDS = ["url", "chunk-id"]
+
+
+class VectorStore:
+    """
+    Common interface of the vector backends.
+
+    Vectors are written as (id, values, metadata) tuples, like pinecone
+    upserts, and query returns a dict with a "matches" list of dicts with
+    "id", "score" and "metadata", like a Pinecone query response, so code that
+    reads search results works with every backend.
+    """
+
+    def ensure_index(self, dimension=1536, recreate=False):
+        """
+        Creates the index if needed and returns True if an existing index
+        is reused.
+        """
+        raise NotImplementedError
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def update_metadata(self, id, metadata):
+        raise NotImplementedError
+
+    def delete(self, ids=None, filter=None):
+        raise NotImplementedError
+
+    def query(self, vector, top_k=5, include_metadata=True, filter=None):
+        raise NotImplementedError
+
+    def fetch(self, ids):
+        raise NotImplementedError
+
+    def flush(self):
+        # backends that buffer writes persist them here
+        pass
+
+
+class PineconeStore(VectorStore):
+    """
+    Upserts go through a PineconeWriter (see pinecone_writer.py): they are
+    sent in size-aware batches on background threads and flush() waits for
+    them.
+    """
+    _initialized = False
+
+    def __init__(self, index_name='blog-index'):
+        import pinecone
+        from pinecone_writer import DEFAULT_IN_FLIGHT, PineconeWriter, init_pinecone, open_index
+
+        if not PineconeStore._initialized:
+            init_pinecone()
+            PineconeStore._initialized = True
+
+        self.pinecone = pinecone
+        self.index_name = index_name
+        self.index = open_index(index_name, pool_threads=DEFAULT_IN_FLIGHT)
+        self.writer = PineconeWriter(self.index, in_flight=DEFAULT_IN_FLIGHT)
+
+    def ensure_index(self, dimension=1536, recreate=False):
+        existed = self.index_name in self.pinecone.list_indexes()
+        if existed and recreate:
+            self.pinecone.delete_index(self.index_name)
+        if not existed or recreate:
+            self.pinecone.create_index(self.index_name, dimension, metadata_config={"indexed": INDEXED_FIELDS})
+        return existed and not recreate
+
+    def upsert(self, vectors):
+        self.writer.write(vectors)
+
+    def update_metadata(self, id, metadata):
+        return self.index.update(id=id, set_metadata=metadata)
+
+    def delete(self, ids=None, filter=None):
+        # a delete must not overtake upserts that are still in flight
+        self.writer.flush()
+        if ids is not None:
+            return self.index.delete(ids=ids)
+        return self.index.delete(filter=filter)
+
+    def query(self, vector, top_k=5, include_metadata=True, filter=None):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+    def fetch(self, ids):
+        return self.index.fetch(ids=ids)
+
+    def flush(self):
+        self.writer.flush()
+
+
+class RedisStore(VectorStore):
+    """
+    Vectors are stored as hashes with a per-index prefix ("post:" for the
+    posts index) and indexed by a RediSearch index with an HNSW vector field. Writes go through
+    RedisBulkLoader (see redis_index.py), which pipelines them.
+    """
+
+    def __init__(self, index_name='posts', prefix='post:'):
+        from redis_index import RedisBulkLoader, get_connection
+        from redis_search import RedisSearch
+
+        # binary-safe pooled connection; embeddings are stored as FLOAT32 blobs
+        self.conn = get_connection()
+        self.index_name = index_name
+        self.prefix = prefix
+        self.loader = RedisBulkLoader(self.conn, index_name, prefix)
+        self.searcher = RedisSearch(self.conn, index_name, prefix)
+
+    def ensure_index(self, dimension=1536, recreate=False):
+        return self.loader.ensure_index(dimension, recreate)
+
+    def upsert(self, vectors):
+        self.loader.load(vectors)
+
+    def update_metadata(self, id, metadata):
+        self.loader.update(id, metadata)
+
+    def delete(self, ids=None, filter=None):
+        if ids:
+            self.loader.delete(ids)
+        if filter is not None:
+            # deleted hashes leave the index right away, so every search
+            # returns the next matches until none are left
+            while True:
+                matches = self.searcher.ids(filter)
+                if not matches:
+                    break
+                self.loader.delete(matches)
+
+    def query(self, vector, top_k=5, include_metadata=True, filter=None):
+        return {"matches": self.searcher.search(vector, top_k, filter=filter, include_metadata=include_metadata)}
+
+    def fetch(self, ids):
+        from redis_index import hash_metadata
+
+        p = self.conn.pipeline(transaction=False)
+        for id in ids:
+            p.hgetall(self.prefix + id)
+        vectors = {}
+        for id, fields in zip(ids, p.execute() if ids else []):
+            if not fields:
+                continue
+            vectors[id] = {
+                "id": id,
+                "values": np.frombuffer(fields[b"embedding"], dtype=np.float32).tolist(),
+                "metadata": hash_metadata(fields),
+            }
+        return {"vectors": vectors}
+
+
+def _matches_filter(metadata, filter):
+    # supports the equality subset of Pinecone filters: {"field": value},
+    # {"field": {"$eq": value}} and {"field": {"$in": [values]}}
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _locked(method):
+    # the ingestion pipeline writes to a LocalStore from several threads
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class LocalStore(VectorStore):
+    """
+    In-process vector store backed by NumPy.
+
+    All vectors are kept L2-normalized in one contiguous float32 matrix, so an
+    exact cosine top-k is a single matrix-vector product followed by
+    argpartition. The matrix is saved as a .npy file and memory-mapped when
+    the store is opened; it is only copied into memory on the first write to
+    it. Every change, metadata updates included, marks the store dirty, and
+    flush() persists a dirty store.
+
+    With index_type "ivf" an IVFIndex (see ann_index.py) narrows every query
+    down to the rows of the nprobe closest lists. Deleted rows are marked as
+    tombstones and removed when the store is compacted, on flush() or when
+    more than COMPACT_FRACTION of the rows are deleted.
+    """
+
+    COMPACT_FRACTION = 0.25
+
+    def __init__(self, index_name='blog-index', path=None, index_type=DEFAULT_LOCAL_INDEX, nlist=None, nprobe=None):
+        self.index_name = index_name
+        self.path = path or os.path.join(DEFAULT_LOCAL_DIR, index_name)
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dimension = None
+        self.lock = threading.RLock()
+        self._clear()
+        self._load()
+
+    def _new_ann(self):
+        if self.index_type != 'ivf':
+            return None
+        return IVFIndex(nlist=self.nlist or DEFAULT_NLIST, nprobe=self.nprobe or DEFAULT_NPROBE)
+
+    def _clear(self):
+        self.matrix = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.count = 0
+        self.deleted = 0
+        self.ids = []
+        self.metadata = []
+        self.positions = {}
+        self.ann = self._new_ann()
+        # changed since the last load or flush
+        self.dirty = False
+
+    def _load(self):
+        vectors_path = os.path.join(self.path, 'vectors.npy')
+        if not os.path.exists(vectors_path):
+            return
+
+        self.matrix = np.load(vectors_path, mmap_mode='r')
+        with open(os.path.join(self.path, 'store.json')) as f:
+            data = json.load(f)
+        self.ids = data['ids']
+        self.metadata = data['metadata']
+        self.count = len(self.ids)
+        self.alive = np.ones(self.count, dtype=bool)
+        self.dimension = self.matrix.shape[1]
+        self.positions = {id: i for i, id in enumerate(self.ids)}
+
+        # a saved index determines the index type of the store
+        ann = IVFIndex.load(self.path)
+        if ann is not None:
+            self.ann = ann
+            self.index_type = 'ivf'
+
+    def _writable(self, extra):
+        # copy a memory-mapped matrix into memory and grow it geometrically
+        needed = self.count + extra
+        if self.matrix is None:
+            capacity = max(needed, 1024)
+        elif isinstance(self.matrix, np.memmap) or needed > self.matrix.shape[0]:
+            capacity = max(needed, self.matrix.shape[0] * 2 if needed > self.matrix.shape[0] else self.matrix.shape[0])
+        else:
+            return
+
+        matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        if self.matrix is not None:
+            matrix[:self.count] = self.matrix[:self.count]
+            alive[:self.count] = self.alive[:self.count]
+        self.matrix = matrix
+        self.alive = alive
+
+    def _compact(self):
+        # drop tombstones; rows keep their relative order
+        if self.deleted == 0:
+            return
+        keep = self.alive[:self.count].copy()
+        self.matrix = np.ascontiguousarray(self.matrix[:self.count][keep])
+        self.alive = np.ones(len(self.matrix), dtype=bool)
+        self.ids = [id for id, k in zip(self.ids, keep) if k]
+        self.metadata = [metadata for metadata, k in zip(self.metadata, keep) if k]
+        self.count = len(self.ids)
+        self.deleted = 0
+        self.positions = {id: i for i, id in enumerate(self.ids)}
+        if self.ann is not None:
+            self.ann.compact(keep)
+
+    @_locked
+    def ensure_index(self, dimension=1536, recreate=False):
+        existed = self.count > 0 or os.path.exists(os.path.join(self.path, 'vectors.npy'))
+        if recreate:
+            self._clear()
+            self.flush()
+        self.dimension = dimension
+        return existed and not recreate
+
+    @_locked
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        values = np.asarray([v[1] for v in vectors], dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values = values / np.where(norms == 0, 1, norms)
+
+        if self.dimension is None:
+            self.dimension = values.shape[1]
+        self._writable(len(vectors))
+
+        rows = []
+        for (id, _, metadata), row in zip(vectors, values):
+            if id in self.positions:
+                i = self.positions[id]
+                self.metadata[i] = metadata or {}
+            else:
+                i = self.count
+                self.positions[id] = i
+                self.ids.append(id)
+                self.metadata.append(metadata or {})
+                self.count += 1
+            self.matrix[i] = row
+            self.alive[i] = True
+            rows.append(i)
+        self.dirty = True
+
+        if self.ann is not None and not self.ann.maybe_train(self.matrix, self.count, self.alive):
+            self.ann.add(rows, values)
+
+    @_locked
+    def update_metadata(self, id, metadata):
+        if id in self.positions:
+            self.metadata[self.positions[id]].update(metadata)
+            self.dirty = True
+
+    @_locked
+    def delete(self, ids=None, filter=None):
+        if filter is not None:
+            ids = [id for id in self.positions if _matches_filter(self.metadata[self.positions[id]], filter)]
+        ids = [id for id in (ids or []) if id in self.positions]
+        if not ids:
+            return
+
+        # mark rows as tombstones; they are skipped by queries
+        self._writable(0)
+        for id in ids:
+            i = self.positions.pop(id)
+            self.alive[i] = False
+            self.ids[i] = None
+            self.metadata[i] = None
+            self.deleted += 1
+        self.dirty = True
+
+        if self.deleted > self.count * self.COMPACT_FRACTION:
+            self._compact()
+
+    @_locked
+    def query(self, vector, top_k=5, include_metadata=True, filter=None, nprobe=None):
+        if self.count - self.deleted == 0:
+            return {"matches": []}
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        # candidate rows: the probed lists of the ANN index, or all rows
+        if self.ann is not None and self.ann.ready:
+            candidates = self.ann.candidates(query, nprobe)
+            candidates = candidates[candidates < self.count]
+        else:
+            candidates = None
+
+        if filter is not None:
+            rows = candidates if candidates is not None else range(self.count)
+            candidates = np.array([i for i in rows if self.alive[i] and _matches_filter(self.metadata[i], filter)], dtype=np.int64)
+        elif candidates is not None:
+            candidates = candidates[self.alive[candidates]]
+
+        if candidates is not None:
+            if len(candidates) == 0:
+                return {"matches": []}
+            scores = self.matrix[candidates] @ query
+        else:
+            scores = self.matrix[:self.count] @ query
+            if self.deleted:
+                scores[~self.alive[:self.count]] = -np.inf
+
+        k = min(top_k, len(scores), self.count - self.deleted)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        matches = []
+        for j in top:
+            i = int(candidates[j]) if candidates is not None else int(j)
+            match = {"id": self.ids[i], "score": float(scores[j])}
+            if include_metadata:
+                match["metadata"] = self.metadata[i]
+            matches.append(match)
+        return {"matches": matches}
+
+    @_locked
+    def fetch(self, ids):
+        vectors = {}
+        for id in ids:
+            if id in self.positions:
+                i = self.positions[id]
+                vectors[id] = {"id": id, "values": self.matrix[i].tolist(), "metadata": self.metadata[i]}
+        return {"vectors": vectors}
+
+    @_locked
+    def flush(self):
+        os.makedirs(self.path, exist_ok=True)
+        vectors_path = os.path.join(self.path, 'vectors.npy')
+        if self.matrix is None or self.count - self.deleted == 0:
+            for name in ('vectors.npy', 'store.json', 'ann.json', 'ann_centroids.npy', 'ann_assign.npy'):
+                if os.path.exists(os.path.join(self.path, name)):
+                    os.remove(os.path.join(self.path, name))
+            return
+
+        if not self.dirty:
+            # nothing changed since the store was opened or last flushed
+            return
+
+        self._compact()
+
+        # write to temporary files first so a crash never leaves a torn store
+        np.save(vectors_path + '.tmp.npy', self.matrix[:self.count])
+        with open(os.path.join(self.path, 'store.json.tmp'), 'w') as f:
+            json.dump({'ids': self.ids, 'metadata': self.metadata}, f)
+        os.replace(vectors_path + '.tmp.npy', vectors_path)
+        os.replace(os.path.join(self.path, 'store.json.tmp'), os.path.join(self.path, 'store.json'))
+        if self.ann is not None:
+            self.ann.save(self.path, self.count)
+        self.dirty = False
+
+
+_stores = {}
+
+def get_vector_store(index_name='blog-index', backend=None):
+    """
+    Returns the vector store for index_name. The backend is "pinecone",
+    "redis" or "local" and defaults to the VECTOR_STORE environment variable.
+    Stores are created once per process.
+    """
+    backend = backend or DEFAULT_BACKEND
+    key = (backend, index_name)
+    if key not in _stores:
+        if backend == 'pinecone':
+            _stores[key] = PineconeStore(index_name)
+        elif backend == 'redis':
+            from redis_index import prefix_for
+
+            _stores[key] = RedisStore(index_name, prefix_for(index_name))
+        elif backend == 'local':
+            _stores[key] = LocalStore(index_name)
+        else:
+            raise ValueError(f"Unknown vector store backend: {backend}")
+    return _stores[key]
@@ -7,28 +7,31 @@ sys.path.append(str(pathlib.Path().absolute()) + "/helpers")
 
 import feedparser
 import os
-import pinecone
 import openai
 import requests
-from bs4 import BeautifulSoup
 from retrying import retry
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import tiktoken
 import hashlib
 import streamlit as st
 import urllib.parse
-from helpers import tiktoken_len, create_embedding, crawl, scrape_website
+from crawler import crawl_website
+from manifest import IngestManifest
+from vector_store import get_vector_store
+from doc_store import get_document_store
+from ingest import Ingestion
+from embedding_cache import get_default_cache
 
 import dotenv
 
 dotenv.load_dotenv(dotenv_path='../.env')
 
 
-# check environment variables
-if os.getenv('PINECONE_API_KEY') is None:
+# check environment variables; Pinecone settings are only needed for the Pinecone backend
+pinecone_backend = os.getenv('VECTOR_STORE', 'pinecone') == 'pinecone'
+if pinecone_backend and os.getenv('PINECONE_API_KEY') is None:
     st.error("PINECONE_API_KEY not set. Please set this environment variable and restart the app.")
     st.stop()
-if os.getenv('PINECONE_ENVIRONMENT') is None:
+if pinecone_backend and os.getenv('PINECONE_ENVIRONMENT') is None:
     st.error("PINECONE_ENVIRONMENT not set. Please set this environment variable and restart the app.")
     st.stop()
 if os.getenv('OPENAI_API_KEY') is None:
@@ -38,7 +41,7 @@ if os.getenv('OPENAI_API_KEY') is None:
 # app starts here
 st.title("Upload content to Pinecone 🔎")
 
-st.write("Click Upload to upload baeke.info or other posts to Pinecone in chunks.")
+st.write("Click Upload to upload baeke.info or other posts to Pinecone (or the configured vector store) in chunks.")
 
 url = st.text_input("Address", "https://blog.baeke.info/feed/")
 
@@ -64,8 +67,14 @@ if address_type == "RSS":
         st.stop()
     st.write("Number of entries: ", num_pages)
 elif address_type == "Crawl":
-    # fill entries with all links until a certain depth
-    pages = scrape_website(url, 2)
+    # fill entries with all links until a certain depth; pages are
+    # streamed from the crawler as they are discovered
+    pages = []
+    crawl_status = st.empty()
+    for page in crawl_website(url, 2):
+        pages.append(page)
+        crawl_status.write(f"Crawling... {len(pages)} pages found")
+    crawl_status.empty()
     num_pages = len(pages)
     if num_pages == 0:
         st.write("Error processing feed. Stopping...")
@@ -78,93 +87,71 @@ with st.expander("Options", expanded=False):
     chunk_overlap = st.slider("Chunk overlap", 0, 60, 20)
     blog_entries = st.slider("Blog entries", 1, num_pages, num_pages)
     recreate = st.checkbox("Recreate index", False)
+    prune = st.checkbox("Remove pages that are no longer listed", False)
 
 if st.button("Upload"):
     # OpenAI API key
     openai.api_key = os.getenv('OPENAI_API_KEY')
 
-    # get the Pinecone API key and environment
-    pinecone_api = os.getenv('PINECONE_API_KEY')
-    pinecone_env = os.getenv('PINECONE_ENVIRONMENT')
-
-    pinecone.init(api_key=pinecone_api, environment=pinecone_env)
-
-    if "blog-index" not in pinecone.list_indexes():
-        st.write("Index does not exist. Creating...")
-        pinecone.create_index("blog-index", 1536, metadata_config= {"indexed": ["url", "chunk-id"]})
+    # the manifest records what is in the index, so unchanged pages and
+    # chunks are skipped; it is reset when the index is recreated. The console
+    # uploader embeds whole posts and keeps its own manifest
+    manifest = IngestManifest.for_index("blog-index", "upload")
+
+    # Pinecone unless VECTOR_STORE selects another backend
+    index = get_vector_store("blog-index")
+    if recreate:
+        st.write("Recreating index...")
+    index_existed = index.ensure_index(1536, recreate=recreate)
+    if index_existed:
+        st.write("Reusing existing index.")
     else:
-        st.write("Index already exists.")
-        if recreate:
-            st.write("Deleting existing index...")
-            pinecone.delete_index("blog-index")
-            st.write("Creating new index...")
-            pinecone.create_index("blog-index", 1536, metadata_config= {"indexed": ["url", "chunk-id"]})
-        else:
-            st.write("Reusing existing index.")
-
-    # set index; must exist
-    index = pinecone.Index('blog-index')
-
-    # create recursive text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
+        st.write("Index created.")
+        manifest.clear()
+        IngestManifest.forget_index("blog-index")
+
+    # pages on the feed use the WordPress article body, crawled pages the full text
+    use_entry_content = url == "https://blog.baeke.info/feed/"
+
+    # fetch, parse and chunk, embed and upsert run as overlapping stages;
+    # pages are chunked on paragraph, line and word boundaries in token space
+    ingestion = Ingestion(
+        index,
+        manifest,
+        get_document_store(),
+        use_entry_content=use_entry_content,
+        index_existed=index_existed,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,  # number of tokens overlap between chunks
-        length_function=tiktoken_len,
-        separators=['\n\n', '\n', ' ', '']
+        separators=['\n\n', '\n', ' ']
     )
 
     # starting the upload process
     progress_text = "Upload in progress..."
     my_bar = st.progress(0, text=progress_text)
+    stage_status = st.empty()
 
-    pinecone_vectors = []
-
+    # the pipeline runs on worker threads; progress is only updated from here
     with st.expander("Logs", expanded=False):
-        for i, entry in enumerate(pages[:blog_entries]):
-            page = entry['link']
-            r = requests.get(page)
-            soup = BeautifulSoup(r.text, 'html.parser')
-            if url == "https://blog.baeke.info/feed/":
-                article = soup.find("div", {"class": "entry-content"}).text
-            else:
-                article = soup.text
-
-            st.write("Processing URL: ", page)
-
-            # create chunks
-            chunks = text_splitter.split_text(article)
-
-            # create md5 hash of page
-            url = page
-            url_hash = hashlib.md5(url.encode("utf-8"))       
-            url_hash = url_hash.hexdigest()
-
-            number_of_chunks = len(chunks)
-
-            # create embeddings for each chunk
-            for j, chunk in enumerate(chunks):
-                st.write("\tCreating embedding for chunk ", j+1, " of ", number_of_chunks)
-                vector = create_embedding(chunk)
-
-                # concatenate hash and j
-                hash_j = url_hash + str(j)
-
-                # add vector to pinecone_vectors list
-                st.write("\tAdding vector to pinecone_vectors list for chunk ", j+1, " of ", number_of_chunks)
-                pinecone_vectors.append((hash_j, vector, {"url": page, "chunk-id": j, "text": chunk}))
-
-                # upsert every 100 vectors
-                if len(pinecone_vectors) % 100 == 0:
-                    st.write("Upserting batch of 100 vectors...")
-                    upsert_response = index.upsert(vectors=pinecone_vectors)
-                    pinecone_vectors = []
-            
-            # update progress bar
-            my_bar.progress((i+1)/blog_entries, text=progress_text + f" {i+1} of {blog_entries}")
-
-    # if there are any vectors left, upsert them
-    if len(pinecone_vectors) > 0:
-        upsert_response = index.upsert(vectors=pinecone_vectors)
-        pinecone_vectors = []
+        for message in ingestion.run([entry['link'] for entry in pages[:blog_entries]]):
+            if message is not None:
+                st.write(message)
+            my_bar.progress(ingestion.pages / blog_entries, text=progress_text + f" {ingestion.pages} of {blog_entries}")
+            stage_status.write(ingestion.progress())
+
+        # pages that were ingested before but are no longer listed
+        if prune:
+            for page in ingestion.prune(entry['link'] for entry in pages):
+                st.write("Removing vectors of unlisted page: ", page)
+
+    ingestion.finish()
 
     my_bar.progress(1.0, text="Upload complete.")
+    stage_status.write(ingestion.progress())
+    st.write("Pages skipped (unchanged): ", ingestion.skipped, ", failed: ", ingestion.failed,
+             ", vectors upserted: ", ingestion.vectors, ", deleted: ", len(ingestion.stale_ids))
+
+    # unchanged chunks are served from the embedding cache
+    cache = get_default_cache()
+    if cache is not None:
+        st.write("Embedding cache: ", cache.stats())
@@ -0,0 +1,7 @@
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+# the helpers and the langchain apps import their modules by name
+sys.path.append(str(ROOT / "streamlit" / "helpers"))
+sys.path.append(str(ROOT / "langchain"))
@@ -0,0 +1,44 @@
+import numpy as np
+from ann_index import IVFIndex
+from vector_store import LocalStore
+
+
+def normalized(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_overwritten_vector_that_changes_lists_is_returned_once(tmp_path):
+    rng = np.random.default_rng(0)
+    store = LocalStore("test", path=str(tmp_path), index_type="ivf", nlist=4, nprobe=4)
+    store.ensure_index(8)
+    values = rng.normal(size=(4 * 39 + 10, 8)).astype(np.float32)
+    store.upsert([(f"id-{i}", v, {}) for i, v in enumerate(values)])
+    assert store.ann.ready
+
+    # query once so the list arrays are cached, then move id-0 to another list
+    store.query(values[0], top_k=10)
+    old = int(store.ann.assign[0])
+    target = next(c for c in range(4) if c != old)
+    store.upsert([("id-0", store.ann.centroids[target], {})])
+    assert int(store.ann.assign[0]) == target
+
+    # and back again, so it is in its first list twice
+    store.upsert([("id-0", store.ann.centroids[old], {})])
+    for vector in (store.ann.centroids[old], store.ann.centroids[target]):
+        ids = [match["id"] for match in store.query(vector, top_k=50)["matches"]]
+        assert len(ids) == len(set(ids))
+
+
+def test_candidates_are_unique():
+    rng = np.random.default_rng(1)
+    index = IVFIndex(nlist=2, nprobe=2)
+    vectors = normalized(rng.normal(size=(100, 4)).astype(np.float32))
+    alive = np.ones(100, dtype=bool)
+    assert index.maybe_train(vectors, 100, alive)
+    index.candidates(vectors[0])
+    row_label = int(index.assign[5])
+    other = 1 - row_label
+    index.add([5], index.centroids[[other]])
+    index.add([5], index.centroids[[row_label]])
+    rows = index.candidates(vectors[0])
+    assert len(rows) == len(np.unique(rows)) == 100
@@ -0,0 +1,37 @@
+import os
+import time
+from answer_cache import AnswerCache, compact_log, log_invalidations
+
+
+def cached(cache, url):
+    cache.put([1.0, 0.0], "model", [url], [url], f"answer about {url}")
+    return cache.get([1.0, 0.0], "model", [url])
+
+
+def test_log_is_compacted_without_losing_invalidations(tmp_path):
+    log = str(tmp_path / "invalidations.log")
+    log_invalidations(["https://a/old"], log)
+    cache = AnswerCache(max_entries=4, log_path=log)
+    assert cached(cache, "https://a/kept") is not None
+
+    # the same urls over and over grow the log beyond its cap
+    for _ in range(200):
+        log_invalidations([f"https://a/{i}" for i in range(5)], log, max_bytes=2048)
+    assert os.path.getsize(log) <= 2048
+    assert cached(cache, "https://a/kept") is not None
+
+    log_invalidations(["https://a/kept"], log, max_bytes=0)
+    assert cache.get([1.0, 0.0], "model", ["https://a/kept"]) is None
+    # after the compaction the reader only applies entries it has not seen
+    assert cached(cache, "https://a/3") is not None
+
+
+def test_compaction_drops_entries_older_than_the_answers(tmp_path):
+    log = str(tmp_path / "invalidations.log")
+    with open(log, "w") as f:
+        f.write(f"{time.time() - 7200}\thttps://a/old\n{time.time()}\thttps://a/new\n")
+
+    compact_log(log, max_age=3600)
+
+    with open(log) as f:
+        assert [line.split("\t")[1] for line in f.read().splitlines()] == ["https://a/new"]
@@ -0,0 +1,52 @@
+from chunker import TokenChunker
+
+
+class ByteEncoding:
+    """One token per utf-8 byte, so tokens split multi-byte characters."""
+
+    name = "bytes"
+
+    def encode(self, text, disallowed_special=()):
+        return list(text.encode('utf-8'))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode('utf-8', errors='replace')
+
+    def decode_single_token_bytes(self, token):
+        return bytes([token])
+
+
+def test_chunks_do_not_split_multi_byte_characters():
+    text = "é" * 11 + "€" * 7 + "日本語" * 5
+    chunker = TokenChunker(chunk_size=8, chunk_overlap=3, encoding=ByteEncoding())
+
+    chunks = chunker.split_text(text)
+
+    assert chunks
+    assert not any("�" in chunk for chunk in chunks)
+    assert all(chunk in text for chunk in chunks)
+    assert text.endswith(chunks[-1])
+
+
+def test_a_character_longer_than_the_window_is_kept_whole():
+    chunker = TokenChunker(chunk_size=2, chunk_overlap=1, encoding=ByteEncoding())
+
+    assert chunker.split_text("日本") == ["日", "本"]
+
+
+def test_chunks_hold_at_most_chunk_size_tokens():
+    words = ["a", "word", "longer", "paragraph\n\n", "line\n", "x" * 30]
+    text = " ".join(words[i * 7 % len(words)] for i in range(400))
+    chunker = TokenChunker(chunk_size=64, chunk_overlap=8, encoding=ByteEncoding())
+    tokens = chunker.encoding.encode(text)
+    offsets = chunker._byte_offsets(tokens)
+    levels = chunker._boundary_levels(text.encode('utf-8'), offsets)
+
+    ranges = chunker.split_tokens(tokens, levels)
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(tokens)
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        # separators are only looked for in the second half of the window
+        assert 64 // 2 <= end - start <= 64
+        assert 0 <= end - next_start <= 8
+    assert all(len(chunk.encode('utf-8')) <= 64 for chunk in chunker.split_text(text))
@@ -0,0 +1,52 @@
+import pytest
+import pinecone_writer
+from pinecone_writer import PineconeWriter
+
+
+class ApiError(Exception):
+    def __init__(self, status):
+        super().__init__(f"status {status}")
+        self.status = status
+
+
+class FailingIndex:
+    def __init__(self, status, max_vectors=None):
+        self.status = status
+        self.max_vectors = max_vectors
+        self.requests = []
+
+    def upsert(self, vectors):
+        self.requests.append(len(vectors))
+        if self.max_vectors is None or len(vectors) > self.max_vectors:
+            raise ApiError(self.status)
+
+
+def batch(n):
+    return [(str(i), [0.0, 1.0], {"url": "u"}) for i in range(n)]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pinecone_writer.time, "sleep", lambda seconds: None)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_exhausted_retries_are_raised_without_splitting(status):
+    index = FailingIndex(status)
+    writer = PineconeWriter(index, attempts=3)
+    writer.write(batch(8))
+
+    with pytest.raises(RuntimeError) as error:
+        writer.flush()
+    assert error.value.__cause__.status == status
+    assert index.requests == [8, 8, 8]
+
+
+def test_rejected_batches_are_split():
+    index = FailingIndex(413, max_vectors=2)
+    writer = PineconeWriter(index, attempts=3)
+    writer.write(batch(8))
+    writer.flush()
+
+    assert index.requests == [8, 4, 2, 2, 4, 2, 2]
+    assert writer.stats()['vectors'] == 8
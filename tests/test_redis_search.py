@@ -0,0 +1,24 @@
+from redis_index import validate_index
+from redis_search import filter_query
+
+
+def test_url_filters_match_the_tag_exactly():
+    assert filter_query({"url": "https://blog.baeke.info/a-b/"}) == r"(@url:{https\:\/\/blog\.baeke\.info\/a\-b\/})"
+    assert filter_query({"url": {"$in": ["a.b", "c"]}}) == r"(@url:{a\.b|c})"
+
+
+def test_text_filters_are_phrases():
+    assert filter_query({"text": "kubernetes"}) == '(@text:"kubernetes")'
+
+
+def test_an_index_with_a_text_url_field_needs_a_migration():
+    info = {
+        "index_definition": [b"key_type", b"HASH", b"prefixes", [b"post:"]],
+        "attributes": [
+            [b"identifier", b"url", b"attribute", b"url", b"type", b"TEXT"],
+            [b"identifier", b"text", b"attribute", b"text", b"type", b"TEXT"],
+            [b"identifier", b"chunk-id", b"attribute", b"chunk-id", b"type", b"NUMERIC"],
+            [b"identifier", b"embedding", b"attribute", b"embedding", b"type", b"VECTOR"],
+        ],
+    }
+    assert validate_index(info) == ["field url is TEXT, expected TAG"]
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+from langchain.text_splitter import CharacterTextSplitter
+from vector_index import FaissIndexManager
+
+DIMENSION = 16
+
+
+class HashEmbeddings:
+    """Deterministic vectors seeded by the text, no OpenAI calls."""
+
+    model = "hash"
+
+    def __init__(self):
+        self.calls = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(DIMENSION).astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def write_book(root, name, lines, tag=""):
+    with open(os.path.join(root, name), "w", encoding="utf-8") as f:
+        f.write("\n".join(f"{name} {tag} line {i}" for i in range(lines)))
+
+
+def open_index(tmp_path, index_type="flat"):
+    embeddings = HashEmbeddings()
+    splitter = CharacterTextSplitter(separator="\n", chunk_size=20, chunk_overlap=0)
+    manager = FaissIndexManager(str(tmp_path / "faiss_index"), embeddings, {"chunk_size": 20}, index_type=index_type, workers=1)
+    books = sorted((tmp_path / "books").glob("*.txt"))
+    db = manager.open(books, splitter, root=str(tmp_path / "books"))
+    return db, embeddings, manager
+
+
+def sources(db):
+    return sorted({doc.metadata["source"].rsplit("/", 1)[-1] for doc in db.docstore._dict.values()})
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf"])
+def test_updates_embed_only_new_and_changed_files(tmp_path, index_type):
+    books = tmp_path / "books"
+    books.mkdir()
+    write_book(str(books), "a.txt", 700)
+    write_book(str(books), "b.txt", 700)
+    db, embeddings, manager = open_index(tmp_path, index_type)
+    total = db.index.ntotal
+    assert embeddings.calls == total
+
+    # add only: appended in place
+    write_book(str(books), "c.txt", 10)
+    db, embeddings, manager = open_index(tmp_path, index_type)
+    assert embeddings.calls == 10
+    assert db.index.ntotal == total + 10
+
+    # change: the old vectors of b.txt are dropped, the new ones embedded
+    write_book(str(books), "b.txt", 700, tag="changed")
+    db, embeddings, manager = open_index(tmp_path, index_type)
+    assert embeddings.calls == 700
+    assert db.index.ntotal == total + 10
+    assert len(db.docstore._dict) == db.index.ntotal
+
+    # removal: nothing is embedded
+    os.remove(books / "c.txt")
+    db, embeddings, manager = open_index(tmp_path, index_type)
+    assert embeddings.calls == 0
+    assert db.index.ntotal == total
+    assert sources(db) == ["a.txt", "b.txt"]
+    assert db.similarity_search("b.txt changed line 5", k=1)[0].page_content == "b.txt changed line 5"
+
+    # the saved version loads again without embedding anything
+    db, embeddings, manager = open_index(tmp_path, index_type)
+    assert embeddings.calls == 0
+    assert db.index.ntotal == total
+
+
+def test_flat_index_is_reindexed_as_ivf_from_its_vectors(tmp_path):
+    books = tmp_path / "books"
+    books.mkdir()
+    write_book(str(books), "a.txt", 700)
+    write_book(str(books), "b.txt", 700)
+    db, embeddings, manager = open_index(tmp_path, "flat")
+    total = db.index.ntotal
+
+    db, embeddings, manager = open_index(tmp_path, "ivf")
+    assert embeddings.calls == 0
+    assert db.index.ntotal == total
+    assert isinstance(db.index, faiss.IndexIVFFlat)
+    assert db.similarity_search("a.txt  line 7", k=1)[0].page_content == "a.txt  line 7"
+
+
+def test_flat_index_vectors_are_memory_mapped(tmp_path):
+    if not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        pytest.skip("faiss cannot memory map flat indexes")
+    books = tmp_path / "books"
+    books.mkdir()
+    write_book(str(books), "a.txt", 50)
+    flags = []
+    read_index = faiss.read_index
+
+    def recording_read_index(path, flag=0):
+        flags.append(flag)
+        return read_index(path, flag)
+
+    open_index(tmp_path, "flat")
+    faiss.read_index = recording_read_index
+    try:
+        db, embeddings, manager = open_index(tmp_path, "flat")
+    finally:
+        faiss.read_index = read_index
+    assert flags == [faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY]
+    assert db.similarity_search("a.txt  line 3", k=1)[0].page_content == "a.txt  line 3"
@@ -0,0 +1,104 @@
+import numpy as np
+from vector_store import LocalStore
+
+
+def vectors(n, dimension=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dimension)).astype(np.float32)
+
+
+def test_update_metadata_is_flushed_on_a_memory_mapped_store(tmp_path):
+    store = LocalStore("test", path=str(tmp_path))
+    store.ensure_index(8)
+    store.upsert([(f"id-{i}", v, {"url": "u", "chunk-id": i}) for i, v in enumerate(vectors(3))])
+    store.flush()
+
+    # reopened, the matrix is memory mapped and only metadata changes
+    store = LocalStore("test", path=str(tmp_path))
+    assert isinstance(store.matrix, np.memmap)
+    store.update_metadata("id-1", {"chunk-id": 7})
+    store.flush()
+
+    reopened = LocalStore("test", path=str(tmp_path))
+    assert reopened.fetch(["id-1"])["vectors"]["id-1"]["metadata"]["chunk-id"] == 7
+
+
+class FakeRedis:
+    """Hashes plus the FT.SEARCH tag queries RedisStore sends, no server."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.round_trips = 0
+
+    def execute_command(self, *args):
+        self.round_trips += 1
+        assert args[0] == "FT.SEARCH" and "NOCONTENT" in args
+        field, value = args[2].strip("()@}").split(":{")
+        value = value.replace("\\", "")
+        limit = args[args.index("LIMIT") + 2]
+        keys = [key for key, fields in self.hashes.items() if fields.get(field.encode()) == value.encode()][:limit]
+        return [len(keys), *keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def hset(self, key, mapping):
+        self.commands.append(lambda: self.conn.hashes.setdefault(key.encode(), {}).update(
+            {k.encode(): v if isinstance(v, bytes) else v.encode() for k, v in mapping.items()}))
+
+    def hgetall(self, key):
+        self.commands.append(lambda: dict(self.conn.hashes.get(key.encode(), {})))
+
+    def delete(self, *keys):
+        self.commands.append(lambda: [self.conn.hashes.pop(key if isinstance(key, bytes) else key.encode(), None) for key in keys])
+
+    def execute(self):
+        self.conn.round_trips += 1
+        results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+def redis_store():
+    from redis_index import RedisBulkLoader
+    from redis_search import RedisSearch
+    from vector_store import RedisStore
+
+    store = RedisStore.__new__(RedisStore)
+    store.conn = FakeRedis()
+    store.index_name, store.prefix = "posts", "post:"
+    store.loader = RedisBulkLoader(store.conn, "posts", "post:", batch_size=2)
+    store.searcher = RedisSearch(store.conn, "posts", "post:")
+    return store
+
+
+def test_redis_store_deletes_by_url_filter():
+    store = redis_store()
+    store.upsert([(str(i), v, {"url": "https://a.b/old" if i < 5 else "https://a.b/new", "chunk-id": i}) for i, v in enumerate(vectors(8))])
+
+    store.searcher.ids = lambda filter, limit=2, ids=store.searcher.ids: ids(filter, limit)
+    store.delete(filter={"url": "https://a.b/old"})
+
+    assert sorted(store.conn.hashes) == [b"post:5", b"post:6", b"post:7"]
+
+
+def test_redis_store_fetches_in_one_round_trip():
+    store = redis_store()
+    store.upsert([(str(i), v, {"url": "u", "chunk-id": i}) for i, v in enumerate(vectors(3))])
+    store.conn.round_trips = 0
+
+    fetched = store.fetch(["0", "2", "9"])["vectors"]
+
+    assert store.conn.round_trips == 1
+    assert sorted(fetched) == ["0", "2"]
+    assert fetched["2"]["metadata"] == {"url": "u", "chunk-id": 2}
+    np.testing.assert_allclose(fetched["2"]["values"], vectors(3)[2])
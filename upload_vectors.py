@@ -1,22 +1,32 @@
+import sys
+import pathlib
+
+# add the shared helpers folder to path (embedding batching and cache)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent / "streamlit" / "helpers"))
+
 import feedparser
 import os
-import pinecone
 import numpy as np
 import openai
 import requests
-from bs4 import BeautifulSoup
+from embeddings import create_embedding
+from embedding_cache import get_default_cache
+from answer_cache import log_invalidations
+from doc_store import get_document_store
+from extract import extract_article
+from pinecone_writer import DEFAULT_IN_FLIGHT, PineconeWriter, init_pinecone, open_index
 
 # OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# get the Pinecone API key and environment
-pinecone_api = os.getenv('PINECONE_API_KEY')
-pinecone_env = os.getenv('PINECONE_ENVIRONMENT')
+# uses the Pinecone API key and environment from the environment variables
+init_pinecone()
 
-pinecone.init(api_key=pinecone_api, environment=pinecone_env)
+# set index; must exist. The pool threads allow concurrent upserts
+index = open_index('blog-index', pool_threads=DEFAULT_IN_FLIGHT)
 
-# set index; must exist
-index = pinecone.Index('blog-index')
+# extracted articles are saved for the query path
+documents = get_document_store()
 
 # URL of the RSS feed to parse
 url = 'https://blog.baeke.info/feed/'
@@ -35,22 +45,43 @@ for i, entry in enumerate(feed.entries[:50]):
     print("Processing entry ", i, " of ", entries)
 
     r = requests.get(entry.link)
-    soup = BeautifulSoup(r.text, 'html.parser')
-    article = soup.find('div', {'class': 'entry-content'}).text
+    article = extract_article(r.text)
 
-    # vectorize with OpenAI text-emebdding-ada-002
-    embedding = openai.Embedding.create(
-        input=article,
-        model="text-embedding-ada-002"
-    )
+    # keep the article text for the query path
+    documents.put(entry.link, article)
 
-    # print the embedding (length = 1536)
-    vector = embedding["data"][0]["embedding"]
+    # vectorize with OpenAI text-emebdding-ada-002 (cached)
+    vector = create_embedding(article)
 
     # append tuple to pinecone_vectors list
     pinecone_vectors.append((str(i), vector, {"url": entry.link}))
 
-# all vectors can be upserted to pinecode in one go
-upsert_response = index.upsert(vectors=pinecone_vectors)
+# upsert in batches that fit the Pinecone request size limit, several at a time
+# ids are positions in the feed, so an upsert can replace another post's vector
+ids = [id for id, _, _ in pinecone_vectors]
+previous = index.fetch(ids=ids)["vectors"] if ids else {}
+writer = PineconeWriter(index)
+writer.write(pinecone_vectors)
+writer.close()
+print("Upserted: ", writer.stats())
+
+# cached answers are stale where an id now holds another url or the
+# article's vector changed; both the old and the new url are affected
+changed = set()
+for id, vector, metadata in pinecone_vectors:
+    old = previous.get(id)
+    if old is None:
+        changed.add(metadata["url"])
+        continue
+    old_url = (old.get("metadata") or {}).get("url")
+    if old_url != metadata["url"] or not np.allclose(old["values"], vector, atol=1e-6):
+        changed.update(url for url in (old_url, metadata["url"]) if url)
+print("Changed urls: ", len(changed))
+log_invalidations(sorted(changed))
+
+print("Vector upload complete.")
 
-print("Vector upload complete.")
\ No newline at end of file
+# report how many articles were served from the embedding cache
+cache = get_default_cache()
+if cache is not None:
+    print("Embedding cache: ", cache.stats())
\ No newline at end of file
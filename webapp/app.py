@@ -1,13 +1,26 @@
 import os
+import sys
+import pathlib
+import json
 import logging
+import time
 from re import M
-from flask import Flask, render_template, request, jsonify
-import pinecone
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import openai
 import requests
-from bs4 import BeautifulSoup
 import tiktoken
 
+# add the shared helpers folder to path (vector stores, query cache, document store)
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "streamlit" / "helpers"))
+
+from vector_store import get_vector_store
+from query_cache import embed_query, get_query_cache
+from doc_store import get_article, get_document_store
+from context_packer import context_budget, fit_text, pack_context
+from embeddings import tiktoken_len
+from answer_cache import get_answer_cache
+from metrics import Metrics, Timings
+
 app = Flask(__name__)
 
 ## returns url and score if score is high enough
@@ -19,62 +32,107 @@ def get_highest_score_url(items):
     
     return "", 0
 
-# init pinecone and openai
-pinecone_api = os.getenv('PINECONE_API_KEY')
-pinecone_env = os.getenv('PINECONE_ENVIRONMENT')
+# init the vector store (Pinecone unless VECTOR_STORE is set) and openai
+index = get_vector_store('blog-index')
 
-pinecone.init(api_key=pinecone_api, environment=pinecone_env)
+openai.api_key = os.getenv('OPENAI_API_KEY')
 
-index = pinecone.Index('blog-index')
+# answers to paraphrased questions over unchanged sources are reused;
+# None when ANSWER_CACHE=0
+answer_cache = get_answer_cache()
+
+allowed_models = ["gpt-3.5-turbo", "gpt-4"]
+
+# per-stage latency, token and cache metrics, scraped from /metrics
+metrics = Metrics(prefix='webapp_')
+metrics.describe('stage_seconds', "Time spent in each stage of a query, by model")
+metrics.describe('tokens_total', "Prompt (in) and completion (out) tokens, by model")
+metrics.describe('cache_lookups_total', "Lookups in the query embedding, document and answer caches")
+
+# add a "timings" block (milliseconds per stage) to every response, or only
+# when the request has timings=1
+ALWAYS_TIMINGS = os.getenv('WEBAPP_TIMINGS', '0') == '1'
+
+
+@metrics.collect
+def cache_lookups():
+    caches = {'query_embedding': get_query_cache(), 'document': get_document_store(), 'answer': answer_cache}
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        stats = cache.stats()
+        yield 'cache_lookups_total', 'counter', {'cache': name, 'result': 'hit'}, stats['hits'] + stats.get('backend_hits', 0)
+        yield 'cache_lookups_total', 'counter', {'cache': name, 'result': 'miss'}, stats['misses']
 
-openai.api_key = os.getenv('OPENAI_API_KEY')
+
+def wants_timings(form):
+    return ALWAYS_TIMINGS or form.get('timings', '').lower() in ('1', 'true', 'yes')
+
+
+def count_tokens(model, prompt_tokens, completion_tokens):
+    metrics.inc('tokens_total', prompt_tokens, model=model, direction='in')
+    metrics.inc('tokens_total', completion_tokens, model=model, direction='out')
 
 # default page
 @app.route('/')
 def home():
     return render_template('index.html')
 
-# respond to submit button
-@app.route('/query', methods=['POST'])
-def query():
+def error_response(message, score=0):
+    return {
+        'url': "",
+        'score': score,
+        'response': message
+    }
+
+
+def read_form(form):
+    """
+    Returns (error, query, model); error is a response dict when the form
+    has no query or an unknown model.
+    """
     # if query is empty, return empty response
-    your_query = request.form.get('query')
-    if your_query == "":
-        return jsonify({
-            'url': "",
-            'score': 0,
-            'response': "Please specify a query!"
-        })
-    
+    your_query = form.get('query')
+    if not your_query:
+        return error_response("Please specify a query!"), None, None
+
     # get model from form and check if allowed
-    model = request.form.get('model')
+    model = form.get('model')
     if model not in allowed_models:
-        return jsonify({
-            'url': "",
-            'score': 0,
-            'response': "Invalid model. Please try again."
-        })    
+        return error_response("Invalid model. Please try again."), None, None
+    return None, your_query, model
 
-    # default max tokens for reply is higher for gpt-4
-    max_tokens = 250
-    if model == "gpt-4":
-        max_tokens = 1024
 
-    # vectorize query
+def prepare_query(form, timings):
+    """
+    Validates the form, searches the vector store and builds the chat
+    request. Returns (error, url, score, request, cached); error is a
+    response dict when the query cannot be answered. cached describes the
+    query for the answer cache (see remember_answer); its "answer" is set
+    and request is None when a similar question over the same sources was
+    answered before. Every stage is timed with timings.
+    """
+    error, your_query, model = read_form(form)
+    if error is not None:
+        return error, None, 0, None, None
+    timings.labels['model'] = model
+
+    max_tokens = reply_tokens(model)
+
+    # vectorize query; repeated queries come from the query cache
     try:
-        query_vector = openai.Embedding.create(
-            input=your_query,
-            model="text-embedding-ada-002"
-        )["data"][0]["embedding"]
+        with timings.stage('embed'):
+            query_vector = embed_query(your_query)
     except Exception as e:
         logging.error("Error calling OpenAI Embedding API: ", exc_info=True)
+        return error_response("Error calling OpenAI Embedding API. Please try again."), None, 0, None, None
 
-    # query with pinecone
-    search_response = []
-    search_response = index.query(
-        top_k=5,
-        vector=query_vector,
-        include_metadata=True)
+    # query the vector store
+    with timings.stage('search'):
+        search_response = index.query(
+            top_k=5,
+            vector=query_vector,
+            include_metadata=True)
     
     # log search response for debugging
     logging.debug("Search response: %s", search_response)
@@ -85,64 +143,198 @@ def query():
 
     # if url is empty, return empty response
     if url == "":
-        return jsonify({
-            'url': "",
-            'score': 0.0,
-            'response': "Only found low scoring results. Please try a different query."
-        })
+        return error_response("Only found low scoring results. Please try a different query.", 0.0), None, 0, None, None
 
     logging.debug("Highest score url: %s", url)
 
-    try:
-        # get article from url and parse HTML
-        r = requests.get(url)
-        soup = BeautifulSoup(r.text, 'html.parser')
+    cached = answer_cache_entry(query_vector, model, search_response['matches'])
+    if answer_cache is not None:
+        with timings.stage('answer_cache'):
+            cached['answer'] = answer_cache.get(query_vector, model, cached['source_ids'])
+        if cached['answer'] is not None:
+            logging.debug("Answer cache hit: %s", answer_cache.stats())
+            return None, url, score, None, cached
 
-        # do not grab the entire HTML
-        article = soup.find('div', {'class': 'entry-content'}).text
+    try:
+        # get article text from the local document store; the page is
+        # only fetched and parsed when it was never ingested
+        with timings.stage('article'):
+            article = get_article(url)
     except Exception as e:
         logging.error("Error getting article: ", exc_info=True)
-        return jsonify({
-            'url': "",
-            'score': 0,
-            'response': "Error getting article. Please try again."
-        })
+        return error_response("Error getting article. Please try again."), None, 0, None, None
+
+    with timings.stage('context'):
+        chat_request = build_chat_request(your_query, model, max_tokens, url, article, search_response['matches'])
+    return None, url, score, chat_request, cached
+
+
+def reply_tokens(model):
+    # default max tokens for reply is higher for gpt-4
+    max_tokens = 250
+    if model == "gpt-4":
+        max_tokens = 1024
+    return max_tokens
+
+
+def answer_cache_entry(query_vector, model, matches):
+    # the answer depends on the model and on the retrieved chunks; a cached
+    # answer is only reused when both are the same
+    return {
+        'query_vector': query_vector,
+        'model': model,
+        'source_ids': [match["id"] for match in matches],
+        'urls': {(match.get("metadata") or {}).get("url") for match in matches} - {None},
+        'answer': None
+    }
+
+
+def build_chat_request(your_query, model, max_tokens, url, article, matches):
+    """
+    Returns the chat completion request that answers your_query from the
+    article at url.
+    """
+    # the article is cut to the tokens the model has left after the
+    # instructions and the reply; when it does not fit and the index has
+    # chunk texts, the best matching chunks of the page are used instead
+    instructions = "Answer me only if the article below the --- is relevant to the question. If not relevant say so and provide an answer beyond the article. If you answer beyond the article, say so. If relevant, answer in detail and with bullet points. Here is my question: " + your_query
+    system = "You are an assistant that only provides relevant answers."
+    budget = context_budget(model, max_tokens, system + instructions)
+    context = fit_text(article, budget)
+    if context != article:
+        page_matches = [match for match in matches if (match.get("metadata") or {}).get("url") == url]
+        if any("text" in match["metadata"] for match in page_matches):
+            context, _ = pack_context(page_matches, budget)
+    logging.debug("Context: %d of %d tokens", tiktoken_len(context), budget)
+
+    # model is set by user; ensure openai key allows gpt-4 use
+    return dict(
+        model=model,
+        messages=[
+            { "role": "system", "content": system },
+            { "role": "user", "content": instructions + "\n---\n" + context }
+        ],
+        temperature=0,
+        max_tokens=max_tokens
+    )
+
+
+def remember_answer(cached, answer):
+    # store a generated answer for similar questions over the same sources
+    if answer_cache is not None and answer:
+        answer_cache.put(cached['query_vector'], cached['model'], cached['source_ids'], cached['urls'], answer)
+
+
+def timed_response(body, timings, form):
+    # closes the request's timings and adds them to the response if asked
+    timings.finish()
+    if wants_timings(form):
+        body = dict(body, timings=timings.as_dict())
+    return body
+
+
+def prompt_tokens(chat_request):
+    return sum(tiktoken_len(message["content"]) for message in chat_request["messages"])
+
+
+# respond to submit button
+@app.route('/query', methods=['POST'])
+def query():
+    timings = Timings(metrics, route='query')
+    error, url, score, chat_request, cached = prepare_query(request.form, timings)
+    if error is not None:
+        return jsonify(timed_response(error, timings, request.form))
+
+    if cached['answer'] is not None:
+        return jsonify(timed_response({
+            'url': url,
+            'score': score,
+            'response': f"\n{cached['answer']}"
+        }, timings, request.form))
 
     try:
-        # call openai completion, model is set by user
-        # ensure openai key allows gpt-4 use
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                { "role": "system", "content": "You are an assistant that only provides relevant answers." },
-                { "role": "user", "content": "Answer me only if the article below the --- is relevant to the question. If not relevant say so and provide an answer beyond the article. If you answer beyond the article, say so. If relevant, answer in detail and with bullet points. Here is my question: " + your_query +
-                     "\n---\n" + article }
-                   
-            ],
-            temperature=0,
-            max_tokens=max_tokens
-
-        )
-
-        response_text=f"\n{response.choices[0]['message']['content']}"
+        # call openai completion
+        with timings.stage('completion'):
+            response = openai.ChatCompletion.create(**chat_request)
+
+        answer = response.choices[0]['message']['content']
+        response_text=f"\n{answer}"
     except Exception as e:
         logging.error(f"Error with OpenAI Completion: {e}", exc_info=True)
-        return jsonify({
-            'url': "",
-            'score': 0.0,
-            'response': "Error with OpenAI Completion. Please try a different query."
-        })
+        return jsonify(timed_response(error_response("Error with OpenAI Completion. Please try a different query.", 0.0), timings, request.form))
+
+    usage = response.get('usage') or {}
+    count_tokens(chat_request['model'], usage.get('prompt_tokens', prompt_tokens(chat_request)), usage.get('completion_tokens', tiktoken_len(answer)))
+    remember_answer(cached, answer)
 
-    return jsonify({
+    return jsonify(timed_response({
         'url': url,
         'score': score,
         'response': response_text
+    }, timings, request.form))
+
+
+def sse(event, data):
+    # one server-sent event; data is JSON so newlines in tokens are safe
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# streaming variant of /query: server-sent events with the url and score
+# first, then the answer token by token as the model produces it
+@app.route('/query/stream', methods=['GET', 'POST'])
+def query_stream():
+    form = request.form if request.method == 'POST' else request.args
+
+    def generate():
+        timings = Timings(metrics, route='query_stream')
+        error, url, score, chat_request, cached = prepare_query(form, timings)
+        if error is not None:
+            yield sse('error', timed_response(error, timings, form))
+            return
+
+        yield sse('meta', {'url': url, 'score': score})
+
+        # a cached answer is sent as a single token
+        if cached['answer'] is not None:
+            yield sse('token', {'text': cached['answer']})
+            yield sse('done', timed_response({}, timings, form))
+            return
+
+        answer = ""
+        try:
+            # time to the first token and to the end of the answer
+            started = time.perf_counter()
+            for chunk in openai.ChatCompletion.create(stream=True, **chat_request):
+                # the first chunk only carries the role, the last one only the finish reason
+                delta = chunk.choices[0].get('delta', {}).get('content')
+                if delta:
+                    if not answer:
+                        timings.record('first_token', time.perf_counter() - started)
+                    answer += delta
+                    yield sse('token', {'text': delta})
+            timings.record('completion', time.perf_counter() - started)
+        except Exception as e:
+            logging.error(f"Error with OpenAI Completion: {e}", exc_info=True)
+            yield sse('error', timed_response(error_response("Error with OpenAI Completion. Please try a different query.", 0.0), timings, form))
+            return
+        count_tokens(chat_request['model'], prompt_tokens(chat_request), tiktoken_len(answer))
+        remember_answer(cached, answer)
+        yield sse('done', timed_response({}, timings, form))
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
     })
 
+
+# Prometheus scrape endpoint
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     log_level = os.getenv('LOG_LEVEL', 'ERROR').upper()
     logging.basicConfig(level=getattr(logging, log_level))
 
-    allowed_models = ["gpt-3.5-turbo", "gpt-4"]
-
     app.run(debug=True)
@@ -0,0 +1,267 @@
+"""
+Async serving mode of the web app, on aiohttp.
+
+Serves the same routes as app.py (/, /query, /query/stream, /metrics) from
+one event loop, so a process keeps hundreds of queries in flight while they
+wait for OpenAI, the vector store or a page fetch. Outbound calls use
+pooled keep-alive clients: one aiohttp session for OpenAI (through
+openai's async API), one for article fetches, and the vector store's own
+connection pool, called from a bounded thread pool because its client is
+synchronous. Each upstream has a cap on in-flight calls:
+
+- WEBAPP_OPENAI_IN_FLIGHT (default 64): embedding and chat requests
+- WEBAPP_SEARCH_IN_FLIGHT (default 16): vector store queries
+- WEBAPP_FETCH_IN_FLIGHT (default 16): article fetches on a document store miss
+
+The steps of one query depend on each other (embedding, search, article,
+completion), so concurrency comes from serving many queries at once.
+
+Usage: python webapp/async_app.py [--host 127.0.0.1] [--port 5000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import jinja2
+import openai
+from aiohttp import web
+
+# the Flask app holds the shared query logic, vector store, caches and metrics
+from app import (index, answer_cache, metrics, read_form, error_response, get_highest_score_url, reply_tokens,
+                 answer_cache_entry, build_chat_request, remember_answer, timed_response, prompt_tokens,
+                 count_tokens, sse)
+from doc_store import get_document_store
+from embeddings import EMBEDDING_MODEL, tiktoken_len
+from extract import extract_article
+from metrics import Timings
+from query_cache import get_query_cache
+
+OPENAI_IN_FLIGHT = int(os.getenv('WEBAPP_OPENAI_IN_FLIGHT', 64))
+SEARCH_IN_FLIGHT = int(os.getenv('WEBAPP_SEARCH_IN_FLIGHT', 16))
+FETCH_IN_FLIGHT = int(os.getenv('WEBAPP_FETCH_IN_FLIGHT', 16))
+
+WEBAPP = pathlib.Path(__file__).resolve().parent
+templates = jinja2.Environment(loader=jinja2.FileSystemLoader(str(WEBAPP / "templates")), autoescape=True)
+
+
+async def embed(app, query):
+    # the query embedding cache is shared with the Flask app; its lookups
+    # can read from disk, so they run off the event loop
+    cache = get_query_cache()
+    vector = await asyncio.to_thread(cache.get, EMBEDDING_MODEL, query)
+    if vector is None:
+        async with app['openai_slots']:
+            response = await openai.Embedding.acreate(input=query, model=EMBEDDING_MODEL)
+        vector = response["data"][0]["embedding"]
+        await asyncio.to_thread(cache.put, EMBEDDING_MODEL, query, vector)
+    return vector
+
+
+async def search(app, vector):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app['search_pool'], lambda: index.query(top_k=5, vector=vector, include_metadata=True))
+
+
+async def fetch_article(app, url):
+    # like doc_store.get_article, with the page fetched on the event loop
+    store = get_document_store()
+    article = await asyncio.to_thread(store.get, url)
+    if article is not None:
+        return article
+
+    logging.debug("Document store miss, fetching %s", url)
+    async with app['fetch_session'].get(url) as r:
+        # an error page must not be stored as the article
+        r.raise_for_status()
+        html = await r.text()
+    article = await asyncio.to_thread(extract_article, html)
+    await asyncio.to_thread(store.put, url, article)
+    return article
+
+
+async def prepare_query(app, form, timings):
+    """
+    Async version of app.prepare_query, with the same return value.
+    """
+    error, your_query, model = read_form(form)
+    if error is not None:
+        return error, None, 0, None, None
+    timings.labels['model'] = model
+
+    try:
+        with timings.stage('embed'):
+            query_vector = await embed(app, your_query)
+    except Exception as e:
+        logging.error("Error calling OpenAI Embedding API: ", exc_info=True)
+        return error_response("Error calling OpenAI Embedding API. Please try again."), None, 0, None, None
+
+    with timings.stage('search'):
+        search_response = await search(app, query_vector)
+    logging.debug("Search response: %s", search_response)
+
+    url, score = get_highest_score_url(search_response['matches'])
+    if url == "":
+        return error_response("Only found low scoring results. Please try a different query.", 0.0), None, 0, None, None
+
+    cached = answer_cache_entry(query_vector, model, search_response['matches'])
+    if answer_cache is not None:
+        with timings.stage('answer_cache'):
+            # get() reads the invalidation log first
+            cached['answer'] = await asyncio.to_thread(answer_cache.get, query_vector, model, cached['source_ids'])
+        if cached['answer'] is not None:
+            return None, url, score, None, cached
+
+    try:
+        with timings.stage('article'):
+            article = await fetch_article(app, url)
+    except Exception as e:
+        logging.error("Error getting article: ", exc_info=True)
+        return error_response("Error getting article. Please try again."), None, 0, None, None
+
+    with timings.stage('context'):
+        # fitting the context tokenizes the article, off the event loop
+        chat_request = await asyncio.to_thread(build_chat_request, your_query, model, reply_tokens(model), url, article,
+                                               search_response['matches'])
+    return None, url, score, chat_request, cached
+
+
+async def home(request):
+    html = templates.get_template('index.html').render(url_for=lambda endpoint, filename: f"/static/{filename}")
+    return web.Response(text=html, content_type='text/html')
+
+
+async def query(request):
+    form = await request.post()
+    timings = Timings(metrics, route='query')
+    error, url, score, chat_request, cached = await prepare_query(request.app, form, timings)
+    if error is not None:
+        return web.json_response(timed_response(error, timings, form))
+
+    if cached['answer'] is not None:
+        return web.json_response(timed_response({'url': url, 'score': score, 'response': f"\n{cached['answer']}"}, timings, form))
+
+    try:
+        with timings.stage('completion'):
+            async with request.app['openai_slots']:
+                response = await openai.ChatCompletion.acreate(**chat_request)
+        answer = response.choices[0]['message']['content']
+    except Exception as e:
+        logging.error(f"Error with OpenAI Completion: {e}", exc_info=True)
+        return web.json_response(timed_response(error_response("Error with OpenAI Completion. Please try a different query.", 0.0), timings, form))
+
+    usage = response.get('usage') or {}
+    if 'prompt_tokens' in usage and 'completion_tokens' in usage:
+        counts = usage['prompt_tokens'], usage['completion_tokens']
+    else:
+        # counting with tiktoken tokenizes the whole prompt, off the event loop
+        counts = await asyncio.to_thread(lambda: (usage.get('prompt_tokens') or prompt_tokens(chat_request),
+                                                  usage.get('completion_tokens') or tiktoken_len(answer)))
+    count_tokens(chat_request['model'], *counts)
+    await asyncio.to_thread(remember_answer, cached, answer)
+    return web.json_response(timed_response({'url': url, 'score': score, 'response': f"\n{answer}"}, timings, form))
+
+
+async def query_stream(request):
+    form = await request.post() if request.method == 'POST' else request.query
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        # keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+
+    async def send(event, data):
+        await response.write(sse(event, data).encode('utf-8'))
+
+    timings = Timings(metrics, route='query_stream')
+    error, url, score, chat_request, cached = await prepare_query(request.app, form, timings)
+    if error is not None:
+        await send('error', timed_response(error, timings, form))
+        return response
+
+    await send('meta', {'url': url, 'score': score})
+    if cached['answer'] is not None:
+        await send('token', {'text': cached['answer']})
+        await send('done', timed_response({}, timings, form))
+        return response
+
+    answer = ""
+    try:
+        started = time.perf_counter()
+        # the slot is held until the answer is complete
+        async with request.app['openai_slots']:
+            async for chunk in await openai.ChatCompletion.acreate(stream=True, **chat_request):
+                delta = chunk.choices[0].get('delta', {}).get('content')
+                if delta:
+                    if not answer:
+                        timings.record('first_token', time.perf_counter() - started)
+                    answer += delta
+                    await send('token', {'text': delta})
+        timings.record('completion', time.perf_counter() - started)
+    except Exception as e:
+        logging.error(f"Error with OpenAI Completion: {e}", exc_info=True)
+        await send('error', timed_response(error_response("Error with OpenAI Completion. Please try a different query.", 0.0), timings, form))
+        return response
+
+    # streamed responses have no usage; count with tiktoken off the event loop
+    count_tokens(chat_request['model'], *await asyncio.to_thread(lambda: (prompt_tokens(chat_request), tiktoken_len(answer))))
+    await asyncio.to_thread(remember_answer, cached, answer)
+    await send('done', timed_response({}, timings, form))
+    return response
+
+
+async def metrics_endpoint(request):
+    return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+
+@web.middleware
+async def openai_session(request, handler):
+    # openai's async API reuses the pooled session of this context
+    openai.aiosession.set(request.app['openai_session'])
+    return await handler(request)
+
+
+async def start_clients(app):
+    app['openai_session'] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=OPENAI_IN_FLIGHT))
+    app['fetch_session'] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=FETCH_IN_FLIGHT),
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+    app['openai_slots'] = asyncio.Semaphore(OPENAI_IN_FLIGHT)
+    app['search_pool'] = ThreadPoolExecutor(max_workers=SEARCH_IN_FLIGHT, thread_name_prefix='search')
+
+
+async def close_clients(app):
+    await app['openai_session'].close()
+    await app['fetch_session'].close()
+    app['search_pool'].shutdown(wait=False)
+
+
+def create_app():
+    app = web.Application(middlewares=[openai_session])
+    app.on_startup.append(start_clients)
+    app.on_cleanup.append(close_clients)
+    app.router.add_get('/', home)
+    app.router.add_post('/query', query)
+    app.router.add_route('GET', '/query/stream', query_stream)
+    app.router.add_route('POST', '/query/stream', query_stream)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_static('/static', str(WEBAPP / "static"))
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    log_level = os.getenv('LOG_LEVEL', 'ERROR').upper()
+    logging.basicConfig(level=getattr(logging, log_level))
+
+    web.run_app(create_app(), host=args.host, port=args.port)